@@ -1,16 +1,262 @@
 #!/usr/bin/env python3
 
-# Prerequisites: pip install pyetherchain
+# Prerequisites: pip install pyetherchain (only for --backend etherchain)
 #
-# usage: python3 get-bytecode.py <address>
+# usage: python3 get-bytecode.py [--backend etherchain|rpc|store] [--rpc-url <url>] [--store <dir>]
+#                                [--cache <dir>] [--offline] [--refresh] [-j <jobs>] [-o <dir>]
+#                                [-f <address file>] <address> ...
+#        python3 get-bytecode.py --serve <port> [--cache <dir>]
+#
+# Prints the code of each address: just the code for a single address, `<address> <code>` lines for several,
+# or with -o, writes <dir>/<address>.hex files.
+#
+# Backends:
+#   etherchain  EtherChain().account(address).code, one request per address
+#   rpc         eth_getCode on an Ethereum JSON-RPC endpoint, e.g. a local node, --batch-size addresses per request
+#   store       a bytecode store directory, in the format of the cache, without network access
+#
+# Fetched code is kept in the cache, a bytecode store in .build/bytecode-cache of the repository. Code is stored once
+# per code hash, code/<sha256>.hex, with one addresses/<address>.json file per address pointing to it. Addresses
+# found in the cache are never fetched again, unless --refresh is given; --offline only reads the cache.
+# Addresses are cached as soon as they are fetched; the ones that could not be fetched are reported at the end.
+# --serve answers eth_getCode from the cache on 127.0.0.1:<port>, a local stand-in for --backend rpc.
 
+import argparse
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
+import re
+import socketserver
 import sys
-from pyetherchain.pyetherchain import EtherChain
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+DEFAULT_CACHE = os.path.join(ROOT, '.build', 'bytecode-cache')
+
+address_pattern = re.compile(r'0x[0-9a-fA-F]{40}')
+
+
+class BytecodeStore:
+    """Code of addresses, stored once per code hash"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def address_file(self, address):
+        return os.path.join(self.path, 'addresses', address.lower() + '.json')
+
+    def code_file(self, code_hash):
+        return os.path.join(self.path, 'code', code_hash + '.hex')
+
+    def get(self, address):
+        try:
+            with open(self.address_file(address)) as f:
+                entry = json.load(f)
+            with open(self.code_file(entry['code_hash'])) as f:
+                return f.read().strip()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, address, code, source):
+        code_hash = hashlib.sha256(code.encode()).hexdigest()
+        write_atomic(self.code_file(code_hash), code + '\n')
+        entry = {'address': address.lower(), 'code_hash': code_hash, 'source': source, 'fetched': time.time()}
+        write_atomic(self.address_file(address), json.dumps(entry, indent=2, sort_keys=True) + '\n')
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# Every backend fetches one batch of addresses, and returns ({address: code}, [error message, ...]).
+def fetch_etherchain(addresses, args):
+    from pyetherchain.pyetherchain import EtherChain
+
+    codes = {}
+    errors = []
+    for address in addresses:
+        try:
+            codes[address] = EtherChain().account(address).code
+        except Exception as e:
+            errors.append('{}: {}'.format(address, e))
+    return (codes, errors)
+
+
+def fetch_rpc(addresses, args):
+    request = [{'jsonrpc': '2.0', 'id': i, 'method': 'eth_getCode', 'params': [address, 'latest']}
+               for (i, address) in enumerate(addresses)]
+    data = json.dumps(request).encode()
+    http_request = urllib.request.Request(args.rpc_url, data, {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request, timeout=60) as response:
+            replies = json.load(response)
+    except (OSError, ValueError) as e:
+        return ({}, ['{}: {}'.format(address, e) for address in addresses])
+    if not isinstance(replies, list):
+        return ({}, ['{}: {}'.format(address, replies.get('error', replies)) for address in addresses])
+    codes = {}
+    errors = []
+    for reply in replies:
+        address = addresses[reply['id']]
+        if 'error' in reply:
+            errors.append('{}: {}'.format(address, reply['error']))
+        else:
+            codes[address] = reply['result']
+    return (codes, errors)
+
+
+def fetch_store(addresses, args):
+    store = BytecodeStore(args.store)
+    codes = {}
+    errors = []
+    for address in addresses:
+        code = store.get(address)
+        if code is None:
+            errors.append('{}: not in {}'.format(address, args.store))
+        else:
+            codes[address] = code
+    return (codes, errors)
+
+
+backends = {
+    'etherchain': fetch_etherchain,
+    'rpc': fetch_rpc,
+    'store': fetch_store,
+}
+
+
+def read_addresses(args):
+    addresses = list(args.addresses)
+    for path in args.file or []:
+        with open(path) as f:
+            addresses.extend(address_pattern.findall(f.read()))
+    invalid = [address for address in addresses if not address_pattern.fullmatch(address)]
+    if invalid:
+        sys.exit('Not an address: ' + ', '.join(invalid))
+    # Duplicates are fetched once, in order of appearance.
+    return list(dict.fromkeys(address.lower() for address in addresses))
+
+
+def get_codes(addresses, args):
+    cache = BytecodeStore(args.cache)
+    codes = {}
+    if not args.refresh:
+        for address in addresses:
+            code = cache.get(address)
+            if code is not None:
+                codes[address] = code
+    missing = [address for address in addresses if address not in codes]
+    if missing and args.offline:
+        sys.exit('Not in the cache {}: {}'.format(args.cache, ', '.join(missing)))
+    # Batches are cached as they complete, so that the addresses fetched before a failure are not fetched again.
+    batch_size = args.batch_size if args.backend == 'rpc' else 1
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(backends[args.backend], batch, args) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            (fetched, batch_errors) = future.result()
+            for (address, code) in fetched.items():
+                cache.put(address, code, args.backend)
+            codes.update(fetched)
+            errors.extend(batch_errors)
+    if errors:
+        sys.exit('Could not fetch bytecode of {} addresses:\n  {}'.format(len(errors), '\n  '.join(sorted(errors))))
+    return codes
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """JSON-RPC endpoint answering eth_getCode from a bytecode store"""
+
+    store = None
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        except (ValueError, TypeError):
+            self.reply({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': 'Parse error'}})
+            return
+        if isinstance(request, list):
+            self.reply([self.answer(call) for call in request])
+        else:
+            self.reply(self.answer(request))
+
+    def answer(self, call):
+        reply = {'jsonrpc': '2.0', 'id': call.get('id')}
+        if call.get('method') != 'eth_getCode':
+            reply['error'] = {'code': -32601, 'message': 'Method not found'}
+            return reply
+        code = self.store.get(call['params'][0])
+        if code is None:
+            reply['error'] = {'code': -32000, 'message': 'Unknown address ' + call['params'][0]}
+        else:
+            reply['result'] = code
+        return reply
+
+    def reply(self, value):
+        data = json.dumps(value).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(args):
+    StandInHandler.store = BytecodeStore(args.cache)
+    server = ThreadingHTTPServer(('127.0.0.1', args.serve), StandInHandler)
+    print('Serving eth_getCode from {} on http://127.0.0.1:{}'.format(args.cache, args.serve), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
-    address = sys.argv[1]
-    print(EtherChain().account(address).code)
+    parser = argparse.ArgumentParser(description='Get the bytecode of contract addresses.')
+    parser.add_argument('addresses', nargs='*', metavar='address')
+    parser.add_argument('-f', '--file', action='append', help='file to read addresses from, e.g. a contract source')
+    parser.add_argument('--backend', choices=sorted(backends), default='etherchain', help='where code is fetched from')
+    parser.add_argument('--rpc-url', default='http://127.0.0.1:8545', help='JSON-RPC endpoint of --backend rpc')
+    parser.add_argument('--batch-size', type=int, default=100, help='addresses per JSON-RPC request')
+    parser.add_argument('--store', help='bytecode store directory of --backend store')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='bytecode cache directory')
+    parser.add_argument('--offline', action='store_true', help='only read the cache')
+    parser.add_argument('--refresh', action='store_true', help='fetch again addresses that are in the cache')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='concurrent requests')
+    parser.add_argument('-o', '--output-dir', help='write <address>.hex files to this directory')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve eth_getCode from the cache')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args)
+        return
+    if args.backend == 'store' and not args.store:
+        parser.error('--backend store requires --store')
+    addresses = read_addresses(args)
+    if not addresses:
+        parser.error('no address given')
+    codes = get_codes(addresses, args)
+
+    if args.output_dir:
+        for address in addresses:
+            write_atomic(os.path.join(args.output_dir, address + '.hex'), codes[address] + '\n')
+    elif len(addresses) == 1:
+        print(codes[addresses[0]])
+    else:
+        for address in addresses:
+            print(address, codes[address])
 
 
 if __name__ == '__main__':
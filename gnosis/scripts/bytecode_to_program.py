@@ -0,0 +1,278 @@
+# Decodes the runtime bytecode in a file generated by solc --bin-runtime into the <program> cell
+# printed by kprove, e.g. generated/gnosis-GnosisSafe-program-cell.txt:
+#   <program>
+#     0 |-> PUSH ( 1 , 128 )
+#     ...
+#   </program>
+# With the file generated by solc --asm for the same contract, it also writes an index from each PC
+# to the asm line and source location it was compiled from, so that a <pc> in a failed proof can be
+# looked up instead of searched for by hand (previously done with hex_to_decimal.py).
+
+# Usage: bytecode_to_program.py [--contract <name>] [--asm <asm file>] [--index <index file>]
+#                               [--pc <pc>] [-o <program file>] <hex file>
+# Without -o, the <program> cell is written to the standard output.
+# With --pc, only the instruction at <pc> is shown, with its asm line and source location.
+
+import argparse
+import bisect
+import re
+import sys
+
+from hex_to_decimal import opcodes
+
+# solc --asm name of every defined opcode byte. KEVM names are looked up in the opcodes table of hex_to_decimal.py.
+opcode_names = {
+    0x00: 'stop', 0x01: 'add', 0x02: 'mul', 0x03: 'sub', 0x04: 'div', 0x05: 'sdiv', 0x06: 'mod', 0x07: 'smod',
+    0x08: 'addmod', 0x09: 'mulmod', 0x0a: 'exp', 0x0b: 'signextend',
+    0x10: 'lt', 0x11: 'gt', 0x12: 'slt', 0x13: 'sgt', 0x14: 'eq', 0x15: 'iszero', 0x16: 'and', 0x17: 'or',
+    0x18: 'xor', 0x19: 'not', 0x1a: 'byte', 0x1b: 'shl', 0x1c: 'shr', 0x1d: 'sar',
+    0x20: 'sha3',
+    0x30: 'address', 0x31: 'balance', 0x32: 'origin', 0x33: 'caller', 0x34: 'callvalue', 0x35: 'calldataload',
+    0x36: 'calldatasize', 0x37: 'calldatacopy', 0x38: 'codesize', 0x39: 'codecopy', 0x3a: 'gasprice',
+    0x3b: 'extcodesize', 0x3c: 'extcodecopy', 0x3d: 'returndatasize', 0x3e: 'returndatacopy', 0x3f: 'extcodehash',
+    0x40: 'blockhash', 0x41: 'coinbase', 0x42: 'timestamp', 0x43: 'number', 0x44: 'difficulty', 0x45: 'gaslimit',
+    0x50: 'pop', 0x51: 'mload', 0x52: 'mstore', 0x53: 'mstore8', 0x54: 'sload', 0x55: 'sstore', 0x56: 'jump',
+    0x57: 'jumpi', 0x58: 'pc', 0x59: 'msize', 0x5a: 'gas', 0x5b: 'jumpdest',
+    0xf0: 'create', 0xf1: 'call', 0xf2: 'callcode', 0xf3: 'return', 0xf4: 'delegatecall', 0xf5: 'create2',
+    0xfa: 'staticcall', 0xfd: 'revert', 0xfe: 'invalid', 0xff: 'selfdestruct',
+}
+opcode_names.update((0x60 + i, 'push{}'.format(i + 1)) for i in range(32))
+opcode_names.update((0x80 + i, 'dup{}'.format(i + 1)) for i in range(16))
+opcode_names.update((0x90 + i, 'swap{}'.format(i + 1)) for i in range(16))
+opcode_names.update((0xa0 + i, 'log{}'.format(i)) for i in range(5))
+
+JUMPDEST = 0x5b
+PUSH1 = 0x60
+PUSH32 = 0x7f
+
+
+def kevm_name(name):
+    """KEVM name of an opcode. The <program> cell shows OR as EVMOR, which is not a K keyword.
+    """
+    return opcodes['evmor'] if name == 'or' else opcodes[name]
+
+
+class Instruction:
+
+    def __init__(self, pc, opcode, push_size=0, value=None):
+        self.pc = pc
+        self.opcode = opcode
+        self.push_size = push_size
+        self.value = value
+
+    def name(self):
+        return opcode_names.get(self.opcode)
+
+    def kevm(self):
+        if self.push_size:
+            return 'PUSH ( {} , {} )'.format(self.push_size, self.value)
+        name = self.name()
+        if name is None:
+            return 'UNDEFINED ( {} )'.format(self.opcode)
+        return kevm_name(name)
+
+
+def read_bytecode(hex_path, contract=None):
+    """Read the runtime bytecode of contract, or of the first contract, from a solc --bin-runtime file.
+    Returns the contract header line and the bytecode.
+    """
+    header = None
+    with open(hex_path) as hex_file:
+        for line in hex_file:
+            line = line.strip()
+            if line.startswith('======='):
+                header = line
+            elif re.fullmatch(r'(0x)?[0-9a-fA-F]+', line) and (contract is None or header and contract in header):
+                return (header, bytes.fromhex(line[2:] if line.startswith('0x') else line))
+    sys.exit('No bytecode{} in {}'.format(' for ' + contract if contract else '', hex_path))
+
+
+def decode(bytecode):
+    """Decode bytecode into instructions. A PUSH at the end of the bytecode is padded with zeros, as KEVM does.
+    """
+    instructions = []
+    pc = 0
+    while pc < len(bytecode):
+        opcode = bytecode[pc]
+        if PUSH1 <= opcode <= PUSH32:
+            push_size = opcode - PUSH1 + 1
+            data = bytecode[pc + 1:pc + 1 + push_size]
+            value = int.from_bytes(data + bytes(push_size - len(data)), 'big')
+            instructions.append(Instruction(pc, opcode, push_size, value))
+            pc += 1 + push_size
+        else:
+            instructions.append(Instruction(pc, opcode))
+            pc += 1
+    return instructions
+
+
+def jump_destinations(instructions):
+    """PCs a JUMP or JUMPI may go to: JUMPDEST opcodes that are not PUSH data
+    """
+    return frozenset(instruction.pc for instruction in instructions if instruction.opcode == JUMPDEST)
+
+
+# An asm item: a name, optionally followed by arguments in parentheses.
+asm_item_pattern = re.compile(r'\s*([A-Za-z0-9_$.]+)\s*(\()?')
+asm_tag_pattern = re.compile(r'tag_\d+:')
+
+
+def expand_asm(text):
+    """Expand a line of solc --asm code into the names of its instructions in execution order.
+    Arguments of functional instructions, like mstore(0x40, 0x80), are pushed last to first.
+    Literals, tags and other items that are not opcodes, like dataSize(sub_0), are a single push.
+    """
+    (names, end) = expand_asm_item(text, 0)
+    if text[end:].strip():
+        raise ValueError('cannot parse asm: ' + text)
+    return names
+
+
+def expand_asm_item(text, pos):
+    match = asm_item_pattern.match(text, pos)
+    if match is None:
+        raise ValueError('cannot parse asm: ' + text)
+    (name, has_args) = match.groups()
+    pos = match.end()
+    args = []
+    if has_args:
+        while True:
+            while text[pos:pos + 1].isspace():
+                pos += 1
+            if text[pos:pos + 1] == ')':
+                pos += 1
+                break
+            (arg, pos) = expand_asm_item(text, pos)
+            args.append(arg)
+            while text[pos:pos + 1].isspace():
+                pos += 1
+            if text[pos:pos + 1] == ',':
+                pos += 1
+    if name not in opcodes:
+        return (['push'], pos)
+    names = [arg_name for arg in reversed(args) for arg_name in arg]
+    names.append(name)
+    return (names, pos)
+
+
+def read_asm(asm_path, header):
+    """Read the runtime code of the contract with the given header line from a solc --asm file.
+    Yields (line number, source location, instruction names) for every instruction line, in order.
+    """
+    with open(asm_path) as asm_file:
+        lines = asm_file.readlines()
+    start = 0
+    if header is not None:
+        start = next((i for (i, line) in enumerate(lines) if line.strip() == header), None)
+        if start is None:
+            sys.exit('{} is not in {}'.format(header, asm_path))
+    # The runtime code is the first sub-assembly of the deployment code.
+    runtime = next((i for i in range(start + 1, len(lines))
+                    if lines[i].strip().startswith('sub_0: assembly') or lines[i].startswith('=======')), None)
+    if runtime is not None and lines[runtime].strip().startswith('sub_0: assembly'):
+        start = runtime
+    location = None
+    for number in range(start + 1, len(lines)):
+        line = lines[number].strip()
+        if line.startswith('/*'):
+            location = line[2:-2].strip()
+            continue
+        # The code ends at its metadata, its own sub-assemblies, or the next contract.
+        if line.startswith('auxdata:') or line.startswith('sub_') or line.startswith('=======') or line == '}':
+            break
+        line = line.split('//', 1)[0].strip()
+        if not line or line == 'EVM assembly:':
+            continue
+        names = ['jumpdest'] if asm_tag_pattern.fullmatch(line) else expand_asm(line)
+        yield (number + 1, location, names)
+
+
+def same_instruction(instruction, asm_name):
+    if asm_name == 'push':
+        return instruction.push_size > 0
+    return instruction.name() is not None and kevm_name(instruction.name()) == kevm_name(asm_name)
+
+
+def asm_index(instructions, asm_path, header):
+    """Map the PC of every instruction to (asm line number, source location), by walking the asm code
+    and the decoded instructions side by side. Stops with a warning at the first mismatch.
+    """
+    index = {}
+    position = 0
+    for (number, location, names) in read_asm(asm_path, header):
+        for name in names:
+            if position >= len(instructions) or not same_instruction(instructions[position], name):
+                found = instructions[position].kevm() if position < len(instructions) else 'end of code'
+                print('Warning: asm line {} ({}) does not match {} at pc {}; PCs from there on are not indexed.'
+                      .format(number, name, found, instructions[position].pc if position < len(instructions) else '-'),
+                      file=sys.stderr)
+                return index
+            index[instructions[position].pc] = (number, location)
+            position += 1
+    return index
+
+
+def write_program(instructions, output):
+    output.write('<program>\n')
+    output.writelines('  {} |-> {}\n'.format(instruction.pc, instruction.kevm()) for instruction in instructions)
+    output.write('</program>\n')
+
+
+def write_index(instructions, destinations, index, index_path):
+    """Write one tab separated line per instruction: PC, instruction, J if it is a jump destination,
+    asm line number and source location
+    """
+    with open(index_path, 'w') as index_file:
+        index_file.write('# pc\tinstruction\tjumpdest\tasm line\tsource\n')
+        for instruction in instructions:
+            (number, location) = index.get(instruction.pc, ('', ''))
+            index_file.write('{}\t{}\t{}\t{}\t{}\n'.format(
+                instruction.pc, instruction.kevm(), 'J' if instruction.pc in destinations else '', number, location or ''))
+
+
+def show_pc(instructions, destinations, index, pc):
+    pcs = [instruction.pc for instruction in instructions]
+    position = bisect.bisect_right(pcs, pc) - 1
+    instruction = instructions[position] if position >= 0 else None
+    if instruction is None or pc >= instruction.pc + 1 + instruction.push_size:
+        sys.exit('No instruction at pc {}'.format(pc))
+    if instruction.pc != pc:
+        print('pc {} is inside the data of the instruction at pc {}'.format(pc, instruction.pc))
+    print('{} |-> {}'.format(instruction.pc, instruction.kevm()))
+    block = max((destination for destination in destinations if destination <= instruction.pc), default=0)
+    print('in the block starting at pc {}'.format(block))
+    if instruction.pc in index:
+        (number, location) = index[instruction.pc]
+        print('asm line {}'.format(number))
+        if location:
+            print('source {}'.format(location))
+
+
+def cli_runner():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('hex_file', help='File generated by solc --bin-runtime')
+    parser.add_argument('--contract', help='Contract to decode, e.g. GnosisSafe.sol:GnosisSafe; the first one by default')
+    parser.add_argument('--asm', help='File generated by solc --asm for the same contract')
+    parser.add_argument('--index', help='Write the PC index to this file; requires --asm for asm lines')
+    parser.add_argument('--pc', type=int, help='Show the instruction at this PC instead of the <program> cell')
+    parser.add_argument('-o', '--output', help='Write the <program> cell to this file')
+    args = parser.parse_args()
+
+    (header, bytecode) = read_bytecode(args.hex_file, args.contract)
+    instructions = decode(bytecode)
+    destinations = jump_destinations(instructions)
+    index = asm_index(instructions, args.asm, header) if args.asm else {}
+
+    if args.index:
+        write_index(instructions, destinations, index, args.index)
+    if args.pc is not None:
+        show_pc(instructions, destinations, index, args.pc)
+    elif args.output:
+        with open(args.output, 'w') as output:
+            write_program(instructions, output)
+    else:
+        write_program(instructions, sys.stdout)
+
+
+if __name__ == '__main__':
+    cli_runner()
@@ -6,11 +6,17 @@
 # Adapted from:
 # https://codereview.stackexchange.com/questions/152752/read-hex-from-file-and-convert-to-decimal
 
-# Usage: hex_to_decimal.py <input file>
-# It generates an output file in the same directory.
+# Usage: hex_to_decimal.py [--stdout] [<input file or glob> ...]
+# For every input file <name>.<ext>, it generates <name>_converted.sol in the same directory,
+# or with --stdout, writes the converted files to the standard output.
+# Globs are expanded, with ** matching any number of directories, e.g. 'build/**/*.asm'.
+# Without input files, or with -, it converts the standard input to the standard output.
 
 import argparse
+import glob
 import os
+import re
+import sys
 
 opcodes = {
     'stop'          : 'STOP',
@@ -36,7 +42,11 @@ opcodes = {
     'xor'           : 'XOR',
     'not'           : 'NOT',
     'byte'          : 'BYTE',
+    'shl'           : 'SHL',
+    'shr'           : 'SHR',
+    'sar'           : 'SAR',
     'sha3'          : 'SHA3',
+    'keccak256'     : 'SHA3',
     'address'       : 'ADDRESS',
     'balance'       : 'BALANCE',
     'origin'        : 'ORIGIN',
@@ -50,6 +60,9 @@ opcodes = {
     'gasprice'      : 'GASPRICE',
     'extcodesize'   : 'EXTCODESIZE',
     'extcodecopy'   : 'EXTCODECOPY',
+    'returndatasize': 'RETURNDATASIZE',
+    'returndatacopy': 'RETURNDATACOPY',
+    'extcodehash'   : 'EXTCODEHASH',
     'blockhash'     : 'BLOCKHASH',
     'coinbase'      : 'COINBASE',
     'timestamp'     : 'TIMESTAMP',
@@ -143,6 +156,7 @@ opcodes = {
     'return'        : 'RETURN',
     'delegatecall'  : 'DELEGATECALL',
     'callblackbox'  : 'CALLBLACKBOX',
+    'create2'       : 'CREATE2',
     'staticcall'    : 'STATICCALL',
     'revert'        : 'REVERT',
     'invalid'       : 'INVALID',
@@ -150,59 +164,77 @@ opcodes = {
     'selfdestruct'  : 'SELFDESTRUCT',
 }
 
-# Limitation: out file should have an extension of 3 characters, like ".txt"
-def write_and_print_result(args, result):
-    """Write every result to the output file
-    and print each converted value
-    """
-    out_file = args['input_file'][:-4] + "_converted.sol"
-    with open(out_file, 'w') as output:
-        for converted in result:
-            output.write(converted)
+# Matches every line that may need converting: leading whitespace, then either a hex number, or an opcode
+# optionally followed by its arguments in parentheses, then trailing whitespace.
+line_pattern = re.compile(r'(\s*)(?:0x([0-9a-fA-F]+)|([a-z0-9]+)(\((?:.*\S)?)?)?\s*$')
+
+# Number of converted lines written at once
+BATCH_LINES = 4096
 
 
-def read_and_convert_file(args):
-    """Read the given input file and convert each hexadecimal value
-    to decimal value
+def convert(input_file, output):
+    """Convert each hexadecimal value to decimal, and each opcode to its KEVM form,
+    writing the lines to output as they are read
     """
-    result = []
-    with open(args['input_file']) as input_file:
-        for line in input_file:
-            # move trailing whitespaces to another string
-            cleaned_line = line.lstrip()  # removed trailing whitespaces
-            trimmed_line=cleaned_line.strip()
-            nr_spaces = len(line) - len(cleaned_line)
-            spaces = line[0:nr_spaces]
-
-            if cleaned_line.startswith('0x'):   # convert hex values
-                result.append(spaces + str(int(cleaned_line, 0)) + "\n")
-            elif trimmed_line in opcodes:       # convert opcodes
-                result.append(spaces + opcodes[trimmed_line] + "\n")
-            elif trimmed_line.find("(") != -1:
-                parenthese_pos = trimmed_line.find("(")
-                opcode = trimmed_line[:parenthese_pos]
-                rest = trimmed_line[parenthese_pos:]
-                if opcode in opcodes:
-                    result.append(spaces + opcodes[opcode] + rest + "\n")
-                else:
-                    result.append(line)
+    match = line_pattern.match
+    converted = []
+    append = converted.append
+    for line in input_file:
+        matched = match(line)
+        if matched is None:
+            append(line)
+        else:
+            (spaces, hex_value, opcode, rest) = matched.groups()
+            if hex_value is not None:
+                append(spaces + str(int(hex_value, 16)) + "\n")
+            elif opcode in opcodes:
+                append(spaces + opcodes[opcode] + (rest or "") + "\n")
             else:
-                result.append(line)
-    return result
+                append(line)
+        # Written in batches, as a write per line is slower than the conversion itself
+        if len(converted) >= BATCH_LINES:
+            output.write("".join(converted))
+            converted.clear()
+    output.write("".join(converted))
+
+
+def output_path(input_path):
+    return os.path.splitext(input_path)[0] + "_converted.sol"
+
+
+def expand_inputs(patterns):
+    """Expand globs; names that match nothing are kept, to be reported as missing
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else []
+        paths.extend(matches or [pattern])
+    return paths
 
 
 def cli_runner():
     parser = argparse.ArgumentParser()
-    parser.add_argument('input_file', type=str,
-                        help='The file to read the hexadecimal values from')
-    args = vars(parser.parse_args())
-
-    if not os.path.exists(args['input_file']):
-        print('Input file does not exist, please try again.')
-        return
+    parser.add_argument('input_files', nargs='*', metavar='input_file',
+                        help='Files or globs to read the hexadecimal values from; - or none for the standard input')
+    parser.add_argument('--stdout', action='store_true',
+                        help='Write to the standard output instead of <name>_converted.sol files')
+    args = parser.parse_args()
 
-    result = read_and_convert_file(args)
-    write_and_print_result(args, result)
+    missing = False
+    for input_path in expand_inputs(args.input_files or ['-']):
+        if input_path == '-':
+            convert(sys.stdin, sys.stdout)
+        elif not os.path.isfile(input_path):
+            print('Input file {} does not exist, please try again.'.format(input_path), file=sys.stderr)
+            missing = True
+        elif args.stdout:
+            with open(input_path) as input_file:
+                convert(input_file, sys.stdout)
+        else:
+            with open(input_path) as input_file, open(output_path(input_path), 'w') as output:
+                convert(input_file, output)
+    if missing:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
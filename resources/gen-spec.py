@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import re
 import configparser
+import functools
+import hashlib
 
 def app(specs, spec):
     if not specs:
@@ -26,42 +29,77 @@ def safe_get(config, section):
     else:
         return {}
 
+def parent_section(section):
+    return '-'.join(section.split('-')[:-1])
+
 def inherit_get(config, section):
-    if not section:
-        return safe_get(config, 'root')
-    else:
-        parent = inherit_get(config, '-'.join(section.split('-')[:-1]))
-        current = safe_get(config, section)
-        merged = merge_two_dicts(parent, current) # TODO: for Python 3.5 or higher: {**parent, **current}
-        for key in list(merged.keys()):
-            if key.startswith('+'):
-                merged[key[1:]] += merged[key]
-                del merged[key]
+    return make_inherit_resolver(config)(section)
+
+# Returns a function resolving the config inherited by a section along root -> a -> a-b -> a-b-c.
+# Every resolved prefix is cached, so sibling sections share their resolved parents.
+# The returned dicts are shared and must not be modified.
+def make_inherit_resolver(config):
+    resolved = {}
+    def resolve(section):
+        if section in resolved:
+            return resolved[section]
+        if not section:
+            merged = dict(safe_get(config, 'root'))
+        else:
+            parent = resolve(parent_section(section))
+            current = safe_get(config, section)
+            merged = merge_two_dicts(parent, current) # TODO: for Python 3.5 or higher: {**parent, **current}
+            for key in list(merged.keys()):
+                if key.startswith('+'):
+                    merged[key[1:]] += merged[key]
+                    del merged[key]
+        resolved[section] = merged
         return merged
+    return resolve
 
-def gen(spec_template, rule_template, spec_ini, spec_name, rule_name_list):
+# Leaf sections are the sections no other section inherits from, i.e. the candidate spec names.
+def leaf_sections(config):
+    sections = [section for section in config.sections() if section not in ('root', 'pgm')]
+    parents = set(parent_section(section) for section in sections)
+    return [section for section in sections if section not in parents]
+
+# Returns the list of (section, resolved config) of all leaf sections.
+def resolve_leaves(config):
+    inherit = make_inherit_resolver(config)
+    return [(section, inherit(section)) for section in leaf_sections(config)]
+
+def read_spec_ini(spec_ini):
     spec_config = configparser.ConfigParser(comment_prefixes=(';'))
     spec_config.read(spec_ini)
     if 'pgm' not in spec_config:
         print('''Must specify a "pgm" section in the .ini file.''')
         sys.exit(1)
-    pgm_config = spec_config['pgm']
+    return spec_config
+
+def gen_spec(spec_template, rule_template, pgm_config, inherit, spec_name, rule_name_list):
+    rule_segments = compile_template(rule_template)
     rule_spec_list = []
     for name in rule_name_list:
-        rule_spec = rule_template
-        for config in [ inherit_get(spec_config, name)
-                      , pgm_config
-                      ]:
-            rule_spec = subst_all(rule_spec, config)
-#           for key in config:
-#               rule_spec = subst(rule_spec, key, config[key].strip())
-        rule_spec = subst(rule_spec, "rulename", name)
+        configs = [ inherit(name)
+                  , pgm_config
+                  , {'rulename': name}
+                  ]
+        try:
+            rule_spec = expand(rule_segments, make_resolver(configs))
+        except TemplateError as e:
+            print("Error in rule {}: {}".format(name, e), file=sys.stderr)
+            sys.exit(1)
         rule_spec_list.append(rule_spec)
     delimeter = "\n"
     rules = delimeter.join(rule_spec_list)
     genspec = subst(spec_template, 'module', spec_name.upper())
     genspec = subst(genspec, 'rules', rules)
-    print(genspec)
+    return genspec
+
+def gen(spec_template, rule_template, spec_ini, spec_name, rule_name_list):
+    spec_config = read_spec_ini(spec_ini)
+    print(gen_spec(spec_template, rule_template, dict(spec_config['pgm']), make_inherit_resolver(spec_config),
+                   spec_name, rule_name_list))
 #   genspec = template
 #   for config in [ inherit_get(spec_config, name)
 #                 , {'module': name.upper()}
@@ -71,19 +109,148 @@ def gen(spec_template, rule_template, spec_ini, spec_name, rule_name_list):
 #           genspec = subst(genspec, key, config[key].strip())
 #   print(genspec)
 
-def subst_all(init_rule_spec, config):
-    rule_spec = init_rule_spec
-    for key in config:
-        rule_spec = subst(rule_spec, key, config[key].strip())
-    if rule_spec != init_rule_spec:
-        return subst_all(rule_spec, config)
+# Writes text to path only if the file content differs, so that unchanged specs keep their timestamps.
+def write_if_changed(path, text):
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            if f.read() == text:
+                return False
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+# Each batch spec is either <spec_name>, generating a spec with the single rule <spec_name>,
+# or <spec_name>=<rule_name>,<rule_name>,... listing the rules of the spec explicitly.
+def parse_batch_spec(batch_spec):
+    if '=' in batch_spec:
+        (spec_name, rule_names) = batch_spec.split('=', 1)
+        return (spec_name, rule_names.split(','))
     else:
-        return rule_spec
+        return (batch_spec, [batch_spec])
+
+def gen_batch(spec_template, rule_template, spec_ini, output_dir, batch_spec_list):
+    spec_config = read_spec_ini(spec_ini)
+    pgm_config = dict(spec_config['pgm'])
+    inherit = make_inherit_resolver(spec_config)
+    os.makedirs(output_dir, exist_ok=True)
+    for batch_spec in batch_spec_list:
+        (spec_name, rule_name_list) = parse_batch_spec(batch_spec)
+        genspec = gen_spec(spec_template, rule_template, pgm_config, inherit, spec_name, rule_name_list)
+        spec_file = os.path.join(output_dir, spec_name + "-spec.k")
+        if write_if_changed(spec_file, genspec + "\n"):
+            print("gen-spec: " + spec_file)
+
+# The fingerprint of a spec covers everything its generated text depends on: the templates, the spec name,
+# and for each of its rules the value of every placeholder the rule expansion actually used, as resolved
+# along the rule's section chain, the pgm section and {RULENAME}. Keys a spec does not use, and sections
+# it does not inherit from, do not affect it.
+def spec_fingerprint(spec_template, rule_template, pgm_config, inherit, spec_name, rule_name_list):
+    digest = hashlib.sha256()
+    for part in (spec_template, rule_template, spec_name):
+        digest.update(part.encode() + b"\0")
+    used_keys = set()
+    for name in rule_name_list:
+        used = {}
+        configs = [ inherit(name)
+                  , pgm_config
+                  , {'rulename': name}
+                  ]
+        try:
+            expand(compile_template(rule_template), make_resolver(configs, used))
+        except TemplateError as e:
+            print("Error in rule {}: {}".format(name, e), file=sys.stderr)
+            sys.exit(1)
+        digest.update(name.encode() + b"\0")
+        for key in sorted(used):
+            digest.update(key.encode() + b"=" + used[key].encode() + b"\0")
+        used_keys.update(used)
+    return (digest.hexdigest(), sorted(used_keys))
+
+# Writes <output_dir>/<spec_name>-spec.k.stamp for each batch spec, holding the spec fingerprint.
+# A stamp is only rewritten when the fingerprint changed, so make regenerates, and proves again,
+# only the specs whose inputs changed.
+def gen_stamps(spec_template, rule_template, spec_ini, output_dir, batch_spec_list):
+    spec_config = read_spec_ini(spec_ini)
+    pgm_config = dict(spec_config['pgm'])
+    inherit = make_inherit_resolver(spec_config)
+    os.makedirs(output_dir, exist_ok=True)
+    for batch_spec in batch_spec_list:
+        (spec_name, rule_name_list) = parse_batch_spec(batch_spec)
+        (fingerprint, used_keys) = spec_fingerprint(spec_template, rule_template, pgm_config, inherit,
+                                                    spec_name, rule_name_list)
+        stamp = "{}\nrules: {}\nkeys: {}\n".format(fingerprint, " ".join(rule_name_list), " ".join(used_keys))
+        stamp_file = os.path.join(output_dir, spec_name + "-spec.k.stamp")
+        if write_if_changed(stamp_file, stamp):
+            print("gen-spec: " + stamp_file)
+
+#
+# Template substitution engine
+#
+# A template is split once into literal text and {KEY} placeholders. A placeholder refers to the
+# .ini key `key` and is replaced by its (stripped) value, whose own placeholders are resolved
+# recursively. Each key is resolved at most once per rule, so a rule is expanded in a single pass.
+
+placeholder_pattern = re.compile(r"\{([A-Z0-9_+]+)\}")
+
+class TemplateError(Exception):
+    pass
+
+# Returns the list [literal, placeholder, literal, ..., literal]: placeholder names are at odd indices.
+@functools.lru_cache(maxsize=None)
+def compile_template(text):
+    return tuple(placeholder_pattern.split(text))
+
+def expand(segments, resolve):
+    return "".join(segment if i % 2 == 0 else resolve(segment) for (i, segment) in enumerate(segments))
+
+# configs: list of dicts, looked up in order; the first one defining a key wins.
+# If given, used collects the raw value of every key looked up.
+def make_resolver(configs, used=None):
+    resolved = {}
+    resolving = []
+    def resolve(placeholder):
+        if placeholder in resolved:
+            return resolved[placeholder]
+        if placeholder in resolving:
+            cycle = resolving[resolving.index(placeholder):] + [placeholder]
+            raise TemplateError("cyclic placeholder: " + " -> ".join("{" + p + "}" for p in cycle))
+        key = placeholder.lower()
+        config = next((config for config in configs if key in config), None)
+        if config is None:
+            raise TemplateError("undefined placeholder {" + placeholder + "}" +
+                                ("".join(" in {" + p + "}" for p in reversed(resolving))))
+        if used is not None:
+            used[key] = config[key]
+        resolving.append(placeholder)
+        value = expand(compile_template(config[key].strip()), resolve)
+        resolving.pop()
+        resolved[placeholder] = value
+        return value
+    return resolve
 
 if __name__ == '__main__':
-    if len(sys.argv) < 6:
-        print("usage: <cmd> <spec-template> <rule-template> <spec_ini> <spec_name> <rule_name_list>")
-        sys.exit(1)
-    spec_template = open(sys.argv[1], "r").read()
-    rule_template = open(sys.argv[2], "r").read()
-    gen(spec_template, rule_template, sys.argv[3], sys.argv[4], sys.argv[5:])
+    if len(sys.argv) >= 2 and sys.argv[1] == '--list':
+        if len(sys.argv) != 3:
+            print("usage: <cmd> --list <spec_ini>")
+            sys.exit(1)
+        for (section, _) in resolve_leaves(read_spec_ini(sys.argv[2])):
+            print(section)
+    elif len(sys.argv) >= 2 and sys.argv[1] in ('--batch', '--stamps'):
+        if len(sys.argv) < 7:
+            print("usage: <cmd> " + sys.argv[1] + " <output_dir> <spec-template> <rule-template> <spec_ini> <spec_name>[=<rule_name>,...] ...")
+            sys.exit(1)
+        spec_template = open(sys.argv[3], "r").read()
+        rule_template = open(sys.argv[4], "r").read()
+        if sys.argv[1] == '--batch':
+            gen_batch(spec_template, rule_template, sys.argv[5], sys.argv[2], sys.argv[6:])
+        else:
+            gen_stamps(spec_template, rule_template, sys.argv[5], sys.argv[2], sys.argv[6:])
+    else:
+        if len(sys.argv) < 6:
+            print("usage: <cmd> <spec-template> <rule-template> <spec_ini> <spec_name> <rule_name_list>")
+            sys.exit(1)
+        spec_template = open(sys.argv[1], "r").read()
+        rule_template = open(sys.argv[2], "r").read()
+        gen(spec_template, rule_template, sys.argv[3], sys.argv[4], sys.argv[5:])
@@ -1,10 +1,12 @@
+KPROVE_GROUP_RESOURCES:=$(abspath $(dir $(lastword $(MAKEFILE_LIST))))
+
 SUBCLEAN=$(addsuffix .clean,$(SUBDIRS))
 SUBCLEANDEPS=$(addsuffix .clean-deps,$(SUBDIRS))
 SUBDEPS=$(addsuffix .deps,$(SUBDIRS))
 SUBPROOF=$(addsuffix .proof,$(SUBDIRS))
 SUBTEST=$(addsuffix .test,$(SUBDIRS))
 
-.PHONY: all clean clean-deps deps split-proof-tests test $(SUBDIRS) $(SUBCLEAN) $(SUBCLEANDEPS) $(SUBDEPS) $(SUBPROOF) $(SUBTEST)
+.PHONY: all clean clean-deps deps split-proof-tests test proof-stats $(SUBDIRS) $(SUBCLEAN) $(SUBCLEANDEPS) $(SUBDEPS) $(SUBPROOF) $(SUBTEST)
 
 all: $(SUBDIRS)
 clean: $(SUBCLEAN)
@@ -31,6 +33,10 @@ $(SUBPROOF): %.proof:
 $(SUBTEST): %.test:
 	$(MAKE) -C $* test
 
+# Resource use of the proofs of all spec groups, see PROOF_STATS in kprove.mak
+proof-stats:
+	@python3 $(KPROVE_GROUP_RESOURCES)/proof_stats.py summary
+
 #
 # For Jenkins Build
 #
@@ -39,11 +45,19 @@ NPROCS?=1
 
 .PHONY: jenkins
 
-# K bug workaround: Because KEVM parse cache is shared between projects, rules with equal body but different attributes will collide.
-# That's why we need clean-kevm-cache below.
+# Proves the specs of all $(SUBDIRS) on one pool of $(NPROCS) workers, longest proofs first.
+# See schedule-proofs.py for how the shared KEVM parse cache is handled.
 jenkins:
-	set -e; \
-	for i in $(SUBDIRS); do \
-		$(MAKE) -C $$i clean-kevm-cache all; \
-		$(MAKE) -C $$i test -j$(NPROCS); \
-	done
+	python3 $(KPROVE_GROUP_RESOURCES)/schedule-proofs.py -j $(NPROCS) $(SUBDIRS)
+
+# Same, with the proofs shared between $(NPROCS) local workers and the workers of other hosts that connect to
+# port $(COORDINATOR_PORT), started there with `make proof-worker COORDINATOR=<this host>:<port> NPROCS=<n>`.
+COORDINATOR_PORT?=7420
+
+.PHONY: jenkins-coordinator proof-worker
+
+jenkins-coordinator:
+	python3 $(KPROVE_GROUP_RESOURCES)/schedule-proofs.py --listen 0.0.0.0:$(COORDINATOR_PORT) -j $(NPROCS) $(SUBDIRS)
+
+proof-worker:
+	python3 $(KPROVE_GROUP_RESOURCES)/schedule-proofs.py --worker $(COORDINATOR) -j $(NPROCS)
@@ -52,16 +52,32 @@ LOCAL_LEMMAS?=../resources/abstract-semantics-direct-gas.k ../resources/evm-dire
               ../resources/evm-data-map-concrete.k verification.k
 TMPLS?=module-tmpl.k spec-tmpl.k
 
+# Specs generated from $(SPEC_INI) by a single gen-spec.py batch run.
+# By default a spec contains the single rule of the same name.
+# A spec made of several rules lists them in SPEC_RULES.<spec-name>, e.g.
+#   SPEC_RULES.collectToken:=collectToken loop ds-math-mul
+GEN_SPEC_NAMES?=$(SPEC_NAMES)
+
 # additional options to kprove command
 KPROVE_OPTS?=
 KPROVE_OPTS+=$(EXT_KPROVE_OPTS)
 
 # Define variable DEBUG to enable debug options below
+# The Z3 queries in the output of a proof can then be analyzed with script/kprove_z3.py,
+# and added to the query corpus of script/kprove_smt.py, to be replayed against z3.
 # DEBUG=true
 ifdef DEBUG
 KPROVE_OPTS+=--debug-z3-queries --log-rules
 endif
 
+# Define variable Z3_CACHE to run z3 as a separate process memoized by script/kprove_smt.py (script/z3-shim/z3):
+# queries already answered, by any spec or an earlier run, are not solved again.
+# Z3_CACHE=true
+ifdef Z3_CACHE
+KPROVE_OPTS+=--z3-executable
+export PATH:=$(ROOT)/script/z3-shim:$(PATH)
+endif
+
 # Example: 10ms/10s/10m/10h
 TIMEOUT?=
 # Above format
@@ -106,20 +122,65 @@ ifneq ($(CONCRETE_RULES_FILE),)
   CONCRETE_RULES_OPT:=--concrete-rules $(shell cat $(CONCRETE_RULES_FILE) | tr '\n' ',')
 endif
 
+# Records wall time, CPU time, peak memory, process tree and exit status of every proof in
+# $(PROOF_STATS_FILE), and with DEBUG the number of Z3 queries (see proof_stats.py). Enable with
+#   make test KPROVE_PREFIX='$(PROOF_STATS)'
+# `make proof-stats` summarizes the records of all spec groups.
+PROOF_STATS_RUN:=python3 $(RESOURCES)/proof_stats.py
+PROOF_STATS_FILE?=$(SPECS_DIR)/$(SPEC_GROUP)/proof-stats.jsonl
+PROOF_STATS:=$(PROOF_STATS_RUN) run --out $(PROOF_STATS_FILE) --group $(SPEC_GROUP) \
+             --k-rev $(K_VERSION) --kevm-rev $(KEVM_VERSION) $(if $(DEBUG),--count-z3) --
+
 KPROVE_PREFIX?=
 
+# The remaining paths of failed proofs (--format-failures) can be indexed and searched with script/kprove_failures.py.
 KPROVE_OPTS_java:=--deterministic-functions --cache-func-optimized --format-failures --boundary-cells k,pc \
 				  --log-cells k,output,statusCode,localMem,pc,gas,wordStack,callData,accounts,memoryUsed,\#pc,\#result
 KPROVE_OPTS_haskell:=
 
-KPROVE:=$(KPROVE_PREFIX) $(K_BIN)/kprove -v --debug -d $(KEVM_BUILD_DIR) -m $(DEFINITION_MODULE) \
+# Directory passed to kprove -d. schedule-proofs.py points it to a per-group copy of $(KEVM_BUILD_DIR)
+# that links to the kompiled definition but has its own parse cache.
+KPROVE_DEFN_DIR?=$(KEVM_BUILD_DIR)
+
+KPROVE:=$(KPROVE_PREFIX) $(K_BIN)/kprove -v --debug -d $(KPROVE_DEFN_DIR) -m $(DEFINITION_MODULE) \
         --z3-impl-timeout 500 $(SHUTDOWN_WAIT_TIME_OPT) $(TIMEOUT_OPT) $(CONCRETE_RULES_OPT) \
         --no-exc-wrap --no-alpha-renaming \
         $(KPROVE_OPTS_$(K_BACKEND)) $(KPROVE_OPTS)
 
+# Records wall time, peak memory and outcome of every proof in the proof history (see proof_history.py).
+# Set RECORD_PROOF to empty to disable.
+PROOF_HISTORY:=python3 $(RESOURCES)/proof_history.py
+RECORD_PROOF?=$(PROOF_HISTORY) run --spec $< --k-rev $(K_VERSION) --kevm-rev $(KEVM_VERSION) --
+
+# Skips proofs that already passed with the same spec, lemmas, SMT prelude, kprove command and K/KEVM revisions
+# (see proof_cache.py). Set PROOF_CACHE to empty to always prove.
+PROOF_CACHE_RUN:=python3 $(RESOURCES)/proof_cache.py
+PROOF_CACHE?=$(PROOF_CACHE_RUN) run --spec $< --rev-file $(K_VERSION_FILE) --rev-file $(KEVM_VERSION_FILE) --
+
 KSERVER_LOG_FILE:=$(SPECS_DIR)/$(SPEC_GROUP)/kserver.log
+
+# With KSERVER_POOL_SIZE=N, proofs run on a pool of N warm kservers (see kserver_pool.py), started on first use or by
+# spawn-kserver, and kept until stop-kserver. Server <n> listens on KSERVER_POOL_BASE_PORT+<n> and logs to
+# $(KSERVER_LOG_FILE).<n>. A server is restarted after it crashes, after KSERVER_POOL_MAX_RUNS proofs, or when it
+# grows above KSERVER_POOL_MAX_RSS MB. Example: make test -j4 KSERVER_POOL_SIZE=4
+KSERVER_POOL_SIZE?=
+KSERVER_POOL_BASE_PORT?=2120
+KSERVER_POOL_MAX_RUNS?=0
+KSERVER_POOL_MAX_RSS?=0
+KSERVER_POOL:=python3 $(RESOURCES)/kserver_pool.py
+KSERVER_POOL_DIR:=$(SPECS_DIR)/$(SPEC_GROUP)/kserver-pool
+KSERVER_POOL_OPTS:=--size $(KSERVER_POOL_SIZE) --base-port $(KSERVER_POOL_BASE_PORT) --log $(KSERVER_LOG_FILE) \
+                   --max-runs $(KSERVER_POOL_MAX_RUNS) --max-rss $(KSERVER_POOL_MAX_RSS) --kserver '$(K_BIN)/kserver --port {port}'
+
+ifeq ($(KSERVER_POOL_SIZE),)
 SPAWN_KSERVER:=$(K_BIN)/kserver >> "$(KSERVER_LOG_FILE)" 2>&1 &
 STOP_KSERVER:=$(K_BIN)/stop-kserver || true
+KSERVER_POOL_RUN:=
+else
+SPAWN_KSERVER:=$(KSERVER_POOL) start --state-dir $(KSERVER_POOL_DIR) $(KSERVER_POOL_OPTS)
+STOP_KSERVER:=$(KSERVER_POOL) stop --state-dir $(KSERVER_POOL_DIR)
+KSERVER_POOL_RUN:=$(KSERVER_POOL) run --state-dir $(KSERVER_POOL_DIR) $(KSERVER_POOL_OPTS) --
+endif
 
 SPEC_LOCAL_DIR:=$(SPECS_DIR)/$(SPEC_GROUP)
 SPEC_FILES:=$(patsubst %,$(SPEC_LOCAL_DIR)/%-spec.k,$(SPEC_NAMES))
@@ -128,18 +189,36 @@ BASEDIR_LEMMAS_TIMESTAMP:=$(SPEC_BASEDIR)/basedir-lemmas.timestamp
 LOCAL_LEMMAS_TIMESTAMP:=$(SPEC_LOCAL_DIR)/lemmas.timestamp
 LEMMAS:=$(BASEDIR_LEMMAS_TIMESTAMP) $(LOCAL_LEMMAS_TIMESTAMP)
 
+COMMA:=,
+EMPTY:=
+SPACE:=$(EMPTY) $(EMPTY)
+GEN_SPEC_FILES:=$(patsubst %,$(SPEC_LOCAL_DIR)/%-spec.k,$(GEN_SPEC_NAMES))
+GEN_SPEC_TIMESTAMP:=$(SPEC_LOCAL_DIR)/gen-spec.timestamp
+GEN_SPEC_STAMP_FILES:=$(addsuffix .stamp,$(GEN_SPEC_FILES))
+GEN_SPEC_STAMPS_TIMESTAMP:=$(SPEC_LOCAL_DIR)/gen-spec-stamps.timestamp
+# gen-spec.py argument of the spec named $(1)
+GEN_SPEC_ARG=$(1)$(if $(SPEC_RULES.$(1)),=$(subst $(SPACE),$(COMMA),$(strip $(SPEC_RULES.$(1)))))
+GEN_SPEC_ARGS=$(foreach name,$(GEN_SPEC_NAMES),$(call GEN_SPEC_ARG,$(name)))
+GEN_SPEC_BATCH=python3 $(RESOURCES)/gen-spec.py --batch $(SPEC_LOCAL_DIR) $(TMPLS) $(SPEC_INI)
+GEN_SPEC_STAMPS=python3 $(RESOURCES)/gen-spec.py --stamps $(SPEC_LOCAL_DIR) $(TMPLS) $(SPEC_INI) $(GEN_SPEC_ARGS)
+# Names of the specs whose stamps are among the changed prerequisites
+GEN_SPEC_CHANGED=$(patsubst $(SPEC_LOCAL_DIR)/%-spec.k.stamp,%,$(filter %.stamp,$?))
+
 PANDOC_TANGLE_SUBMODULE:=$(ROOT)/.build/pandoc-tangle
 PANDOC_TANGLE_TIMESTAMP:=$(PANDOC_TANGLE_SUBMODULE)/submodule.timestamp
 TANGLER:=$(PANDOC_TANGLE_SUBMODULE)/tangle.lua
 LUA_PATH:=$(PANDOC_TANGLE_SUBMODULE)/?.lua;;
 export TANGLER
 export LUA_PATH
+# Number of lemma files tangled in parallel
+TANGLE_JOBS?=$(shell nproc 2>/dev/null || echo 1)
+TANGLE_CACHE:=python3 $(RESOURCES)/tangle_cache.py -j $(TANGLE_JOBS)
 
 #
 # Dependencies - Java Backend
 #
 
-.PHONY: all clean clean-deps clean-k clean-kevm clean-kevm-cache deps deps-tangle deps-k deps-kevm split-proof-tests test
+.PHONY: all clean clean-deps clean-k clean-kevm clean-kevm-cache clean-proof-cache deps deps-tangle deps-k deps-kevm split-proof-tests test estimate-test proof-stats print-proof-info kserver-status
 
 all: deps split-proof-tests
 
@@ -153,6 +232,8 @@ clean-kevm:
 	rm -rf $(KEVM_REPO_DIR)
 clean-kevm-cache:
 	rm -rf $(KEVM_BUILD_DIR)/driver-kompiled/cache.bin
+clean-proof-cache:
+	$(PROOF_CACHE_RUN) clean
 
 deps: deps-tangle deps-k deps-kevm
 deps-tangle: $(PANDOC_TANGLE_TIMESTAMP)
@@ -196,47 +277,77 @@ $(KEVM_REPO_DIR):
 # makes all these files non-intermediary
 split-proof-tests: $(SPEC_FILES) $(LEMMAS)
 
+# Lemmas are tangled through a cache shared by all spec groups; tangled lemmas are linked, plain .k lemmas copied
+# (see tangle_cache.py).
 $(BASEDIR_LEMMAS_TIMESTAMP): $(BASEDIR_LEMMAS) $(PANDOC_TANGLE_TIMESTAMP)
-	mkdir -p $(SPEC_BASEDIR)
-	#processing .k lemmas
-ifneq ($(wildcard $(BASEDIR_LEMMAS:.md=.k)),)
-	cp $(wildcard $(BASEDIR_LEMMAS:.md=.k)) $(SPEC_BASEDIR)
-endif
-	#processing .md lemmas
-	for i in $(wildcard $(BASEDIR_LEMMAS:.k=.md)); do \
-		pandoc --from markdown --to "$(TANGLER)" --metadata=code:".k" $$i > $(SPEC_BASEDIR)/"$$(basename $$i .md)".k; \
-	done
+	$(TANGLE_CACHE) --dest $(SPEC_BASEDIR) $(BASEDIR_LEMMAS)
 	touch $@
 
 $(LOCAL_LEMMAS_TIMESTAMP): $(LOCAL_LEMMAS) $(PANDOC_TANGLE_TIMESTAMP)
-	mkdir -p $(SPEC_LOCAL_DIR)
-	#processing .k local lemmas
-ifneq ($(wildcard $(LOCAL_LEMMAS:.md=.k)),)
-	cp $(wildcard $(LOCAL_LEMMAS:.md=.k)) $(SPEC_LOCAL_DIR)
-endif
-	#processing .md local lemmas
-	for i in $(wildcard $(LOCAL_LEMMAS:.k=.md)); do \
-		pandoc --from markdown --to "$(TANGLER)" --metadata=code:".k" $$i > $(SPEC_LOCAL_DIR)/"$$(basename $$i .md)".k; \
-	done
+	$(TANGLE_CACHE) --dest $(SPEC_LOCAL_DIR) $(LOCAL_LEMMAS)
 	touch $@
 
 ifneq ($(wildcard $(SPEC_INI:.ini=.md)),)
 $(SPEC_INI): $(SPEC_INI:.ini=.md) $(PANDOC_TANGLE_TIMESTAMP)
-	pandoc --from markdown --to "$(TANGLER)" --metadata=code:".ini" $< > $@
+	$(TANGLE_CACHE) --code .ini -o $@ $<
 endif
 
 # When building a -spec.k file, build all run dependencies.
 $(SPECS_DIR)/$(SPEC_GROUP)/%-spec.k: $(TMPLS) $(SPEC_INI) $(LEMMAS)
 	python3 $(RESOURCES)/gen-spec.py $(TMPLS) $(SPEC_INI) $* $* > $@
 
+ifneq ($(strip $(GEN_SPEC_NAMES)),)
+# Fingerprints all $(GEN_SPEC_NAMES) in one run, parsing $(SPEC_INI) and $(TMPLS) once. A fingerprint covers
+# only the sections a spec inherits from and the keys its rules use (see gen-spec.py), and its stamp
+# <spec>-spec.k.stamp is only rewritten when it changed. Editing one section thus dates only the stamps
+# of the specs that inherit from it.
+$(GEN_SPEC_STAMPS_TIMESTAMP): $(TMPLS) $(SPEC_INI)
+	$(GEN_SPEC_STAMPS)
+	touch $@
+
+# Stamps deleted after the fingerprint run are rewritten.
+$(GEN_SPEC_STAMP_FILES): $(GEN_SPEC_STAMPS_TIMESTAMP)
+	@test -f $@ || $(GEN_SPEC_STAMPS)
+
+# Regenerates the specs whose stamps changed, in one run.
+# Only spec files whose content changed are rewritten, so the others keep their timestamps.
+$(GEN_SPEC_TIMESTAMP): $(GEN_SPEC_STAMP_FILES) $(LEMMAS)
+	$(if $(GEN_SPEC_CHANGED),$(GEN_SPEC_BATCH) $(foreach name,$(GEN_SPEC_CHANGED),$(call GEN_SPEC_ARG,$(name))))
+	touch $@
+
+# Spec files deleted after the batch run are regenerated.
+$(GEN_SPEC_FILES): $(GEN_SPEC_TIMESTAMP)
+	@test -f $@ || $(GEN_SPEC_BATCH) $(call GEN_SPEC_ARG,$(patsubst $(SPEC_LOCAL_DIR)/%-spec.k,%,$@))
+endif
+
 #
 # Kprove
 #
 
-test: $(addsuffix .test,$(SPEC_FILES))
+# With -j, make starts the proofs in the order of the prerequisites: longest expected proof first.
+ifneq ($(filter test,$(MAKECMDGOALS)),)
+TEST_SPEC_FILES:=$(or $(shell $(PROOF_HISTORY) order $(SPEC_FILES)),$(SPEC_FILES))
+else
+TEST_SPEC_FILES:=$(SPEC_FILES)
+endif
+
+test: $(addsuffix .test,$(TEST_SPEC_FILES))
 
 $(SPECS_DIR)/$(SPEC_GROUP)/%-spec.k.test: $(SPECS_DIR)/$(SPEC_GROUP)/%-spec.k
-	$(KPROVE) $<
+	$(PROOF_CACHE) $(RECORD_PROOF) $(KSERVER_POOL_RUN) $(KPROVE) $<
+
+# Expected time of `make test` according to the proof history. Example: make estimate-test JOBS=4
+JOBS?=1
+estimate-test:
+	@$(PROOF_HISTORY) estimate -j $(JOBS) $(SPEC_FILES)
+
+proof-stats:
+	@$(PROOF_STATS_RUN) summary $(ROOT)/specs
+
+# Read by schedule-proofs.py
+print-proof-info:
+	@echo "KEVM_BUILD_DIR=$(KEVM_BUILD_DIR)"
+	@echo "SPEC_FILES=$(SPEC_FILES)"
 
 spawn-kserver:
 	mkdir -p "$(dir $(KSERVER_LOG_FILE))"
@@ -244,3 +355,6 @@ spawn-kserver:
 
 stop-kserver:
 	$(STOP_KSERVER)
+
+kserver-status:
+	@$(KSERVER_POOL) status --state-dir $(KSERVER_POOL_DIR)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+# Pool of warm kserver instances, so that proofs do not pay JVM startup and definition loading.
+#
+# usage: kserver_pool.py start --state-dir <dir> <pool options> --kserver '<kserver command with {port}>'
+#        kserver_pool.py run --state-dir <dir> [<pool options> --kserver '<command>'] [--port-env <var>] -- <command> ...
+#        kserver_pool.py status --state-dir <dir>
+#        kserver_pool.py stop --state-dir <dir>
+# pool options: --size <n> [--base-port <port>] [--log <file>] [--max-runs <n>] [--max-rss <MB>]
+#
+# `start` starts <n> servers on the ports <port> ... <port>+<n>-1, each logging to <file>.<slot>.
+# `run` takes an idle server, runs the command with the port of the server in $<var> (NAILGUN_PORT by default,
+# which the nailgun client of kprove connects to), and gives the server back. Slots are taken with a lock file
+# each, so concurrent `run`s (make -j) never share a server; when all servers are busy, `run` waits.
+# Given the pool options, `run` creates the pool if needed and starts servers as they are first used;
+# without them and without a started pool, the command is run directly.
+# A server that died or stopped accepting connections is restarted before it is used. A server is also
+# restarted after <max-runs> proofs or when it grows above <max-rss> MB, to contain leaks.
+# See KSERVER_POOL_SIZE in kprove.mak.
+
+import argparse
+import fcntl
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+POOL_FILE = 'pool.json'
+# Seconds a starting server gets to accept connections
+START_TIMEOUT = 120
+# Seconds between attempts to take a slot when all servers are busy
+WAIT_INTERVAL = 0.5
+
+
+class ServerError(Exception):
+    pass
+
+
+def slot_file(state_dir, slot, suffix):
+    return os.path.join(state_dir, 'slot-{}.{}'.format(slot, suffix))
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, value):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # A zombie has exited, but not been reaped by its parent.
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def accepts_connections(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=2):
+            return True
+    except OSError:
+        return False
+
+
+def rss_mb(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+
+def healthy(server):
+    return server is not None and alive(server['pid']) and accepts_connections(server['port'])
+
+
+def stop_server(server):
+    if server is not None and alive(server['pid']):
+        try:
+            os.killpg(server['pid'], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def start_server(pool, slot):
+    port = pool['base_port'] + slot
+    command = [arg.replace('{port}', str(port)) for arg in pool['command']]
+    log_file = '{}.{}'.format(pool['log'], slot)
+    os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+    with open(log_file, 'a') as log:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+    server = {'pid': process.pid, 'port': port, 'started': time.time(), 'runs': 0}
+    deadline = time.time() + START_TIMEOUT
+    while not accepts_connections(port):
+        if process.poll() is not None or time.time() > deadline:
+            stop_server(server)
+            raise ServerError('server {} did not start, see {}'.format(slot, log_file))
+        time.sleep(0.5)
+    return server
+
+
+# Restarts the server of a slot if it is not healthy, or if it served too many proofs or grew too big.
+# The caller holds the lock of the slot.
+def ensure_server(pool, state_dir, slot, recycle=False):
+    server = read_json(slot_file(state_dir, slot, 'json'))
+    if healthy(server):
+        if not recycle:
+            return server
+        if pool['max_runs'] and server['runs'] >= pool['max_runs']:
+            print('kserver_pool.py: restarting server {} after {} proofs'.format(slot, server['runs']), file=sys.stderr)
+        elif pool['max_rss'] and rss_mb(server['pid']) > pool['max_rss']:
+            print('kserver_pool.py: restarting server {} at {}MB'.format(slot, rss_mb(server['pid'])), file=sys.stderr)
+        else:
+            return server
+    elif server is not None:
+        print('kserver_pool.py: restarting server {}, which is down'.format(slot), file=sys.stderr)
+    stop_server(server)
+    server = start_server(pool, slot)
+    write_json(slot_file(state_dir, slot, 'json'), server)
+    return server
+
+
+# Takes the lock of an idle slot, waiting while all are busy. Returns (slot, open lock file).
+def acquire_slot(state_dir, size):
+    while True:
+        for slot in range(size):
+            lock = open(slot_file(state_dir, slot, 'lock'), 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return (slot, lock)
+            except BlockingIOError:
+                lock.close()
+        time.sleep(WAIT_INTERVAL)
+
+
+# Reads the pool of the state directory, creating it from the pool options if there is none.
+def open_pool(args):
+    pool_path = os.path.join(args.state_dir, POOL_FILE)
+    pool = read_json(pool_path)
+    if pool is not None or args.size is None:
+        return pool
+    if not args.kserver:
+        sys.exit('kserver_pool.py: no kserver command given')
+    os.makedirs(args.state_dir, exist_ok=True)
+    # Concurrent `run`s may all find no pool; the first one creates it.
+    with open(os.path.join(args.state_dir, 'pool.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        pool = read_json(pool_path)
+        if pool is None:
+            pool = {'size': args.size, 'base_port': args.base_port, 'command': shlex.split(args.kserver),
+                    'log': os.path.abspath(args.log or os.path.join(args.state_dir, 'kserver.log')),
+                    'max_runs': args.max_runs, 'max_rss': args.max_rss}
+            write_json(pool_path, pool)
+    return pool
+
+
+def start(args):
+    if args.size is None:
+        sys.exit('kserver_pool.py: --size is required')
+    pool = open_pool(args)
+    for slot in range(pool['size']):
+        with open(slot_file(args.state_dir, slot, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                server = ensure_server(pool, args.state_dir, slot)
+            except ServerError as e:
+                sys.exit('kserver_pool.py: ' + str(e))
+        print('kserver {} on port {} (pid {})'.format(slot, server['port'], server['pid']))
+
+
+def run(args):
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        sys.exit('kserver_pool.py: no command given')
+    pool = open_pool(args)
+    if pool is None:
+        os.execvp(command[0], command)
+    (slot, lock) = acquire_slot(args.state_dir, pool['size'])
+    with lock:
+        try:
+            server = ensure_server(pool, args.state_dir, slot, recycle=True)
+        except ServerError as e:
+            print('kserver_pool.py: {}; running without it'.format(e), file=sys.stderr)
+            lock.close()
+            os.execvp(command[0], command)
+        env = dict(os.environ, **{args.port_env: str(server['port'])})
+        returncode = subprocess.call(command, env=env)
+        server['runs'] += 1
+        write_json(slot_file(args.state_dir, slot, 'json'), server)
+        # The next run restarts it anyway, but a crash is worth reporting next to the proof that caused it.
+        if not healthy(server):
+            print('kserver_pool.py: server {} died during the proof'.format(slot), file=sys.stderr)
+    sys.exit(returncode)
+
+
+def status(args):
+    pool = read_json(os.path.join(args.state_dir, POOL_FILE))
+    if pool is None:
+        print('No kserver pool in ' + args.state_dir)
+        return
+    for slot in range(pool['size']):
+        server = read_json(slot_file(args.state_dir, slot, 'json'))
+        if server is None:
+            print('kserver {}: not started'.format(slot))
+            continue
+        with open(slot_file(args.state_dir, slot, 'lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                busy = False
+            except BlockingIOError:
+                busy = True
+        print('kserver {} on port {} (pid {}): {}, {}, {} proofs, {}MB'.format(
+            slot, server['port'], server['pid'], 'healthy' if healthy(server) else 'down',
+            'busy' if busy else 'idle', server['runs'], rss_mb(server['pid'])))
+
+
+def stop(args):
+    pool = read_json(os.path.join(args.state_dir, POOL_FILE))
+    if pool is None:
+        return
+    for slot in range(pool['size']):
+        stop_server(read_json(slot_file(args.state_dir, slot, 'json')))
+        for suffix in ['json', 'lock']:
+            if os.path.exists(slot_file(args.state_dir, slot, suffix)):
+                os.remove(slot_file(args.state_dir, slot, suffix))
+    os.remove(os.path.join(args.state_dir, POOL_FILE))
+    if os.path.exists(os.path.join(args.state_dir, 'pool.lock')):
+        os.remove(os.path.join(args.state_dir, 'pool.lock'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage a pool of warm kserver instances.')
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    start_parser = subparsers.add_parser('start', help='start the servers')
+    run_parser = subparsers.add_parser('run', help='run a command on an idle server')
+    run_parser.add_argument('--port-env', default='NAILGUN_PORT', help='variable holding the server port')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER)
+    for pool_parser in [start_parser, run_parser]:
+        pool_parser.add_argument('--size', type=int, help='number of servers')
+        pool_parser.add_argument('--base-port', type=int, default=2120, help='port of the first server')
+        pool_parser.add_argument('--log', help='log file; server <n> logs to <log>.<n>')
+        pool_parser.add_argument('--max-runs', type=int, default=0, help='restart a server after this many proofs')
+        pool_parser.add_argument('--max-rss', type=int, default=0, help='restart a server above this many MB')
+        pool_parser.add_argument('--kserver', help='kserver command; {port} is replaced with the port of the server')
+
+    subparsers.add_parser('status', help='show the servers')
+    subparsers.add_parser('stop', help='stop the servers')
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--state-dir', required=True, help='directory holding the pool state')
+
+    args = parser.parse_args()
+    if args.cmd == 'start':
+        start(args)
+    elif args.cmd == 'run':
+        run(args)
+    elif args.cmd == 'status':
+        status(args)
+    elif args.cmd == 'stop':
+        stop(args)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Content-addressed cache of passed proofs.
+#
+# usage: proof_cache.py run --spec <spec-file> [--rev-file <file>] ... -- <command> ...
+#        proof_cache.py key --spec <spec-file> [--rev-file <file>] ... -- <command> ...
+#        proof_cache.py clean
+#
+# `run` runs a proof command unless a proof with the same key has already passed, in which case the cached
+# result is reported instead. Only passed proofs are cached; failures are always re-run.
+# `key` prints the key and the files that went into it.
+# `clean` drops the cache.
+#
+# The key is a SHA-256 hash of:
+#   - the spec file and all files it transitively requires that exist next to the requiring file
+#     (the tangled lemmas in the specs directory; requires that are not found there belong to the
+#     KEVM definition, which is covered by its revision),
+#   - the SMT prelude files given to the command with --smt-prelude,
+#   - the kprove command line: the command from the kprove executable on, so that wrappers before it
+#     (proof_history.py, kserver_pool.py, KPROVE_PREFIX) do not change the key, with the kprove path and the
+#     definition directory given with -d left out (the definition is identified by the revisions below),
+#   - the contents of the --rev-file files (.k.rev, .kevm.rev).
+#
+# The cache is the directory .build/proof-cache, or $PROOF_CACHE_DIR if set.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import proof_history
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFAULT_CACHE_DIR = os.path.join(ROOT, '.build', 'proof-cache')
+
+requires_pattern = re.compile(r'^\s*requires\s+"([^"]+)"', re.MULTILINE)
+
+
+def cache_dir():
+    return os.environ.get('PROOF_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+
+# Returns the spec file followed by the files it transitively requires, each once, in a stable order.
+def required_files(spec_file):
+    files = []
+    seen = set()
+    pending = [os.path.abspath(spec_file)]
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        files.append(path)
+        with open(path, 'r') as f:
+            text = f.read()
+        for required in reversed(requires_pattern.findall(text)):
+            required_path = os.path.normpath(os.path.join(os.path.dirname(path), required))
+            if os.path.isfile(required_path):
+                pending.append(required_path)
+    return files
+
+
+def option_files(command, option):
+    return [os.path.abspath(command[i + 1]) for (i, arg) in enumerate(command[:-1])
+            if arg == option and os.path.isfile(command[i + 1])]
+
+
+def display_path(path):
+    if path.startswith(ROOT + os.sep):
+        return os.path.relpath(path, ROOT)
+    return path
+
+
+# The kprove arguments of a proof command: wrappers before the kprove executable and the definition directory,
+# which differs between make test and schedule-proofs.py, are left out.
+def kprove_args(command):
+    starts = [i for (i, arg) in enumerate(command) if os.path.basename(arg) == 'kprove']
+    args = command[starts[0] + 1:] if starts else list(command)
+    for (i, arg) in enumerate(args[:-1]):
+        if arg in ('-d', '--directory'):
+            args[i + 1] = '$DEFINITION'
+    return args
+
+
+def proof_key(spec_file, rev_files, command):
+    digest = hashlib.sha256()
+    inputs = []
+    def add(kind, name, data):
+        for part in (kind, name, data):
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+    # Paths are hashed relative to the repository root so that clones in different places share keys.
+    for path in required_files(spec_file) + option_files(command, '--smt-prelude') + [os.path.abspath(f) for f in rev_files]:
+        with open(path, 'rb') as f:
+            add(b'file', display_path(path).encode(), f.read())
+        inputs.append(display_path(path))
+    add(b'command', b'', '\0'.join(kprove_args(command)).replace(ROOT, '$ROOT').encode())
+    return (digest.hexdigest(), inputs)
+
+
+def entry_path(key):
+    return os.path.join(cache_dir(), key[:2], key + '.json')
+
+
+def lookup(key):
+    try:
+        with open(entry_path(key), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store(key, entry):
+    path = entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def split_command(command):
+    return command[1:] if command[:1] == ['--'] else command
+
+
+def run(args):
+    command = split_command(args.command)
+    if not command:
+        print('No command given.')
+        sys.exit(1)
+    (key, _) = proof_key(args.spec, args.rev_file, command)
+    entry = lookup(key)
+    if entry is not None:
+        print('Cached proof result for {}: {} (proved {} in {}, key {})'.format(
+            display_path(os.path.abspath(args.spec)), entry['outcome'],
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['started'])),
+            proof_history.format_duration(entry['wall_time']), key[:12]), flush=True)
+        sys.exit(0)
+    started = time.time()
+    returncode = subprocess.call(command)
+    if returncode == 0:
+        store(key, {'spec': display_path(os.path.abspath(args.spec)), 'started': started,
+                    'wall_time': time.time() - started, 'outcome': 'passed'})
+    sys.exit(returncode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Skip proofs that already passed with the same inputs.')
+    subparsers = parser.add_subparsers(dest='cmd')
+    for (name, description) in [('run', 'run a proof command unless it is cached'),
+                                 ('key', 'print the cache key of a proof command')]:
+        subparser = subparsers.add_parser(name, help=description)
+        subparser.add_argument('--spec', required=True, help='spec file proved by the command')
+        subparser.add_argument('--rev-file', action='append', default=[], help='toolchain revision file, e.g. .k.rev')
+        subparser.add_argument('command', nargs=argparse.REMAINDER)
+    subparsers.add_parser('clean', help='drop the cache')
+
+    args = parser.parse_args()
+    if args.cmd == 'run':
+        run(args)
+    elif args.cmd == 'key':
+        (key, inputs) = proof_key(args.spec, args.rev_file, split_command(args.command))
+        print(key)
+        for path in inputs:
+            print('  ' + path)
+    elif args.cmd == 'clean':
+        shutil.rmtree(cache_dir(), ignore_errors=True)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Local database of proof durations, used to start the longest proofs first.
+#
+# usage: proof_history.py run [--spec <spec-file>] [--k-rev <rev>] [--kevm-rev <rev>] -- <command> ...
+#        proof_history.py order <spec-file> ...
+#        proof_history.py estimate [-j <jobs>] <spec-file> ...
+#        proof_history.py report [--limit <n>] [--threshold <ratio>]
+#
+# `run` runs a proof command and records its wall time, peak memory, outcome and the K/KEVM revisions.
+# `order` prints the given specs longest expected proof first, specs without history first of all.
+# `estimate` prints the expected total time of proving the given specs.
+# `report` shows the slowest specs and the specs whose proof time regressed between revisions.
+#
+# The database is the SQLite file .build/proof-history.db, or $PROOF_HISTORY_DB if set.
+
+import argparse
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFAULT_DB = os.path.join(ROOT, '.build', 'proof-history.db')
+
+# Number of most recent runs of a spec averaged into its expected duration.
+RECENT_RUNS = 3
+
+
+def db_path():
+    return os.environ.get('PROOF_HISTORY_DB', DEFAULT_DB)
+
+
+def connect():
+    path = db_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+                        spec        TEXT NOT NULL,
+                        started     REAL NOT NULL,
+                        wall_time   REAL NOT NULL,
+                        peak_rss_kb INTEGER,
+                        k_rev       TEXT,
+                        kevm_rev    TEXT,
+                        outcome     TEXT NOT NULL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS runs_spec ON runs (spec, started)')
+    return conn
+
+
+# Specs are identified by their path relative to the repository root, so that the same spec
+# gets the same key whether it is given as an absolute or as a relative path.
+def spec_key(spec_file):
+    path = os.path.abspath(spec_file)
+    if path.startswith(ROOT + os.sep):
+        return os.path.relpath(path, ROOT)
+    return path
+
+
+def read_rev(rev):
+    if rev and os.path.isfile(rev):
+        with open(rev, 'r') as f:
+            return f.read().strip()
+    return rev
+
+
+def record(spec_file, started, wall_time, peak_rss_kb, k_rev, kevm_rev, outcome):
+    with connect() as conn:
+        conn.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (spec_key(spec_file), started, wall_time, peak_rss_kb, k_rev, kevm_rev, outcome))
+
+
+# Returns {spec_file: expected seconds} for the given spec files that have a history.
+def expected_durations(spec_files):
+    durations = {}
+    if not os.path.exists(db_path()):
+        return durations
+    with connect() as conn:
+        for spec_file in spec_files:
+            rows = conn.execute('SELECT wall_time FROM runs WHERE spec = ? ORDER BY started DESC LIMIT ?',
+                                (spec_key(spec_file), RECENT_RUNS)).fetchall()
+            if rows:
+                durations[spec_file] = sum(row[0] for row in rows) / len(rows)
+    return durations
+
+
+# Longest expected proof first; specs without history are put in front since nothing bounds them.
+def order(spec_files):
+    durations = expected_durations(spec_files)
+    return sorted(spec_files, key=lambda spec_file: (spec_file not in durations, durations.get(spec_file, 0)),
+                  reverse=True)
+
+
+# Greedy longest-first assignment of the known durations to `jobs` workers.
+# Returns (total seconds, expected wall time, number of specs without history).
+def estimate(spec_files, jobs):
+    durations = expected_durations(spec_files)
+    known = sorted(durations.values(), reverse=True)
+    workers = [0.0] * max(1, jobs)
+    for duration in known:
+        workers[workers.index(min(workers))] += duration
+    return (sum(known), max(workers), len(spec_files) - len(known))
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return '{:.0f}s'.format(seconds)
+    if seconds < 3600:
+        return '{:.0f}m{:02.0f}s'.format(seconds // 60, seconds % 60)
+    return '{:.0f}h{:02.0f}m'.format(seconds // 3600, seconds % 3600 // 60)
+
+
+def short_rev(rev):
+    return (rev or '-')[:8]
+
+
+def run(args):
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        print('No command given.')
+        sys.exit(1)
+    started = time.time()
+    returncode = subprocess.call(command)
+    wall_time = time.time() - started
+    # ru_maxrss is in kilobytes on Linux; it covers all waited-for descendants.
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if args.spec:
+        outcome = 'passed' if returncode == 0 else 'failed'
+        try:
+            record(args.spec, started, wall_time, peak_rss_kb, read_rev(args.k_rev), read_rev(args.kevm_rev), outcome)
+        except sqlite3.Error as e:
+            print('proof_history.py: could not record {}: {}'.format(args.spec, e), file=sys.stderr)
+    sys.exit(returncode)
+
+
+def report(args):
+    if not os.path.exists(db_path()):
+        print('No proof history in ' + db_path())
+        return
+    with connect() as conn:
+        latest = conn.execute('''SELECT spec, wall_time, peak_rss_kb, outcome, k_rev, kevm_rev FROM runs r
+                                 WHERE started = (SELECT MAX(started) FROM runs WHERE spec = r.spec)
+                                 ORDER BY wall_time DESC LIMIT ?''', (args.limit,)).fetchall()
+        print('Slowest specs (latest run):')
+        for (spec, wall_time, peak_rss_kb, outcome, k_rev, kevm_rev) in latest:
+            print('  {:>8}  {:>7.0f}MB  {:6}  k:{} kevm:{}  {}'.format(
+                format_duration(wall_time), (peak_rss_kb or 0) / 1024, outcome, short_rev(k_rev), short_rev(kevm_rev), spec))
+
+        revisions = conn.execute('''SELECT spec, k_rev, kevm_rev, AVG(wall_time), MAX(started) FROM runs
+                                    GROUP BY spec, k_rev, kevm_rev ORDER BY spec, MAX(started)''').fetchall()
+    by_spec = {}
+    for (spec, k_rev, kevm_rev, wall_time, _) in revisions:
+        by_spec.setdefault(spec, []).append(((k_rev, kevm_rev), wall_time))
+    # Compares the latest revisions of each spec with the revisions it was proved with before.
+    regressions = []
+    for (spec, runs) in by_spec.items():
+        if len(runs) < 2:
+            continue
+        ((old_revs, old_wall_time), (new_revs, wall_time)) = runs[-2:]
+        if old_wall_time > 0 and wall_time / old_wall_time >= args.threshold:
+            regressions.append((wall_time / old_wall_time, spec, old_wall_time, wall_time, old_revs, new_revs))
+    print('\nRegressions (>= {:.2f}x slower than under the previous revisions):'.format(args.threshold))
+    if not regressions:
+        print('  none')
+    for (ratio, spec, old_wall_time, wall_time, old_revs, new_revs) in sorted(regressions, key=lambda r: r[0], reverse=True):
+        print('  {:5.2f}x  {} -> {}  k:{} kevm:{} -> k:{} kevm:{}  {}'.format(
+            ratio, format_duration(old_wall_time), format_duration(wall_time),
+            short_rev(old_revs[0]), short_rev(old_revs[1]), short_rev(new_revs[0]), short_rev(new_revs[1]), spec))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record and query proof durations.')
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    run_parser = subparsers.add_parser('run', help='run a proof command and record it')
+    run_parser.add_argument('--spec', help='spec file proved by the command')
+    run_parser.add_argument('--k-rev', help='K revision, or a .k.rev file')
+    run_parser.add_argument('--kevm-rev', help='KEVM revision, or a .kevm.rev file')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER)
+
+    order_parser = subparsers.add_parser('order', help='print specs longest expected proof first')
+    order_parser.add_argument('specs', nargs='*')
+
+    estimate_parser = subparsers.add_parser('estimate', help='estimate the time of proving specs')
+    estimate_parser.add_argument('-j', '--jobs', type=int, default=1)
+    estimate_parser.add_argument('specs', nargs='*')
+
+    report_parser = subparsers.add_parser('report', help='show slowest and regressed specs')
+    report_parser.add_argument('--limit', type=int, default=20)
+    report_parser.add_argument('--threshold', type=float, default=1.25)
+
+    args = parser.parse_args()
+    if args.cmd == 'run':
+        run(args)
+    elif args.cmd == 'order':
+        print(' '.join(order(args.specs)))
+    elif args.cmd == 'estimate':
+        (total, wall_time, unknown) = estimate(args.specs, args.jobs)
+        print('{} specs: {} of proofs, about {} with {} jobs{}'.format(
+            len(args.specs), format_duration(total), format_duration(wall_time), args.jobs,
+            ' (plus {} specs without history)'.format(unknown) if unknown else ''))
+    elif args.cmd == 'report':
+        report(args)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# Resource use of proofs, for sizing CI machines and noticing when a K or KEVM update makes proofs more expensive.
+#
+# usage: proof_stats.py run --out <jsonl-file> [--spec <spec-file>] [--group <spec-group>] [--k-rev <rev>]
+#                           [--kevm-rev <rev>] [--count-z3] -- <command> ...
+#        proof_stats.py summary [--top <n>] [--threshold <ratio>] [<jsonl-file or directory> ...]
+#
+# `run` runs a proof command and appends one JSON line to <jsonl-file> with its wall time, CPU time, peak memory,
+# exit status and the processes it started. The spec defaults to the last *.k argument of the command, so that
+# `run` can be used as KPROVE_PREFIX (see PROOF_STATS in kprove.mak). With --count-z3, the output of the command
+# is scanned for the Z3 queries printed by kprove --debug-z3-queries, and their number is recorded.
+# `summary` aggregates the latest record of every spec by spec group, shows the most expensive proofs, and compares
+# the cost of the specs proved under consecutive K/KEVM revisions. By default it reads every proof-stats.jsonl in
+# ./specs.
+#
+# CPU time and peak RSS come from getrusage, which only covers descendants that were waited for. The process tree
+# and the peak RSS of all processes together are sampled from /proc every SAMPLE_INTERVAL seconds, so short-lived
+# processes, like most z3 runs, may be missed.
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import re
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from proof_history import format_duration, read_rev, short_rev
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+STATS_FILE = 'proof-stats.jsonl'
+# Seconds between samples of the process tree
+SAMPLE_INTERVAL = 0.5
+# Characters of the command line kept for every process of the tree
+CMDLINE_LENGTH = 200
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# The header of a query printed by kprove --debug-z3-queries, not its "Z3 query result:" and "Z3 query time:" lines;
+# the same lines as queryStartPattern in script/kprove_z3.py.
+z3_query_pattern = re.compile(rb'^\s*Z3 query(?! result| time)\b', re.IGNORECASE)
+
+
+def proc_stat(pid):
+    with open('/proc/{}/stat'.format(pid)) as f:
+        text = f.read()
+    # The command name in parentheses may contain spaces, the other fields do not.
+    (name, fields) = (text[text.index('(') + 1:text.rindex(')')], text[text.rindex(')') + 2:].split())
+    return (name, int(fields[1]), int(fields[21]) * PAGE_SIZE)
+
+
+def proc_cmdline(pid):
+    with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+        return f.read().replace(b'\0', b' ').decode(errors='replace').strip()[:CMDLINE_LENGTH]
+
+
+class ProcessTree:
+    """Descendants of a process, sampled from /proc. Remembers every process seen, with its peak RSS."""
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.processes = {}
+        self.peak_rss = 0
+
+    def sample(self):
+        stats = {}
+        for pid in os.listdir('/proc'):
+            if pid.isdigit():
+                try:
+                    stats[int(pid)] = proc_stat(pid)
+                except (OSError, ValueError, IndexError):
+                    pass
+        children = {}
+        for (pid, (_, ppid, _)) in stats.items():
+            children.setdefault(ppid, []).append(pid)
+        total_rss = 0
+        pending = [self.root_pid]
+        now = time.time()
+        while pending:
+            pid = pending.pop()
+            if pid not in stats:
+                continue
+            (name, ppid, rss) = stats[pid]
+            total_rss += rss
+            process = self.processes.get(pid)
+            if process is None:
+                try:
+                    cmdline = proc_cmdline(pid)
+                except OSError:
+                    cmdline = ''
+                process = {'pid': pid, 'ppid': ppid, 'name': name, 'cmdline': cmdline, 'first_seen': now,
+                           'peak_rss_kb': 0}
+                self.processes[pid] = process
+            process['last_seen'] = now
+            process['peak_rss_kb'] = max(process['peak_rss_kb'], rss >> 10)
+            pending.extend(children.get(pid, []))
+        self.peak_rss = max(self.peak_rss, total_rss)
+
+    def records(self, started):
+        records = []
+        for process in sorted(self.processes.values(), key=lambda p: p['first_seen']):
+            record = dict(process)
+            record['first_seen'] = round(process['first_seen'] - started, 1)
+            record['last_seen'] = round(process['last_seen'] - started, 1)
+            records.append(record)
+        return records
+
+
+def copy_counting(source, target, counter, index):
+    """Copy the lines of source to target, counting the Z3 queries in counter[index]"""
+    match = z3_query_pattern.match
+    for line in iter(source.readline, b''):
+        if match(line):
+            counter[index] += 1
+        target.write(line)
+        target.flush()
+
+
+def spec_argument(command):
+    return next((arg for arg in reversed(command[1:]) if arg.endswith('.k')), None)
+
+
+def append_record(path, record):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Parallel proofs (make -j) append to the same file.
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def run(args):
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        print('No command given.')
+        sys.exit(1)
+    started = time.time()
+    output = subprocess.PIPE if args.count_z3 else None
+    process = subprocess.Popen(command, stdout=output, stderr=output)
+    tree = ProcessTree(process.pid)
+    counter = [0, 0]
+    copiers = []
+    if args.count_z3:
+        for (index, (source, target)) in enumerate([(process.stdout, sys.stdout.buffer),
+                                                    (process.stderr, sys.stderr.buffer)]):
+            copier = threading.Thread(target=copy_counting, args=(source, target, counter, index), daemon=True)
+            copier.start()
+            copiers.append(copier)
+    # The wrapper must not die before the proof does, or the proof would not be recorded.
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+    while True:
+        tree.sample()
+        try:
+            returncode = process.wait(SAMPLE_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+    for copier in copiers:
+        copier.join()
+    wall_time = time.time() - started
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    spec = args.spec or spec_argument(command)
+    record = {
+        'spec': os.path.relpath(os.path.abspath(spec), ROOT) if spec else None,
+        'group': args.group,
+        'started': started,
+        'wall_time': round(wall_time, 3),
+        'user_time': round(usage.ru_utime, 3),
+        'sys_time': round(usage.ru_stime, 3),
+        'cpu_time': round(usage.ru_utime + usage.ru_stime, 3),
+        # ru_maxrss is in kilobytes on Linux, and is the peak of the largest single process.
+        'max_rss_kb': usage.ru_maxrss,
+        'peak_tree_rss_kb': tree.peak_rss >> 10,
+        'returncode': returncode,
+        'signal': signal.Signals(-returncode).name if returncode < 0 else None,
+        'outcome': 'passed' if returncode == 0 else 'failed',
+        'z3_queries': sum(counter) if args.count_z3 else None,
+        'k_rev': read_rev(args.k_rev),
+        'kevm_rev': read_rev(args.kevm_rev),
+        'host': socket.gethostname(),
+        'cpus': os.cpu_count(),
+        'processes': tree.records(started),
+    }
+    try:
+        append_record(args.out, record)
+    except OSError as e:
+        print('proof_stats.py: could not record {}: {}'.format(spec, e), file=sys.stderr)
+    sys.exit(128 - returncode if returncode < 0 else returncode)
+
+
+def read_records(paths):
+    records = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, '**', STATS_FILE), recursive=True)) if os.path.isdir(path) else [path]
+        for stats_file in files:
+            with open(stats_file) as f:
+                for (number, line) in enumerate(f, 1):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        print('{}:{}: skipping malformed record'.format(stats_file, number), file=sys.stderr)
+    return records
+
+
+def summary(args):
+    records = read_records(args.paths or [os.path.join(ROOT, 'specs')])
+    if not records:
+        print('No proof stats found.')
+        return
+    # Latest record of every spec under every revision
+    by_revisions = {}
+    for record in sorted(records, key=lambda r: r['started']):
+        by_revisions[(record['group'], record['spec'], record['k_rev'], record['kevm_rev'])] = record
+    latest = {}
+    for record in by_revisions.values():
+        latest[(record['group'], record['spec'])] = record
+
+    groups = {}
+    for record in latest.values():
+        groups.setdefault(record['group'] or '-', []).append(record)
+    print('{:30} {:>6} {:>6} {:>9} {:>9} {:>9} {:>11}'.format(
+        'group', 'specs', 'failed', 'wall', 'cpu', 'peak rss', 'z3 queries'))
+    rows = sorted(groups.items()) + [('total', list(latest.values()))]
+    for (group, group_records) in rows:
+        queries = [r['z3_queries'] for r in group_records if r['z3_queries'] is not None]
+        print('{:30} {:>6} {:>6} {:>9} {:>9} {:>7.0f}MB {:>11}'.format(
+            group, len(group_records), sum(r['outcome'] != 'passed' for r in group_records),
+            format_duration(sum(r['wall_time'] for r in group_records)),
+            format_duration(sum(r['cpu_time'] for r in group_records)),
+            max(max(r['max_rss_kb'], r['peak_tree_rss_kb']) for r in group_records) / 1024,
+            sum(queries) if queries else '-'))
+
+    print('\nMost expensive proofs (latest run, by CPU time):')
+    for record in sorted(latest.values(), key=lambda r: r['cpu_time'], reverse=True)[:args.top]:
+        print('  cpu {:>8}  wall {:>8}  {:>7.0f}MB  {:6}  {}'.format(
+            format_duration(record['cpu_time']), format_duration(record['wall_time']),
+            max(record['max_rss_kb'], record['peak_tree_rss_kb']) / 1024, record['outcome'], record['spec']))
+
+    # Compares, group by group, each K/KEVM revision pair with the previous one, on the specs proved under both.
+    print('\nCost under consecutive revisions (specs proved under both; >= {:.2f}x marked):'.format(args.threshold))
+    compared = False
+    for group in sorted(groups):
+        revisions = []
+        costs = {}
+        for record in sorted(by_revisions.values(), key=lambda r: r['started']):
+            if (record['group'] or '-') != group:
+                continue
+            revs = (record['k_rev'], record['kevm_rev'])
+            if revs not in costs:
+                revisions.append(revs)
+                costs[revs] = {}
+            costs[revs][record['spec']] = record
+        for (old_revs, new_revs) in zip(revisions, revisions[1:]):
+            specs = set(costs[old_revs]) & set(costs[new_revs])
+            if not specs:
+                continue
+            compared = True
+            old_cpu = sum(costs[old_revs][spec]['cpu_time'] for spec in specs)
+            new_cpu = sum(costs[new_revs][spec]['cpu_time'] for spec in specs)
+            old_rss = max(costs[old_revs][spec]['max_rss_kb'] for spec in specs)
+            new_rss = max(costs[new_revs][spec]['max_rss_kb'] for spec in specs)
+            ratio = new_cpu / old_cpu if old_cpu > 0 else float('inf')
+            print('{} {:30} k:{} kevm:{} -> k:{} kevm:{}  {} specs  cpu {} -> {} ({:.2f}x)  rss {:.0f}MB -> {:.0f}MB'.format(
+                '!' if ratio >= args.threshold else ' ', group, short_rev(old_revs[0]), short_rev(old_revs[1]),
+                short_rev(new_revs[0]), short_rev(new_revs[1]), len(specs), format_duration(old_cpu),
+                format_duration(new_cpu), ratio, old_rss / 1024, new_rss / 1024))
+    if not compared:
+        print('  no spec was proved under more than one revision')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record and summarize the resource use of proofs.')
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    run_parser = subparsers.add_parser('run', help='run a proof command and record its resource use')
+    run_parser.add_argument('--out', required=True, help='JSONL file the record is appended to')
+    run_parser.add_argument('--spec', help='spec file proved by the command; the last *.k argument by default')
+    run_parser.add_argument('--group', help='spec group of the spec')
+    run_parser.add_argument('--k-rev', help='K revision, or a .k.rev file')
+    run_parser.add_argument('--kevm-rev', help='KEVM revision, or a .kevm.rev file')
+    run_parser.add_argument('--count-z3', action='store_true', help='count the Z3 queries printed by the command')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER)
+
+    summary_parser = subparsers.add_parser('summary', help='aggregate recorded proofs across spec groups')
+    summary_parser.add_argument('--top', type=int, default=10, help='number of most expensive proofs shown')
+    summary_parser.add_argument('--threshold', type=float, default=1.5, help='CPU time ratio marked as a regression')
+    summary_parser.add_argument('paths', nargs='*', help='JSONL files, or directories searched for ' + STATS_FILE)
+
+    args = parser.parse_args()
+    if args.cmd == 'run':
+        run(args)
+    elif args.cmd == 'summary':
+        summary(args)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+
+# Proves the specs of several spec groups on one bounded pool of workers.
+#
+# usage: schedule-proofs.py [-j <jobs>] [--no-prepare] [--clean-cache] [--dry-run] <group-dir> ...
+#        schedule-proofs.py --listen <host>:<port> [-j <local workers>] [--idle-timeout <seconds>]
+#                           [--report <file>] [--no-prepare] [--clean-cache] [--dry-run] <group-dir> ...
+#        schedule-proofs.py --worker <host>:<port> [-j <jobs>] [--name <name>] [--no-prepare] [--clean-cache]
+#
+# Every group is first prepared serially with `make -C <group-dir> all`. Then the *-spec.k files of all
+# groups are put into one global queue, longest expected proof first according to the proof history
+# (see proof_history.py), and each of them is proved by `make -C <group-dir> <spec-file>.test`.
+# The output of a proof goes to <spec-file>.log.
+#
+# K bug workaround: the KEVM parse cache (cache.bin) is shared between all groups using the same KEVM build,
+# and rules with equal body but different attributes collide in it. Instead of wiping the cache between
+# groups, every group gets its own definition directory under .build/defn-cache, which links to the kompiled
+# definition but holds a private cache.bin (see KPROVE_DEFN_DIR in kprove.mak).
+#
+# With --listen, the proofs are run by worker processes instead, connected over TCP to this coordinator: -j local
+# workers that it starts itself, and workers started with --worker on other hosts, each with its own checkout of
+# this repository (at any path) and its own K/KEVM build. A worker proves -j specs at a time, and is given the
+# next spec of the queue whenever it finishes one, so that the proofs are balanced over the workers by their
+# expected durations. A worker prepares a group with `make all` before its first spec of the group (unless
+# --no-prepare) and keeps its logs; the coordinator gets the outcome, duration and the end of the log of
+# failed proofs, records the durations of other hosts in its own proof history, and prints one report, also
+# written as JSON with --report. Workers send a heartbeat every HEARTBEAT_INTERVAL seconds; the specs of a
+# worker that disconnects or stays silent for HEARTBEAT_TIMEOUT seconds are given to other workers, up to
+# MAX_ATTEMPTS times. The coordinator gives up after --idle-timeout seconds without any worker.
+# Workers run whatever spec the coordinator sends, within their checkout: use on trusted networks only.
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import proof_history
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFN_CACHE_DIR = os.path.join(ROOT, '.build', 'defn-cache')
+PARSE_CACHE_FILE = 'cache.bin'
+
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 60
+MAX_ATTEMPTS = 3
+# Lines of the log of a failed proof sent back to the coordinator
+LOG_TAIL_LINES = 20
+
+Job = namedtuple('Job', ['group', 'spec_file', 'defn_dir'])
+
+
+def group_name(group):
+    return os.path.relpath(os.path.abspath(group), ROOT)
+
+
+def proof_info(group):
+    out = subprocess.run(['make', '-s', '--no-print-directory', '-C', group, 'print-proof-info'],
+                         stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    info = {}
+    for line in out.splitlines():
+        if '=' in line:
+            (key, value) = line.split('=', 1)
+            info[key] = value.strip()
+    return info
+
+
+def relink(source, target):
+    if os.path.islink(target):
+        if os.readlink(target) == source:
+            return
+        os.remove(target)
+    os.symlink(source, target)
+
+
+# Mirrors a *-kompiled directory with symlinks, except for the parse cache, which stays private.
+# The private cache is dropped when the kompiled definition is newer than it.
+def shadow_kompiled_dir(source, target, clean):
+    os.makedirs(target, exist_ok=True)
+    cache_file = os.path.join(target, PARSE_CACHE_FILE)
+    entries = [entry for entry in os.listdir(source) if entry != PARSE_CACHE_FILE]
+    if os.path.exists(cache_file):
+        cache_time = os.path.getmtime(cache_file)
+        if clean or any(os.path.getmtime(os.path.join(source, entry)) > cache_time for entry in entries):
+            os.remove(cache_file)
+    for entry in os.listdir(target):
+        path = os.path.join(target, entry)
+        if os.path.islink(path) and not os.path.exists(path):
+            os.remove(path)
+    for entry in entries:
+        relink(os.path.join(source, entry), os.path.join(target, entry))
+
+
+def private_defn_dir(group, kevm_build_dir, clean):
+    defn_dir = os.path.join(DEFN_CACHE_DIR, group_name(group).replace('/', '_'))
+    os.makedirs(defn_dir, exist_ok=True)
+    for entry in os.listdir(kevm_build_dir):
+        source = os.path.join(kevm_build_dir, entry)
+        target = os.path.join(defn_dir, entry)
+        if entry.endswith('-kompiled') and os.path.isdir(source):
+            shadow_kompiled_dir(source, target, clean)
+        else:
+            relink(source, target)
+    return defn_dir
+
+
+def group_defn_dir(group, info, clean):
+    kevm_build_dir = info['KEVM_BUILD_DIR']
+    if os.path.isdir(kevm_build_dir):
+        return private_defn_dir(group, kevm_build_dir, clean)
+    return kevm_build_dir
+
+
+def collect_jobs(groups, clean):
+    jobs = []
+    for group in groups:
+        info = proof_info(group)
+        defn_dir = group_defn_dir(group, info, clean)
+        jobs.extend(Job(group, spec_file, defn_dir) for spec_file in info['SPEC_FILES'].split())
+    return jobs
+
+
+# Specs without history go first, biggest first, as bigger specs (more rules, bigger programs) tend to take longer.
+def order_jobs(jobs):
+    durations = proof_history.expected_durations([job.spec_file for job in jobs])
+    def expected_cost(job):
+        if job.spec_file in durations:
+            return (False, durations[job.spec_file])
+        try:
+            return (True, os.path.getsize(job.spec_file))
+        except OSError:
+            return (True, 0)
+    return sorted(jobs, key=expected_cost, reverse=True)
+
+
+# Runs the proof of a job; `processes`, if given, holds the running proof while it runs.
+def run_job(job, processes=None):
+    log_file = job.spec_file + '.log'
+    start = time.time()
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(['make', '-C', job.group, job.spec_file + '.test',
+                                    'KPROVE_DEFN_DIR=' + job.defn_dir], stdout=log, stderr=subprocess.STDOUT)
+        if processes is not None:
+            processes.add(process)
+        try:
+            returncode = process.wait()
+        finally:
+            if processes is not None:
+                processes.discard(process)
+    return (job, returncode, time.time() - start, log_file)
+
+
+def spec_name(job):
+    return os.path.relpath(job.spec_file, ROOT)
+
+
+def parse_address(address):
+    (host, _, port) = address.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def send_message(sock, lock, message):
+    data = (json.dumps(message) + '\n').encode()
+    with lock:
+        sock.sendall(data)
+
+
+# Path of the repository given relative to its root by another host
+def checkout_path(path):
+    resolved = os.path.normpath(os.path.join(ROOT, path))
+    if resolved != ROOT and not resolved.startswith(ROOT + os.sep):
+        raise ValueError('{} is outside of {}'.format(path, ROOT))
+    return resolved
+
+
+def log_tail(log_file):
+    try:
+        with open(log_file, errors='replace') as f:
+            return list(collections.deque(f, LOG_TAIL_LINES))
+    except OSError:
+        return []
+
+
+class WorkerConnection:
+    """A worker connected to the coordinator, and the jobs it is running"""
+
+    def __init__(self, sock, hello, address):
+        self.sock = sock
+        self.name = hello.get('name') or '{}:{}'.format(*address[:2])
+        self.slots = max(1, int(hello.get('jobs', 1)))
+        # Workers of other hosts, or with another proof history, do not record their proofs in ours.
+        self.records_history = (hello.get('host'), hello.get('history')) == (
+            socket.gethostname(), os.path.abspath(proof_history.db_path()))
+        self.running = {}
+        self.send_lock = threading.Lock()
+
+    def send(self, message):
+        send_message(self.sock, self.send_lock, message)
+
+
+class Coordinator:
+    """Hands the jobs out to the connected workers, longest expected proof first, and collects their results"""
+
+    def __init__(self, jobs, idle_timeout):
+        self.jobs = jobs
+        self.idle_timeout = idle_timeout
+        self.queue = collections.deque(range(len(jobs)))
+        self.attempts = [0] * len(jobs)
+        self.results = {}
+        self.workers = []
+        self.idle_since = time.time()
+        self.condition = threading.Condition()
+        self.server = None
+
+    def listen(self, address):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(16)
+        threading.Thread(target=self.accept, daemon=True).start()
+        return self.server.getsockname()[1]
+
+    def accept(self):
+        while True:
+            try:
+                (sock, address) = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(sock, address), daemon=True).start()
+
+    def serve(self, sock, address):
+        worker = None
+        sock.settimeout(HEARTBEAT_TIMEOUT)
+        try:
+            lines = sock.makefile('r')
+            hello = json.loads(lines.readline() or '{}')
+            if hello.get('type') != 'hello':
+                return
+            worker = WorkerConnection(sock, hello, address)
+            with self.condition:
+                self.workers.append(worker)
+                print('Worker {} joined with {} jobs'.format(worker.name, worker.slots), flush=True)
+                self.dispatch()
+            for line in lines:
+                message = json.loads(line)
+                if message.get('type') == 'result':
+                    with self.condition:
+                        self.finish(worker, message)
+        except (OSError, ValueError) as e:
+            if worker is not None and worker.running:
+                print('Worker {}: {}'.format(worker.name, e), flush=True)
+        finally:
+            if worker is not None:
+                with self.condition:
+                    self.lose(worker)
+            sock.close()
+
+    def message(self, job_id):
+        job = self.jobs[job_id]
+        # Private definition directories are in the checkout, and workers that share it use them as they are.
+        defn_dir = os.path.relpath(job.defn_dir, ROOT)
+        return {'type': 'job', 'id': job_id, 'group': group_name(job.group),
+                'spec': os.path.relpath(job.spec_file, ROOT),
+                'defn_dir': None if defn_dir.startswith(os.pardir) else defn_dir}
+
+    # Called with self.condition held, as all methods below.
+    def dispatch(self):
+        for worker in list(self.workers):
+            while self.queue and len(worker.running) < worker.slots:
+                job_id = self.queue.popleft()
+                worker.running[job_id] = time.time()
+                self.attempts[job_id] += 1
+                try:
+                    worker.send(self.message(job_id))
+                except OSError:
+                    # The connection thread of the worker requeues its jobs.
+                    break
+
+    def finish(self, worker, message):
+        job_id = message['id']
+        started = worker.running.pop(job_id, None)
+        if started is None or job_id in self.results:
+            return
+        job = self.jobs[job_id]
+        result = {'spec': spec_name(job), 'worker': worker.name, 'returncode': message['returncode'],
+                  'duration': message['duration'], 'log': message.get('log'), 'tail': message.get('tail', [])}
+        result['status'] = 'PASSED' if result['returncode'] == 0 else 'FAILED'
+        self.results[job_id] = result
+        print('[{}/{}] {} {} ({:.0f}s, {})'.format(len(self.results), len(self.jobs), result['status'],
+                                                   result['spec'], result['duration'], worker.name), flush=True)
+        if not worker.records_history and message.get('proved'):
+            try:
+                proof_history.record(job.spec_file, time.time() - result['duration'], result['duration'], None,
+                                     None, None, 'passed' if result['returncode'] == 0 else 'failed')
+            except sqlite3.Error as e:
+                print('Could not record {}: {}'.format(result['spec'], e), file=sys.stderr)
+        self.dispatch()
+        self.condition.notify_all()
+
+    def lose(self, worker):
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        lost = sorted(job_id for job_id in worker.running if job_id not in self.results)
+        requeued = [job_id for job_id in lost if self.attempts[job_id] < MAX_ATTEMPTS]
+        print('Worker {} left{}'.format(worker.name, ', requeuing {} proofs'.format(len(requeued)) if lost else ''),
+              flush=True)
+        for job_id in lost:
+            if job_id not in requeued:
+                self.results[job_id] = {'spec': spec_name(self.jobs[job_id]), 'worker': worker.name,
+                                        'returncode': None, 'duration': 0.0, 'log': None, 'status': 'LOST',
+                                        'tail': ['lost with {} workers'.format(MAX_ATTEMPTS)]}
+        # Requeued jobs are started before the others, in their original order.
+        self.queue.extendleft(reversed(requeued))
+        if not self.workers:
+            self.idle_since = time.time()
+        self.dispatch()
+        self.condition.notify_all()
+
+    # Waits for the results of all jobs, or until no worker was connected for idle_timeout seconds.
+    def wait(self):
+        with self.condition:
+            while len(self.results) < len(self.jobs):
+                if not self.workers and time.time() - self.idle_since > self.idle_timeout:
+                    print('No worker for {}s, giving up'.format(self.idle_timeout), flush=True)
+                    break
+                self.condition.wait(1)
+            workers = list(self.workers)
+        for worker in workers:
+            try:
+                worker.send({'type': 'done'})
+            except OSError:
+                pass
+        self.server.close()
+
+
+def report(results, jobs, report_file):
+    failed = [result for result in results if result['status'] != 'PASSED']
+    done = {result['id'] for result in results}
+    not_run = [spec_name(job) for (job_id, job) in enumerate(jobs) if job_id not in done]
+    by_worker = {}
+    for result in results:
+        (count, duration) = by_worker.get(result['worker'], (0, 0.0))
+        by_worker[result['worker']] = (count + 1, duration + result['duration'])
+    print('\n{} proofs, {} passed, {} failed{}'.format(
+        len(jobs), len(results) - len(failed), len(failed), ', {} not run'.format(len(not_run)) if not_run else ''))
+    for (worker, (count, duration)) in sorted(by_worker.items()):
+        print('  {}: {} proofs, {}'.format(worker, count, proof_history.format_duration(duration)))
+    if failed:
+        print('\nFailed proofs:')
+    for result in failed:
+        print('  {} {} ({}: {})'.format(result['status'], result['spec'], result['worker'], result['log'] or '-'))
+        for line in result['tail']:
+            print('    ' + line.rstrip('\n'))
+    if not_run:
+        print('\nNot run:')
+        for spec in not_run:
+            print('  ' + spec)
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump({'results': results, 'not_run': not_run}, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return not failed and not not_run
+
+
+def coordinate(args, jobs):
+    coordinator = Coordinator(jobs, args.idle_timeout)
+    (host, port) = parse_address(args.listen)
+    port = coordinator.listen((host, port))
+    print('Coordinator listening on {}:{}'.format(host, port), flush=True)
+    local_workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker',
+                                       '127.0.0.1:{}'.format(port), '--name', 'local-{}'.format(i), '--no-prepare'])
+                     for i in range(args.jobs)]
+    coordinator.wait()
+    for worker in local_workers:
+        try:
+            worker.wait(timeout=HEARTBEAT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            worker.terminate()
+    results = [dict(result, id=job_id) for (job_id, result) in sorted(coordinator.results.items())]
+    return report(results, jobs, args.report)
+
+
+class GroupCache:
+    """Groups of the local checkout, prepared and given a definition directory once"""
+
+    def __init__(self, prepare, clean):
+        self.prepare = prepare
+        self.clean = clean
+        self.defn_dirs = {}
+        self.locks = collections.defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+
+    def job(self, message):
+        group = checkout_path(message['group'])
+        spec_file = checkout_path(message['spec'])
+        with self.lock:
+            group_lock = self.locks[group]
+        with group_lock:
+            if group not in self.defn_dirs:
+                if self.prepare and subprocess.run(['make', '-C', group, 'all'], stdout=subprocess.DEVNULL,
+                                                   stderr=subprocess.STDOUT).returncode != 0:
+                    raise RuntimeError('Preparing {} failed.'.format(message['group']))
+                defn_dir = message.get('defn_dir') and checkout_path(message['defn_dir'])
+                if not defn_dir or not os.path.isdir(defn_dir):
+                    defn_dir = group_defn_dir(group, proof_info(group), self.clean)
+                self.defn_dirs[group] = defn_dir
+        return Job(group, spec_file, self.defn_dirs[group])
+
+
+def work(args):
+    sock = socket.create_connection(parse_address(args.worker))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    send_lock = threading.Lock()
+    send_message(sock, send_lock, {'type': 'hello', 'name': args.name, 'jobs': args.jobs,
+                                   'host': socket.gethostname(), 'history': os.path.abspath(proof_history.db_path())})
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                send_message(sock, send_lock, {'type': 'heartbeat'})
+            except OSError:
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    groups = GroupCache(not args.no_prepare, args.clean_cache)
+    processes = set()
+
+    def prove(message):
+        result = {'type': 'result', 'id': message['id'], 'proved': False, 'duration': 0.0, 'tail': []}
+        try:
+            (job, returncode, duration, log_file) = run_job(groups.job(message), processes)
+            result.update(proved=True, returncode=returncode, duration=duration,
+                          log=os.path.relpath(log_file, ROOT))
+            if returncode != 0:
+                result['tail'] = log_tail(log_file)
+        except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+            result.update(returncode=1, tail=[str(e)])
+        if not stopped.is_set():
+            try:
+                send_message(sock, send_lock, result)
+            except OSError:
+                pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        try:
+            for line in sock.makefile('r'):
+                message = json.loads(line)
+                if message.get('type') == 'job':
+                    executor.submit(prove, message)
+                elif message.get('type') == 'done':
+                    stopped.set()
+                    return
+        except (OSError, ValueError):
+            pass
+        # The coordinator is gone: its jobs are given to other workers.
+        stopped.set()
+        for process in list(processes):
+            process.terminate()
+    sys.exit('Lost the coordinator')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prove the specs of several spec groups on one worker pool.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of proofs run in parallel, or of local workers with --listen')
+    parser.add_argument('--no-prepare', action='store_true', help='do not run `make all` in the groups first')
+    parser.add_argument('--clean-cache', action='store_true', help='drop the private KEVM parse caches')
+    parser.add_argument('--dry-run', action='store_true', help='only print the jobs in the order they would start')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--listen', metavar='HOST:PORT', help='coordinate workers connecting to this address')
+    mode.add_argument('--worker', metavar='HOST:PORT', help='run proofs for the coordinator at this address')
+    parser.add_argument('--name', default=socket.gethostname(), help='name of this worker in the report')
+    parser.add_argument('--idle-timeout', type=int, default=600,
+                        help='seconds the coordinator waits for workers while none is connected')
+    parser.add_argument('--report', help='file the coordinator writes the results to, as JSON')
+    parser.add_argument('groups', nargs='*', help='spec group directories')
+    args = parser.parse_args()
+
+    if args.worker:
+        work(args)
+        return
+    if not args.groups:
+        parser.error('no spec group directory given')
+
+    if not args.no_prepare and not args.dry_run:
+        for group in args.groups:
+            if subprocess.run(['make', '-C', group, 'all']).returncode != 0:
+                print('Preparing {} failed.'.format(group))
+                sys.exit(1)
+
+    jobs = order_jobs(collect_jobs(args.groups, args.clean_cache))
+    (total, wall_time, unknown) = proof_history.estimate([job.spec_file for job in jobs], args.jobs)
+    print('{} proofs, expected {} with {} jobs{}'.format(
+        len(jobs), proof_history.format_duration(wall_time), args.jobs,
+        ' (plus {} proofs without history)'.format(unknown) if unknown else ''), flush=True)
+    if args.dry_run:
+        for job in jobs:
+            print(spec_name(job))
+        return
+    if args.listen:
+        sys.exit(0 if coordinate(args, jobs) else 1)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for (done, future) in enumerate(concurrent.futures.as_completed(futures), 1):
+            (job, returncode, duration, log_file) = future.result()
+            status = 'PASSED' if returncode == 0 else 'FAILED'
+            print('[{}/{}] {} {} ({:.0f}s)'.format(done, len(jobs), status, spec_name(job), duration), flush=True)
+            if returncode != 0:
+                failed.append(log_file)
+
+    if failed:
+        print('\n{} of {} proofs failed, see:'.format(len(failed), len(jobs)))
+        for log_file in failed:
+            print('  ' + log_file)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
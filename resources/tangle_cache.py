@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Tangles literate .md sources with pandoc, once per distinct content, and links the results into spec directories.
+#
+# usage: tangle_cache.py [-j <jobs>] [--code <ext>] [--tangler <tangle.lua>] --dest <dir> <file> ...
+#        tangle_cache.py [--code <ext>] [--tangler <tangle.lua>] -o <output> <file.md>
+#
+# Every <name>.md is tangled into <dir>/<name><ext> (.k by default), other files are copied into <dir> as they are.
+# Tangled outputs are cached in .build/tangle-cache, keyed by the sha256 of the .md content, the tangler and <ext>,
+# so a lemma file shared by several spec groups is tangled once, and again only when it changes. Cache misses are
+# tangled in parallel. Tangled outputs are hard linked into <dir> rather than copied, and copied only where hard
+# links are not possible, e.g. across file systems. Other files are always copied, so that editing a spec directory
+# never edits a tracked source. With -o, a fresh, writable copy of the tangled output is written, so that make sees
+# <output> as newer than <file.md>.
+# The tangler is $TANGLER by default (exported by kprove.mak).
+
+import argparse
+import concurrent.futures
+import filecmp
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+CACHE_DIR = os.path.join(ROOT, '.build', 'tangle-cache')
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def cache_key(md_file, tangler_hash, code):
+    digest = hashlib.sha256()
+    for part in (file_hash(md_file), tangler_hash, code):
+        digest.update(part.encode() + b'\0')
+    return digest.hexdigest()
+
+
+def cached_output(key, code):
+    return os.path.join(CACHE_DIR, key[:2], key + code)
+
+
+def tangle(md_file, tangler, code, output):
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(output, os.getpid())
+    with open(tmp_path, 'w') as out:
+        result = subprocess.run(['pandoc', '--from', 'markdown', '--to', tangler, '--metadata=code:' + code, md_file],
+                                stdout=out, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        os.remove(tmp_path)
+        raise RuntimeError('pandoc failed on {}:\n{}'.format(md_file, result.stderr))
+    # Outputs are shared through hard links; read-only, so that they are not edited in place by mistake.
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, output)
+    print('tangle_cache.py: tangled ' + md_file)
+
+
+# Replaces target with a hard link to source, or with a copy of it.
+def link(source, target):
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    tmp_path = '{}.{}.tmp'.format(target, os.getpid())
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+# Replaces target with a copy of source, unless it already has the same content and is not a link to source.
+# With force, target is always rewritten, so that it is newer than its prerequisites.
+def copy(source, target, force=False):
+    if (not force and os.path.exists(target) and not os.path.samefile(source, target)
+            and filecmp.cmp(source, target, shallow=False)):
+        return
+    tmp_path = '{}.{}.tmp'.format(target, os.getpid())
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+# Returns {md_file: cached output}, tangling the outputs that are not cached yet.
+def tangle_all(md_files, tangler, code, jobs):
+    tangler_hash = file_hash(tangler)
+    outputs = {md_file: cached_output(cache_key(md_file, tangler_hash, code), code) for md_file in md_files}
+    # A file given twice, or two files with equal content, are tangled once.
+    missing = {}
+    for (md_file, output) in outputs.items():
+        if not os.path.exists(output):
+            missing.setdefault(output, md_file)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(tangle, md_file, tangler, code, output) for (output, md_file) in missing.items()]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tangle .md files through a content-hash cache.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel pandoc runs')
+    parser.add_argument('--code', default='.k', help='code blocks to extract, and extension of the outputs')
+    parser.add_argument('--tangler', default=os.environ.get('TANGLER'), help='pandoc tangle.lua writer')
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument('--dest', help='directory the outputs are linked into')
+    destination.add_argument('-o', '--output', help='output of a single .md file')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    if args.output and (len(args.files) != 1 or not args.files[0].endswith('.md')):
+        parser.error('-o takes a single .md file')
+    md_files = [path for path in args.files if path.endswith('.md')]
+    if md_files and not args.tangler:
+        parser.error('set $TANGLER or pass --tangler')
+    try:
+        outputs = tangle_all(md_files, args.tangler, args.code, args.jobs) if md_files else {}
+    except RuntimeError as e:
+        sys.exit('tangle_cache.py: ' + str(e))
+
+    if args.output:
+        # A link would have the mtime of the cached output, which can be older than the .md and the files made from
+        # the output.
+        copy(outputs[args.files[0]], args.output, force=True)
+        return
+    os.makedirs(args.dest, exist_ok=True)
+    for path in args.files:
+        if path in outputs:
+            link(outputs[path], os.path.join(args.dest, os.path.basename(path)[:-len('.md')] + args.code))
+        else:
+            copy(path, os.path.join(args.dest, os.path.basename(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Runs kprove on the specs of a folder in ./specs, on a pool of workers.
+#
+# usage: run-proofs.py [-j <jobs>] [--timeout <seconds>] [--memory <size>] [--resume] [-d]
+#                      <spec-folder> <output-folder> [all | <spec-file> ...] [-- <kprove option> ...]
+#
+# E.g. ./run-proofs.py -j 4 gnosis-erc20 gnosis-erc20-1
+#      ./run-proofs.py --resume gnosis-erc20 gnosis-erc20-1 -- --log-cells "(k),(gas),(statusCode)"
+#
+# Proves ./specs/<spec-folder>/*spec.k, or the given spec files, longest expected proof first (see
+# resources/proof_history.py), with the KEVM definition in $KEVM/.build/defn/java.
+# The output of the proof of <spec-file> goes to output/<output-folder>/<spec-file>.log.
+# output/<output-folder>/status.json holds the status of every spec: passed, failed, timeout, memory
+# (killed for exceeding --memory) or error, with its duration and peak memory. It is rewritten after every proof.
+# With --resume, specs that passed before with the same proof key are not proved again. The key is the one of
+# resources/proof_cache.py: it covers the spec, the lemmas it requires, the SMT preludes, the kprove options and
+# the K and KEVM revisions in .build/.k.rev and .build/.kevm.rev, where these exist.
+# -d deletes the output folder first.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'resources'))
+import proof_cache
+import proof_history
+
+OUTPUT_TOP_DIR = 'output'
+STATUS_FILE = 'status.json'
+# Seconds between checks of a running proof for its timeout and memory use
+POLL_INTERVAL = 1.0
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+REV_FILES = [os.path.join(ROOT, '.build', '.k.rev'), os.path.join(ROOT, '.build', '.kevm.rev')]
+
+
+def parse_size(size):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1:].upper()])
+    return int(size)
+
+
+def proof_key(spec_file, command):
+    return proof_cache.proof_key(spec_file, [f for f in REV_FILES if os.path.isfile(f)], command)[0]
+
+
+def spec_files(spec_dir, names):
+    if not names or names == ['all']:
+        files = []
+        for name in sorted(os.listdir(spec_dir)):
+            if name.endswith('spec.k'):
+                files.append(os.path.join(spec_dir, name))
+            else:
+                print('skipping {} because it is not a spec file'.format(name))
+        return files
+    files = []
+    for name in names:
+        path = os.path.join(spec_dir, name)
+        if os.path.exists(path):
+            files.append(path)
+        else:
+            print('skipping {} because it does not exist - maybe a typo?'.format(name))
+    return files
+
+
+# Resident memory of all processes in the process group, in bytes. Proofs run in their own process group,
+# so this covers the JVM and the z3 processes it starts.
+def group_rss(pgid):
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # The command name in parentheses may contain spaces, the other fields do not.
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * PAGE_SIZE
+    return total
+
+
+def kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# Appends a timestamped line to the log of the run, which the workers and the main thread share.
+def write_log(log, lock, message):
+    with lock:
+        log.write('{}: {}\n'.format(time.ctime(), message))
+        log.flush()
+
+
+def run_proof(command, log_path, timeout, memory, log, lock, start_message):
+    write_log(log, lock, start_message)
+    started = time.time()
+    status = None
+    peak_rss = 0
+    try:
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            while True:
+                try:
+                    returncode = process.wait(POLL_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                rss = group_rss(process.pid)
+                peak_rss = max(peak_rss, rss)
+                if timeout is not None and time.time() - started > timeout:
+                    status = 'timeout'
+                elif memory is not None and rss > memory:
+                    status = 'memory'
+                if status is not None:
+                    kill_group(process)
+                    returncode = process.wait()
+                    log.write('\nrun-proofs.py: killed, {}\n'.format(
+                        'timeout of {}s exceeded'.format(timeout) if status == 'timeout' else
+                        'memory limit of {}MB exceeded'.format(memory >> 20)))
+                    break
+    except OSError as e:
+        return {'status': 'error', 'error': str(e), 'started': started, 'wall_time': 0}
+    # Reaps the rest of the group, e.g. z3 processes left behind by a failed proof.
+    kill_group(process)
+    if status is None:
+        status = 'passed' if returncode == 0 else 'failed'
+    return {'status': status, 'returncode': returncode, 'started': started, 'wall_time': time.time() - started,
+            'peak_rss_kb': peak_rss >> 10}
+
+
+def write_status(path, statuses):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(statuses, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run kprove on the specs of a folder in ./specs.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of proofs run in parallel')
+    parser.add_argument('--timeout', type=float, help='seconds after which a proof is killed')
+    parser.add_argument('--memory', help='memory of a proof, with its z3 processes, above which it is killed, e.g. 8G')
+    parser.add_argument('--resume', action='store_true', help='skip specs that passed before and did not change')
+    parser.add_argument('-d', '--delete', action='store_true', help='delete the output folder first')
+    parser.add_argument('--kevm', default=os.environ.get('KEVM'), help='KEVM directory (default: $KEVM)')
+    parser.add_argument('--kprove', default='kprove', help='kprove executable')
+    parser.add_argument('spec_folder', help='folder in ./specs')
+    parser.add_argument('output_folder', help='folder in ./output')
+    parser.add_argument('specs', nargs='*', help='spec files in the spec folder; all of them by default')
+    argv = sys.argv[1:]
+    kprove_opts = []
+    if '--' in argv:
+        (argv, kprove_opts) = (argv[:argv.index('--')], argv[argv.index('--') + 1:])
+    args = parser.parse_args(argv)
+    if not args.kevm:
+        parser.error('set $KEVM or pass --kevm')
+    memory = parse_size(args.memory) if args.memory else None
+
+    output_dir = os.path.join(OUTPUT_TOP_DIR, args.output_folder)
+    if args.delete:
+        print('deleting {}'.format(output_dir))
+        shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir, exist_ok=True)
+    status_path = os.path.join(output_dir, STATUS_FILE)
+    statuses = {}
+    if os.path.exists(status_path):
+        with open(status_path) as f:
+            statuses = json.load(f)
+
+    defn_dir = os.path.join(args.kevm, '.build', 'defn', 'java')
+    files = spec_files(os.path.join('specs', args.spec_folder), args.specs)
+    commands = {f: [args.kprove, f, '-d', defn_dir, '-m', 'VERIFICATION'] + kprove_opts for f in files}
+    keys = {f: proof_key(f, commands[f]) for f in files}
+    if args.resume:
+        done = [f for f in files if statuses.get(os.path.basename(f), {}).get('status') == 'passed'
+                and statuses[os.path.basename(f)].get('proof_key') == keys[f]]
+        if done:
+            print('skipping {} specs that already passed'.format(len(done)))
+        files = [f for f in files if f not in done]
+    files = proof_history.order(files)
+    (total, wall_time, unknown) = proof_history.estimate(files, args.jobs)
+    print('{} proofs, expected {} with {} jobs{}'.format(
+        len(files), proof_history.format_duration(wall_time), args.jobs,
+        ' (plus {} proofs without history)'.format(unknown) if unknown else ''), flush=True)
+
+    failed = 0
+    lock = threading.Lock()
+    with open(os.path.join(output_dir, 'log'), 'a') as log, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {}
+        for spec_file in files:
+            name = os.path.basename(spec_file)
+            log_path = os.path.join(output_dir, name + '.log')
+            start_message = 'Verifying {} with {}'.format(name, ' '.join(kprove_opts))
+            future = executor.submit(run_proof, commands[spec_file], log_path, args.timeout, memory, log, lock,
+                                     start_message)
+            futures[future] = (spec_file, name, log_path)
+        for (done, future) in enumerate(concurrent.futures.as_completed(futures), 1):
+            (spec_file, name, log_path) = futures[future]
+            result = future.result()
+            result.update({'proof_key': keys[spec_file], 'log': log_path})
+            statuses[name] = result
+            write_status(status_path, statuses)
+            if result['status'] != 'error':
+                try:
+                    proof_history.record(spec_file, result['started'], result['wall_time'], result['peak_rss_kb'],
+                                         None, None, result['status'])
+                except sqlite3.Error as e:
+                    print('run-proofs.py: could not record {}: {}'.format(name, e), file=sys.stderr)
+            if result['status'] != 'passed':
+                failed += 1
+            message = '[{}/{}] {} {} ({})'.format(done, len(files), result['status'].upper(), name,
+                                                  proof_history.format_duration(result['wall_time']))
+            write_log(log, lock, message)
+            print(message, flush=True)
+
+    if failed:
+        print('{} of {} proofs did not pass, see {}'.format(failed, len(files), status_path))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
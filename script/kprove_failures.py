@@ -0,0 +1,479 @@
+#!/usr/bin/env python3.6
+
+# Structured records and a searchable index of the remaining paths in kprove --format-failures output.
+#
+# usage: kprove_failures.py parse [--cells <cell,...>] <dump> ...
+#        kprove_failures.py index [--db <file>] [--run <name>] [--cells <cell,...>] <dump or directory> ...
+#        kprove_failures.py query [--db <file>] [--run <name>] [--spec <glob>] [--pc <pc>] [--status <code>]
+#                                 [--k-head <label>] [--cell <cell>=<text>] [--constraint <text>] [--count]
+#        kprove_failures.py show [--db <file>] <path id>
+#
+# A dump is the output of a failed proof: a configuration term (<generatedTop>... or <T>...) per remaining path,
+# each optionally followed by a "/\" line and its constraint, one #And conjunct per line, with separator lines
+# (===..., #Or) and "Key: value" annotations, such as the "Status:" and "Path condition:" of uniswap/results, in
+# between. E.g. uniswap/results/*.txt, or the <spec-file>.log files of schedule-proofs.py.
+#
+# Dumps are read in pieces of READ_SIZE bytes, so their size does not matter: a configuration, usually a single line
+# of megabytes, is scanned as it is read, and only the text of the selected cells is kept, at most --max-text
+# characters of each (the first occurrence of a cell that occurs several times), as of every conjunct, up to
+# --max-constraints conjuncts per path. The pc is the <pc> cell when it is a number, the status the EVMC_... code
+# of <statusCode>, and the k head the first item of <k>.
+#
+# parse prints one JSON record per remaining path. index adds the paths of dumps to an SQLite index,
+# .build/failure-index.db by default, under a run name, the directory of the dump by default, and the spec name,
+# the file name of the dump without its extension. Of a directory, only the *.txt, *.log and *.out files are
+# indexed, as dumps. A dump already indexed with the same size and modification time is skipped, one that
+# changed is indexed again. query lists the indexed paths matching all the given conditions, e.g.
+#   kprove_failures.py query --pc 1234            all paths stuck at pc 1234
+#   kprove_failures.py query --status EVMC_REVERT all paths ending in EVMC_REVERT
+# show prints the annotations, cells and constraint of a path.
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sqlite3
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DEFAULT_DB = os.path.join(ROOT, ".build", "failure-index.db")
+# Extensions of dumps, stripped from the spec name; only files with one are indexed from a directory
+DUMP_EXTENSIONS = (".txt", ".log", ".out")
+
+# The cells of --log-cells in KPROVE_OPTS_java, and the ones around them worth searching
+DEFAULT_CELLS = "k,output,statusCode,localMem,pc,gas,wordStack,callData,memoryUsed,callDepth,id,caller,callValue"
+
+READ_SIZE = 1 << 20
+MAX_TEXT = 4000
+MAX_CONSTRAINTS = 10000
+MAX_ANNOTATIONS = 20
+
+termStartPattern = re.compile(rb"\s*<(generatedTop|T)>")
+separatorPattern = re.compile(rb"\s*(?:={3,}|#Or|\\/)\s*$")
+constraintStartPattern = re.compile(rb"\s*/\\\s*$")
+annotationPattern = re.compile(r"^([A-Z][\w ]{0,40}):\s+(\S.*)$")
+# Cell tags, in KAST form (<pc>(...)) or pretty form (<pc> ... </pc>), parentheses and string starts
+termTokenPattern = re.compile(r'<(/?)([A-Za-z#][\w#-]*)>(\()?|\(|\)|"')
+pcPattern = re.compile(r'^(?:Int\(#")?(\d+)(?:"\))?$')
+statusPattern = re.compile(r"(EVMC_[A-Z0-9_]+?)(?:_NETWORK)?(?:\(|$)")
+kHeadPattern = re.compile(r"\s*(?:#KSequence\(|\.K\b|~>\s*)*\s*([^\s(),]+)")
+
+
+class TermScanner:
+    """Scans a configuration term piece by piece, keeping the text of the wanted cells"""
+
+    def __init__(self, wanted, maxText):
+        self.wanted = wanted
+        self.maxText = maxText
+        self.cells = {}
+        # One entry per open parenthesis or cell: the cell name, and whether it closes with ")" or "</name>"
+        self.stack = []
+        # Open wanted cells: [name, text pieces, length, start of the cell in the current piece]
+        self.captures = []
+        self.inString = False
+
+    def feed(self, text):
+        pos = 0
+        for capture in self.captures:
+            if capture is not None:
+                capture[3] = 0
+        while pos < len(text):
+            if self.inString:
+                end = text.find('"', pos)
+                while end > 0 and text[end - 1] == "\\":
+                    end = text.find('"', end + 1)
+                if end < 0:
+                    break
+                self.inString = False
+                pos = end + 1
+                continue
+            match = termTokenPattern.search(text, pos)
+            if match is None:
+                break
+            pos = match.end()
+            token = match.group(0)
+            if token == '"':
+                self.inString = True
+            elif token == "(":
+                self.stack.append(None)
+            elif token == ")":
+                top = self.stack.pop() if self.stack else None
+                if top is not None and top[0] == ")":
+                    self.closeCell(text, match.start())
+                elif top is not None:
+                    self.stack.append(top)
+            elif match.group(1):
+                name = match.group(2)
+                while self.stack and self.stack[-1] is None:
+                    self.stack.pop()
+                if self.stack and self.stack[-1] == ("</", name):
+                    self.stack.pop()
+                    self.closeCell(text, match.start())
+            else:
+                name = match.group(2)
+                self.stack.append((")" if match.group(3) else "</", name))
+                if name in self.wanted and name not in self.cells \
+                        and not any(capture and capture[0] == name for capture in self.captures):
+                    self.captures.append([name, [], 0, pos])
+                else:
+                    self.captures.append(None)
+        for capture in self.captures:
+            if capture is not None:
+                self.keep(capture, text[capture[3]:])
+
+    def keep(self, capture, text):
+        room = self.maxText - capture[2]
+        if room > 0:
+            capture[1].append(text[:room])
+        capture[2] += len(text)
+
+    def closeCell(self, text, end):
+        capture = self.captures.pop() if self.captures else None
+        if capture is None:
+            return
+        self.keep(capture, text[capture[3]:end])
+        value = "".join(capture[1]).strip()
+        self.cells[capture[0]] = value + "..." if capture[2] > self.maxText else value
+
+
+def truncated(text, maxText):
+    return text if len(text) <= maxText else text[:maxText] + "..."
+
+
+def cellPc(cells):
+    match = pcPattern.match(cells.get("pc", ""))
+    return int(match.group(1)) if match else None
+
+
+def cellStatus(cells):
+    match = statusPattern.search(cells.get("statusCode", ""))
+    return match.group(1) if match else cells.get("statusCode")
+
+
+def cellKHead(cells):
+    match = kHeadPattern.match(cells.get("k", ""))
+    return match.group(1) if match else None
+
+
+def readPiece(f):
+    """The next piece of a line, cut after a "," or a space, so that cell tags are never split"""
+    piece = f.readline(READ_SIZE)
+    if piece.endswith(b"\n") or len(piece) < READ_SIZE:
+        return piece
+    cut = max(piece.rfind(b","), piece.rfind(b" "))
+    if cut > 0:
+        f.seek(cut + 1 - len(piece), os.SEEK_CUR)
+        piece = piece[:cut + 1]
+    return piece
+
+
+def readLine(f, maxText):
+    """The next line, at most maxText characters of it"""
+    line = f.readline(maxText + 1)
+    if len(line) > maxText and not line.endswith(b"\n"):
+        while True:
+            rest = f.readline(READ_SIZE)
+            if not rest or rest.endswith(b"\n"):
+                break
+        return line[:maxText].decode("utf-8", "replace") + "..."
+    return line.decode("utf-8", "replace").rstrip("\n")
+
+
+def splitConjuncts(text):
+    """Splits text at its top-level ",," separators"""
+    parts = []
+    (depth, start, inString, pos) = (0, 0, False, 0)
+    while pos < len(text):
+        char = text[pos]
+        if inString:
+            if char == "\\":
+                pos += 1
+            elif char == '"':
+                inString = False
+        elif char == '"':
+            inString = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and text.startswith(",,", pos):
+            parts.append(text[start:pos].strip())
+            start = pos + 2
+            pos += 1
+        pos += 1
+    return parts + [text[start:].strip()]
+
+
+def conjuncts(line, openAnds):
+    """The conjuncts of a constraint line, and the number of #And( still open after it"""
+    text = line.strip()
+    if text.endswith("..."):
+        return ([text], openAnds)
+    while text.startswith("#And("):
+        text = text[len("#And("):].lstrip()
+        openAnds += 1
+    if text.endswith(",,"):
+        return (splitConjuncts(text[:-2].rstrip()), openAnds)
+    # The last line closes the #And( of the lines before it.
+    while openAnds > 0 and text.endswith(")"):
+        text = text[:-1].rstrip()
+        openAnds -= 1
+    return (splitConjuncts(text), openAnds)
+
+
+def parse(path, wanted, maxText, maxConstraints):
+    """Yields a record per remaining path of a dump"""
+    number = 0
+    annotations = {}
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            piece = readPiece(f)
+            if not piece:
+                return
+            if separatorPattern.match(piece):
+                continue
+            if not termStartPattern.match(piece):
+                if not piece.endswith(b"\n"):
+                    readLine(f, 0)
+                match = annotationPattern.match(piece.decode("utf-8", "replace").strip())
+                if match and len(annotations) < MAX_ANNOTATIONS:
+                    annotations[match.group(1)] = truncated(match.group(2), maxText)
+                continue
+            scanner = TermScanner(wanted, maxText)
+            scanner.feed(piece.decode("utf-8", "replace"))
+            while not piece.endswith(b"\n"):
+                piece = readPiece(f)
+                if not piece:
+                    break
+                scanner.feed(piece.decode("utf-8", "replace"))
+            number += 1
+            record = {"file": path, "number": number, "offset": offset, "annotations": annotations,
+                      "cells": scanner.cells, "pc": cellPc(scanner.cells), "status": cellStatus(scanner.cells),
+                      "kHead": cellKHead(scanner.cells), "constraints": [], "omittedConstraints": 0}
+            annotations = {}
+            lineStart = f.tell()
+            if constraintStartPattern.match(f.readline(READ_SIZE)):
+                openAnds = 0
+                while True:
+                    lineStart = f.tell()
+                    line = readLine(f, maxText)
+                    if not line.strip() or termStartPattern.match(line.encode()) \
+                            or separatorPattern.match(line.encode()):
+                        break
+                    (texts, openAnds) = conjuncts(line, openAnds)
+                    for text in texts:
+                        if len(record["constraints"]) < maxConstraints:
+                            record["constraints"].append(text)
+                        else:
+                            record["omittedConstraints"] += 1
+            # The line after the path is read again as the start of the next one.
+            f.seek(lineStart)
+            yield record
+
+
+def specName(path):
+    name = os.path.basename(path)
+    for extension in DUMP_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def dumpFiles(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for (directory, _, files) in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith(DUMP_EXTENSIONS):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def connect(db):
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok=True)
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS dumps (
+            id          INTEGER PRIMARY KEY,
+            file        TEXT UNIQUE NOT NULL,
+            run         TEXT NOT NULL,
+            spec        TEXT NOT NULL,
+            size        INTEGER NOT NULL,
+            mtime       REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS paths (
+            id          INTEGER PRIMARY KEY,
+            dump        INTEGER NOT NULL,
+            number      INTEGER NOT NULL,
+            offset      INTEGER NOT NULL,
+            pc          INTEGER,
+            status      TEXT,
+            k_head      TEXT,
+            annotations TEXT NOT NULL,
+            omitted     INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS paths_dump ON paths (dump);
+        CREATE INDEX IF NOT EXISTS paths_pc ON paths (pc);
+        CREATE INDEX IF NOT EXISTS paths_status ON paths (status);
+        CREATE TABLE IF NOT EXISTS cells (
+            path        INTEGER NOT NULL,
+            name        TEXT NOT NULL,
+            value       TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS cells_path ON cells (path, name);
+        CREATE TABLE IF NOT EXISTS constraints (
+            path        INTEGER NOT NULL,
+            position    INTEGER NOT NULL,
+            text        TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS constraints_path ON constraints (path, position);""")
+    return conn
+
+
+def deleteDump(conn, dumpId):
+    for table in ("cells", "constraints"):
+        conn.execute("DELETE FROM {} WHERE path IN (SELECT id FROM paths WHERE dump = ?)".format(table), (dumpId,))
+    conn.execute("DELETE FROM paths WHERE dump = ?", (dumpId,))
+    conn.execute("DELETE FROM dumps WHERE id = ?", (dumpId,))
+
+
+def index(args):
+    (dumpCount, pathCount) = (0, 0)
+    with connect(args.db) as conn:
+        for path in dumpFiles(args.dumps):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            row = conn.execute("SELECT id, size, mtime FROM dumps WHERE file = ?", (path,)).fetchone()
+            if row is not None:
+                if (row[1], row[2]) == (stat.st_size, stat.st_mtime):
+                    continue
+                deleteDump(conn, row[0])
+            run = args.run or os.path.basename(os.path.dirname(path))
+            dumpId = conn.execute("INSERT INTO dumps (file, run, spec, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                                  (path, run, specName(path), stat.st_size, stat.st_mtime)).lastrowid
+            for record in parse(path, args.cells, args.max_text, args.max_constraints):
+                pathId = conn.execute("INSERT INTO paths (dump, number, offset, pc, status, k_head, annotations, "
+                                      "omitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (dumpId, record["number"], record["offset"], record["pc"], record["status"],
+                                       record["kHead"], json.dumps(record["annotations"]),
+                                       record["omittedConstraints"])).lastrowid
+                conn.executemany("INSERT INTO cells VALUES (?, ?, ?)",
+                                 [(pathId, name, value) for (name, value) in record["cells"].items()])
+                conn.executemany("INSERT INTO constraints VALUES (?, ?, ?)",
+                                 [(pathId, position, text) for (position, text) in enumerate(record["constraints"])])
+                pathCount += 1
+            conn.commit()
+            dumpCount += 1
+    print("Indexed {} remaining paths of {} dumps in {}.".format(pathCount, dumpCount, args.db))
+
+
+def openIndex(db):
+    if not os.path.exists(db):
+        sys.exit("No failure index {}; run: kprove_failures.py index <dump> ...".format(db))
+    return connect(db)
+
+
+def query(args):
+    conditions = []
+    params = []
+    for (condition, value) in [("dumps.run = ?", args.run), ("paths.pc = ?", args.pc),
+                               ("paths.k_head = ?", args.k_head)]:
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    if args.status is not None:
+        conditions.append("(paths.status = ? OR paths.status LIKE ?)")
+        params += [args.status, args.status + "%"]
+    for cell in args.cell:
+        (name, _, text) = cell.partition("=")
+        conditions.append("paths.id IN (SELECT path FROM cells WHERE name = ? AND instr(value, ?) > 0)")
+        params += [name, text]
+    for text in args.constraint:
+        conditions.append("paths.id IN (SELECT path FROM constraints WHERE instr(text, ?) > 0)")
+        params.append(text)
+    sql = """SELECT paths.id, dumps.run, dumps.spec, paths.number, paths.pc, paths.status, paths.k_head, dumps.file,
+                    paths.offset
+             FROM paths JOIN dumps ON paths.dump = dumps.id {} ORDER BY dumps.run, dumps.spec, paths.number""".format(
+        "WHERE " + " AND ".join(conditions) if conditions else "")
+    with openIndex(args.db) as conn:
+        rows = [row for row in conn.execute(sql, params) if args.spec is None or fnmatch.fnmatch(row[2], args.spec)]
+    if args.count:
+        print(len(rows))
+        return
+    print("{:>6}  {:16}  {:28}  {:>4}  {:>6}  {:24}  {:16}  {}".format(
+        "id", "run", "spec", "path", "pc", "status", "k head", "file:offset"))
+    for (pathId, run, spec, number, pc, status, kHead, path, offset) in rows:
+        print("{:>6}  {:16}  {:28}  {:>4}  {:>6}  {:24}  {:16}  {}:{}".format(
+            pathId, run, spec, number, "-" if pc is None else pc, status or "-", kHead or "-",
+            os.path.relpath(path), offset))
+
+
+def show(args):
+    with openIndex(args.db) as conn:
+        row = conn.execute("""SELECT dumps.run, dumps.spec, dumps.file, paths.number, paths.offset, paths.pc,
+                                     paths.status, paths.k_head, paths.annotations, paths.omitted
+                              FROM paths JOIN dumps ON paths.dump = dumps.id WHERE paths.id = ?""",
+                           (args.pathId,)).fetchone()
+        if row is None:
+            sys.exit("No path {} in {}".format(args.pathId, args.db))
+        (run, spec, path, number, offset, pc, status, kHead, annotations, omitted) = row
+        print("{} {}, path {}: {} at offset {}".format(run, spec, number, path, offset))
+        print("pc: {}  status: {}  k head: {}".format("-" if pc is None else pc, status or "-", kHead or "-"))
+        for (key, value) in json.loads(annotations).items():
+            print("{}: {}".format(key, value))
+        print("Cells:")
+        for (name, value) in conn.execute("SELECT name, value FROM cells WHERE path = ? ORDER BY rowid",
+                                          (args.pathId,)):
+            print("  <{}> {}".format(name, value))
+        print("Constraint:")
+        for (text,) in conn.execute("SELECT text FROM constraints WHERE path = ? ORDER BY position", (args.pathId,)):
+            print("  " + text)
+        if omitted:
+            print("  ... and {} more conjuncts".format(omitted))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse and index the remaining paths of kprove --format-failures output.")
+    subparsers = parser.add_subparsers(dest="cmd")
+    parseParser = subparsers.add_parser("parse", help="print a JSON record per remaining path")
+    indexParser = subparsers.add_parser("index", help="add the remaining paths of dumps to the index")
+    for subparser in (parseParser, indexParser):
+        subparser.add_argument("dumps", nargs="+", metavar="dump")
+        subparser.add_argument("--cells", default=DEFAULT_CELLS, help="comma separated cells to keep (default: {})"
+                               .format(DEFAULT_CELLS))
+        subparser.add_argument("--max-text", type=int, default=MAX_TEXT,
+                               help="characters kept of each cell and conjunct")
+        subparser.add_argument("--max-constraints", type=int, default=MAX_CONSTRAINTS,
+                               help="conjuncts kept of each path")
+    indexParser.add_argument("--run", help="run name (default: the directory of each dump)")
+    queryParser = subparsers.add_parser("query", help="list the indexed paths matching all conditions")
+    queryParser.add_argument("--run")
+    queryParser.add_argument("--spec", help="spec name, or a glob pattern")
+    queryParser.add_argument("--pc", type=int)
+    queryParser.add_argument("--status", help="status code, or its prefix, e.g. EVMC_REVERT")
+    queryParser.add_argument("--k-head", help="first item of <k>, e.g. #halt_EVM")
+    queryParser.add_argument("--cell", action="append", default=[], metavar="CELL=TEXT",
+                             help="the cell contains TEXT")
+    queryParser.add_argument("--constraint", action="append", default=[], metavar="TEXT",
+                             help="a conjunct contains TEXT")
+    queryParser.add_argument("--count", action="store_true", help="only print the number of paths")
+    showParser = subparsers.add_parser("show", help="print the cells and constraint of a path")
+    showParser.add_argument("pathId", type=int)
+    for subparser in (indexParser, queryParser, showParser):
+        subparser.add_argument("--db", default=DEFAULT_DB, help="index file (default: .build/failure-index.db)")
+    args = parser.parse_args()
+    if args.cmd in ("parse", "index"):
+        args.cells = set(args.cells.split(","))
+    if args.cmd == "parse":
+        for path in dumpFiles(args.dumps):
+            for record in parse(path, args.cells, args.max_text, args.max_constraints):
+                record["spec"] = specName(path)
+                print(json.dumps(record))
+    elif args.cmd == "index":
+        index(args)
+    elif args.cmd == "query":
+        query(args)
+    elif args.cmd == "show":
+        show(args)
+    else:
+        parser.print_usage()
+        sys.exit(1)
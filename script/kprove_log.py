@@ -1,67 +1,673 @@
 #!/usr/bin/env python3.6
+import argparse
+import collections
+import concurrent.futures
+import heapq
+import io
 import re
 import sys
 import json
+import time
 import types
 import os
 
 from typing import List
 
 
-def main(debuggDir):
-    debugg_lines = [line.rstrip('\n') for line in open(debuggDir + "/debugg.log", "r")]
+# 93384 node 12_1_487122957_80037969 12_1_487122957_80037969
+# time "node" step_pathId_term_constraint <same>
+# 93390 branch ...
+# Only lines starting with a node or branch event match; their fields are captured in a single pass.
+log_pattern = re.compile(r"(\d+) (?:node (\d+)_(\d+)_(\d+)_(\d+)|(branch) )")
+
+# Seconds to wait for new lines in --follow mode
+POLL_INTERVAL = 0.5
+
+# Default budget of the node cache, in megabytes of node files
+NODE_CACHE_MB = 256
+
+# json.load recurses once per nesting level of a node file, two levels per term.
+JSON_RECURSION_LIMIT = 20000
+
+BRANCH_TEXT = "\nBranching!\n======================================================\n\n"
+
+# In --jobs mode, consecutive steps are rendered in chunks by the same worker, so that they share its node cache.
+CHUNK_STEPS = 8
+# Chunks in flight per worker; bounds the memory held by rendered but not yet written steps.
+CHUNKS_PER_JOB = 4
+
+
+def main(debuggDir, follow=False, stepFilter=None, cacheMb=NODE_CACHE_MB, jobs=1, termFormat=None, delta=False):
+    termFormat = termFormat or TermFormat()
+    if jobs > 1:
+        render_parallel(debuggDir, follow, stepFilter, cacheMb, jobs, termFormat, delta)
+        return
+    nodes = NodeCache(debuggDir, follow, cacheMb * 1024 * 1024)
+    for event in log_events(debuggDir, follow, stepFilter, sys.stdout.flush, delta):
+        render_event(nodes, event, sys.stdout, termFormat)
+
+
+# Yields the steps to print, as the fields of their node lines, and the branch markers to print, as text.
+# With delta, the fields are followed by the term and constraint ids of the node to compare the step with:
+# the previous node of the same path, or for the first step of a path, the node logged before it.
+def log_events(debuggDir, follow, stepFilter, onIdle, delta=False):
     branch_logged = False
-    for line in debugg_lines:
-        if " node " in line:
-            process_node(line)
-            branch_logged = False
-        elif " branch " in line and not branch_logged:
-            print("\nBranching!\n======================================================\n")
+    previousIds = {}
+    lastIds = (None, None)
+    for line in read_lines(debuggDir + "/debugg.log", follow, onIdle):
+        match = log_pattern.match(line)
+        if match is None:
+            continue
+        if match.group(6) is None:
+            fields = match.groups()[:5]
+            if delta:
+                ids = fields[3:5]
+                fields += previousIds.get(fields[2], lastIds)
+                previousIds[fields[2]] = lastIds = ids
+            # Filtered out steps are skipped before their node files are read, and so are the branches after them.
+            if stepFilter is None or stepFilter.accepts(match.group(2), match.group(3)):
+                yield fields
+                branch_logged = False
+            else:
+                branch_logged = True
+        elif not branch_logged:
+            yield BRANCH_TEXT
             branch_logged = True
 
 
-# 93384 node 12_1_487122957_80037969 12_1_487122957_80037969
-# time "node" step_pathId_term_constraint <same>
-rstep_pattern = re.compile("(\d+) node (\d+)_(\d+)_(\d+)_(\d+)")
+def render_event(nodes, event, out, termFormat):
+    if isinstance(event, str):
+        out.write(event)
+    elif len(event) > 5:
+        process_delta(nodes, event, out, termFormat)
+    else:
+        process_node(nodes, event, out, termFormat)
+
+
+# Node cache and term format of a --jobs worker process
+workerNodes = None
+workerFormat = None
+
+
+# Sets up the state of a worker process on its first chunk; every chunk carries the arguments,
+# as ProcessPoolExecutor has no initializer before Python 3.7.
+def init_worker(debuggDir, follow, maxBytes, termFormat):
+    global workerNodes, workerFormat
+    if workerNodes is None:
+        workerNodes = NodeCache(debuggDir, follow, maxBytes)
+        workerFormat = termFormat
+
+
+def render_chunk(initArgs, events):
+    init_worker(*initArgs)
+    out = io.StringIO()
+    for event in events:
+        render_event(workerNodes, event, out, workerFormat)
+    return out.getvalue()
+
+
+# Renders chunks of steps in a pool of worker processes and writes them in log order.
+# At most jobs * CHUNKS_PER_JOB chunks are in flight; the oldest one is written before another is submitted.
+def render_parallel(debuggDir, follow, stepFilter, cacheMb, jobs, termFormat, delta):
+    pending = collections.deque()
+    chunk = []
+    # A following reader submits every step as it comes, instead of waiting for a full chunk.
+    chunkSteps = 1 if follow else CHUNK_STEPS
+
+    initArgs = (debuggDir, follow, cacheMb * 1024 * 1024 // jobs, termFormat)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
 
+        def submit():
+            if chunk:
+                if len(pending) >= jobs * CHUNKS_PER_JOB:
+                    sys.stdout.write(pending.popleft().result())
+                pending.append(executor.submit(render_chunk, initArgs, list(chunk)))
+                chunk.clear()
 
-def process_node(line):
-    (time, step, pathId, termId, constrId) = rstep_pattern.match(line).groups()
-    with open("{}/nodes/{}.json".format(debuggDir, termId), "r") as f:
-        term = json.load(f)
-    with open("{}/nodes/{}.json".format(debuggDir, constrId), "r") as f:
-        constraint = json.load(f)
+        # Everything read so far is written before waiting for more lines.
+        def drain():
+            submit()
+            while pending:
+                sys.stdout.write(pending.popleft().result())
+            sys.stdout.flush()
 
-    print("\nSTEP {} path {} in {} ms\n======================================================\n"
-          .format(step, pathId, time))
-    printTerm(term["term"], None)
+        for event in log_events(debuggDir, follow, stepFilter, drain, delta):
+            chunk.append(event)
+            if len(chunk) >= chunkSteps:
+                submit()
+        drain()
 
-    print("/\\")
-    printTerm(constraint["term"], None)
 
+# Yields the lines of a file one at a time, without the trailing newline.
+# With follow, keeps waiting for lines appended to the file, like `tail -f`; a partially written
+# last line is only yielded once it is complete. onIdle is called before waiting.
+def read_lines(path, follow, onIdle):
+    with open(path, "r") as f:
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    break
+                onIdle()
+                time.sleep(POLL_INTERVAL)
+                continue
+            if not line.endswith("\n") and follow:
+                partial += line
+                continue
+            yield (partial + line).rstrip("\n")
+            partial = ""
 
-def printTerm(term, label, end='\n'):
-    nodeType = term["node"]
-    if nodeType == "KApply":
-        if term["label"] == "#And":
-            printTerm(term["args"][0], None, end="")
-            print(" #And")
-            printTerm(term["args"][1], None)
+
+class StepFilter:
+    """Selects steps by step number range and path id."""
+
+    def __init__(self, first=None, last=None, paths=None):
+        self.first = first
+        self.last = last
+        self.paths = paths
+
+    def accepts(self, step, pathId):
+        step = int(step)
+        return (self.first is None or step >= self.first) \
+            and (self.last is None or step <= self.last) \
+            and (not self.paths or pathId in self.paths)
+
+
+class NodeCache:
+    """Parsed nodes/<id>.json files, least recently used dropped first.
+
+    Consecutive steps usually share their constraint, so its node file is parsed only once.
+    The budget is counted in bytes of node files, as a proxy for the memory of the parsed terms.
+    """
+
+    def __init__(self, debuggDir, follow, maxBytes):
+        self.debuggDir = debuggDir
+        self.follow = follow
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), JSON_RECURSION_LIMIT))
+
+    def get(self, nodeId):
+        entry = self.entries.get(nodeId)
+        if entry is not None:
+            self.entries.move_to_end(nodeId)
+            return entry[0]
+        (node, nodeSize) = self.read(nodeId)
+        self.entries[nodeId] = (node, nodeSize)
+        self.size += nodeSize
+        while self.size > self.maxBytes and len(self.entries) > 1:
+            (_, (_, droppedSize)) = self.entries.popitem(last=False)
+            self.size -= droppedSize
+        return node
+
+    # Returns the parsed node and the size of its file.
+    def read(self, nodeId):
+        path = "{}/nodes/{}.json".format(self.debuggDir, nodeId)
+        # While following, the node file of a freshly logged step may not be written yet.
+        while self.follow and not os.path.exists(path):
+            time.sleep(POLL_INTERVAL)
+        with open(path, "r") as f:
+            node = json.load(f)
+            return (node, f.tell())
+
+
+def process_node(nodes, fields, out, termFormat):
+    (stepTime, step, pathId, termId, constrId) = fields
+    term = nodes.get(termId)
+    constraint = nodes.get(constrId)
+
+    parts = ["\nSTEP {} path {} in {} ms\n======================================================\n\n"
+             .format(step, pathId, stepTime)]
+    printTerm(term["term"], termFormat, parts)
+    parts.append("/\\\n")
+    printTerm(constraint["term"], termFormat, parts)
+    out.write("".join(parts))
+
+
+# Prints only what changed since the node the step is compared with: the cells that differ, and the conjuncts
+# added to or removed from the constraint. Without such a node, the step is printed in full.
+def process_delta(nodes, fields, out, termFormat):
+    (stepTime, step, pathId, termId, constrId, previousTermId, previousConstrId) = fields
+    if previousTermId is None:
+        process_node(nodes, fields[:5], out, termFormat)
+        return
+
+    parts = ["\nSTEP {} path {} in {} ms (changes since {})\n======================================================\n\n"
+             .format(step, pathId, stepTime, previousTermId)]
+    if termId != previousTermId:
+        cells = configuration_cells(nodes.get(termId)["term"], termFormat)
+        previousCells = configuration_cells(nodes.get(previousTermId)["term"], termFormat)
+        for (cellPath, cell) in cells.items():
+            previousCell = previousCells.get(cellPath)
+            if previousCell == cell:
+                continue
+            collection = changed_elements(previousCell, cell) if previousCell is not None else None
+            if collection is not None:
+                # Only the changed bindings of a map, or elements of a set or list, are printed.
+                (label, added, removed) = collection
+                parts.append("~ {}: {}\n".format(cellPath, label))
+                for (sign, elements) in [("+", added), ("-", removed)]:
+                    for element in elements:
+                        parts.append("    {} ".format(sign))
+                        termToString([element], "", termFormat, parts, 0)
+                        parts.append("\n")
+            else:
+                parts.append("{} {}: ".format("~" if previousCell is not None else "+", cellPath))
+                termToString(cell["args"], ", ", termFormat, parts, 0)
+                parts.append("\n")
+        for cellPath in previousCells:
+            if cellPath not in cells:
+                parts.append("- {}\n".format(cellPath))
+    parts.append("/\\\n")
+    if constrId != previousConstrId:
+        added = conjuncts(nodes.get(constrId)["term"])
+        removed = conjuncts(nodes.get(previousConstrId)["term"])
+        for (key, conjunct) in list(added.items()):
+            if key in removed:
+                del added[key]
+                del removed[key]
+        for (sign, changed) in [("+", added), ("-", removed)]:
+            for conjunct in changed.values():
+                parts.append(sign + " ")
+                termToString([conjunct], "", termFormat, parts, 0)
+                parts.append("\n")
+    out.write("".join(parts))
+
+
+def is_cell(term):
+    label = term["label"]
+    return len(label) > 2 and label[0] == "<" and label[-1] == ">"
+
+
+# Returns {cell path: cell} for the innermost cells of a configuration, like <generatedTop>/<ethereum>/.../<pc>.
+# Repeated cells, like the <account> cells of <accounts>, are numbered in order. A term without cells is a single
+# cell with an empty path. Omitted cells are left out.
+def configuration_cells(term, termFormat):
+    cells = collections.OrderedDict()
+    stack = [(term, "")]
+    while stack:
+        (term, parentPath) = stack.pop()
+        if term["node"] != "KApply" or not is_cell(term):
+            if not parentPath:
+                cells[""] = {"args": [term]}
+            continue
+        if term["label"] in termFormat.omit:
+            continue
+        cellPath = parentPath + "/" + term["label"] if parentPath else term["label"]
+        while cellPath in cells:
+            cellPath += "'"
+        children = [arg for arg in term["args"] if arg["node"] == "KApply" and is_cell(arg)]
+        # Cell maps, like <accounts>, hold their cells inside applications of a map label.
+        pending = [arg for arg in term["args"] if arg["node"] == "KApply" and not is_cell(arg)]
+        while pending and not children:
+            current = pending.pop()
+            for arg in current["args"]:
+                if arg["node"] == "KApply":
+                    (children if is_cell(arg) else pending).append(arg)
+        if children:
+            for child in reversed(children):
+                stack.append((child, cellPath))
         else:
-            cells = term["args"]
-            for cell in cells:
-                printTerm(cell, term["label"])
-    else:
-        cellOut = term["token"] if nodeType == "KToken" \
-            else term["name"] if nodeType == "KVariable" \
-            else term["name"] if nodeType == "KVariable" \
-            else term
-        print((label + ": " if label is not None else "") + cellOut, end=end)
+            cells[cellPath] = term
+    return cells
+
+
+# Returns the arguments of nested applications of label, like the conjuncts of an #And tree or the bindings
+# of a _Map_, as {canonical text: argument}.
+def flattened(term, label):
+    result = collections.OrderedDict()
+    stack = [term]
+    while stack:
+        term = stack.pop()
+        if term["node"] == "KApply" and term["label"] == label:
+            stack.extend(reversed(term["args"]))
+        else:
+            result[json.dumps(term, sort_keys=True)] = term
+    return result
+
+
+def conjuncts(term):
+    return flattened(term, "#And")
+
+
+# If both cells hold a collection built by the same binary label, like _Map_, returns the label and the
+# elements added and removed between them. Returns None otherwise.
+def changed_elements(previousCell, cell):
+    if len(cell["args"]) != 1 or len(previousCell["args"]) != 1:
+        return None
+    (term, previousTerm) = (cell["args"][0], previousCell["args"][0])
+    if term["node"] != "KApply" or previousTerm["node"] != "KApply" or term["label"] != previousTerm["label"] \
+            or len(term["args"]) != 2:
+        return None
+    elements = flattened(term, term["label"])
+    previousElements = flattened(previousTerm, term["label"])
+    added = [element for (key, element) in elements.items() if key not in previousElements]
+    removed = [element for (key, element) in previousElements.items() if key not in elements]
+    return (term["label"], added, removed)
+
+
+# Cells given with --output-omit/--output-tostring in dkprove.sh
+dkprove_option_pattern = re.compile(r'--output-(omit|tostring) "([^"]+)"')
+
+
+class TermFormat:
+    """How printTerm shows a term.
+
+    omit: labels of cells that are left out.
+    tostring: labels of cells that are shown on a single line.
+    maxDepth: nesting depth below which subterms are shown as "...".
+    maxWidth: number of arguments shown per term; arguments of nested applications of the same label,
+              like the bindings of a _Map_, count as arguments of a single term.
+    """
+
+    def __init__(self, omit=(), tostring=(), maxDepth=None, maxWidth=None):
+        self.omit = frozenset(omit)
+        self.tostring = frozenset(tostring)
+        self.maxDepth = maxDepth
+        self.maxWidth = maxWidth
+
+    @staticmethod
+    def from_dkprove(path, maxDepth=None, maxWidth=None):
+        with open(path, "r") as f:
+            options = dkprove_option_pattern.findall(f.read())
+        return TermFormat([cell for (kind, cell) in options if kind == "omit"],
+                          [cell for (kind, cell) in options if kind == "tostring"], maxDepth, maxWidth)
+
+    # Returns the arguments of term, with nested applications of the same label flattened,
+    # and the number of arguments left out because of maxWidth.
+    def arguments(self, term):
+        label = term["label"]
+        args = []
+        pending = [term]
+        while pending:
+            current = pending.pop()
+            if current["node"] == "KApply" and current["label"] == label:
+                pending.extend(reversed(current["args"]))
+            else:
+                args.append(current)
+        if self.maxWidth is not None and len(args) > self.maxWidth:
+            return (args[:self.maxWidth], len(args) - self.maxWidth)
+        return (args, 0)
+
+    def too_deep(self, depth):
+        return self.maxDepth is not None and depth > self.maxDepth
+
+
+# Appends to parts one line per token or variable, prefixed by the label of the term it is an argument of,
+# with the two sides of #And on separate lines. Walks the term with an explicit stack, as the conjunctions
+# of path conditions and the maps of KEVM configurations can be nested deeper than the recursion limit.
+def printTerm(term, termFormat, parts):
+    # Entries are (term, label of parent, line end, depth) or text to append.
+    stack = [(term, None, "\n", 0)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            parts.append(entry)
+            continue
+        (term, label, end, depth) = entry
+        nodeType = term["node"]
+        if nodeType == "KApply":
+            termLabel = term["label"]
+            if termLabel == "#And":
+                stack.append((term["args"][1], None, "\n", depth))
+                stack.append(" #And\n")
+                stack.append((term["args"][0], None, "", depth))
+            elif termLabel in termFormat.omit:
+                continue
+            elif termLabel in termFormat.tostring:
+                parts.append(termLabel + ": ")
+                termToString(term["args"], ", ", termFormat, parts, depth + 1)
+                parts.append(end)
+            elif termFormat.too_deep(depth + 1):
+                parts.append(termLabel + ": ..." + end)
+            else:
+                (args, omitted) = termFormat.arguments(term)
+                if omitted:
+                    stack.append("{}: ... ({} more)\n".format(termLabel, omitted))
+                for arg in reversed(args):
+                    stack.append((arg, termLabel, "\n", depth + 1))
+        else:
+            if label is not None:
+                parts.append(label + ": ")
+            if nodeType == "KToken":
+                parts.append(term["token"])
+            elif nodeType == "KVariable":
+                parts.append(term["name"])
+            else:
+                termToString([term], "", termFormat, parts, depth)
+            parts.append(end)
+
+
+# Appends terms to parts on a single line, as label(arg, ...), separated by separator.
+def termToString(terms, separator, termFormat, parts, depth):
+    stack = []
+    for (i, term) in enumerate(reversed(terms)):
+        stack.append((term, depth))
+        if i < len(terms) - 1:
+            stack.append(separator)
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            parts.append(entry)
+            continue
+        (term, depth) = entry
+        nodeType = term["node"]
+        if nodeType == "KToken":
+            parts.append(term["token"])
+        elif nodeType == "KVariable":
+            parts.append(term["name"])
+        elif termFormat.too_deep(depth):
+            parts.append("...")
+        elif nodeType == "KApply":
+            (args, omitted) = termFormat.arguments(term)
+            parts.append(term["label"] + "(")
+            stack.append(")")
+            if omitted:
+                stack.append(", ... ({} more)".format(omitted) if args else "... ({} more)".format(omitted))
+            for (i, arg) in enumerate(reversed(args)):
+                stack.append((arg, depth + 1))
+                if i < len(args) - 1:
+                    stack.append(", ")
+        elif nodeType == "KSequence":
+            items = term["items"]
+            if not items:
+                parts.append(".K")
+            for (i, item) in enumerate(reversed(items)):
+                stack.append((item, depth + 1))
+                if i < len(items) - 1:
+                    stack.append(" ~> ")
+        elif nodeType == "KRewrite":
+            stack.extend([(term["rhs"], depth + 1), " => ", (term["lhs"], depth + 1)])
+        else:
+            parts.append(nodeType)
+
+
+# An instruction is at most 33 bytes long (PUSH32), so a bigger change of <pc> between consecutive steps
+# of a path starts a new basic block.
+MAX_INSTRUCTION_SIZE = 33
+
+
+# Returns the value of the first <pc> cell in term, or None.
+def find_pc(term):
+    stack = [term]
+    while stack:
+        term = stack.pop()
+        if term["node"] == "KApply":
+            if term["label"] == "<pc>" and term["args"] and term["args"][0]["node"] == "KToken":
+                return term["args"][0]["token"]
+            stack.extend(reversed(term["args"]))
+    return None
+
+
+class Profile:
+    """Time per path, branch point and <pc> range, rebuilt from the node and branch lines of a log.
+
+    The time of a step is the time since the step logged before it. A path first seen after a branch line
+    is a child of the path of the step logged before that branch line, its branch point.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.branchPoint = {}
+        self.pathTime = collections.Counter()
+        self.pathSteps = collections.Counter()
+        # path -> [[first pc, last pc, time, steps]] in execution order
+        self.blocks = collections.defaultdict(list)
+        self.stepTimes = []
+        self.lastTime = 0
+        self.lastStep = None
+        self.branch = None
+
+    def add_step(self, stepTime, step, pathId, pc):
+        duration = max(0, stepTime - self.lastTime)
+        self.lastTime = stepTime
+        if pathId not in self.parent:
+            self.parent[pathId] = self.branch[1] if self.branch else None
+            self.branchPoint[pathId] = self.branch
+        self.lastStep = (step, pathId)
+        self.pathTime[pathId] += duration
+        self.pathSteps[pathId] += 1
+        self.stepTimes.append((duration, step, pathId, pc))
+        blocks = self.blocks[pathId]
+        if pc is not None and blocks and blocks[-1][1] is not None \
+                and 0 <= int(pc) - int(blocks[-1][1]) <= MAX_INSTRUCTION_SIZE:
+            blocks[-1][1] = pc
+        elif not blocks or pc is not None or blocks[-1][0] is not None:
+            blocks.append([pc, pc, 0, 0])
+        blocks[-1][2] += duration
+        blocks[-1][3] += 1
+
+    def add_branch(self):
+        self.branch = self.lastStep
+
+    def ancestors(self, pathId):
+        chain = []
+        while pathId is not None:
+            chain.append(pathId)
+            pathId = self.parent.get(pathId)
+        return list(reversed(chain))
+
+    # Time of each branch point: the time of all paths that descend from it.
+    def branch_times(self):
+        times = collections.Counter()
+        paths = collections.Counter()
+        for pathId in self.parent:
+            branch = self.branchPoint[pathId]
+            # Walks up the tree, charging the time of pathId to every branch point it descends from.
+            while branch is not None:
+                times[branch] += self.pathTime[pathId]
+                paths[branch] += 1
+                branch = self.branchPoint.get(branch[1])
+        return (times, paths)
+
+    # Lines of the folded stack format of flamegraph.pl and speedscope: frames separated by ';' and a weight in ms.
+    def folded(self):
+        lines = []
+        for (pathId, blocks) in self.blocks.items():
+            stack = ";".join("path {}".format(ancestor) for ancestor in self.ancestors(pathId))
+            for (firstPc, lastPc, duration, _) in blocks:
+                if duration > 0:
+                    lines.append("{};{} {}".format(stack, pc_range(firstPc, lastPc), duration))
+        return lines
+
+    def report(self, top, out):
+        total = sum(self.pathTime.values())
+        out.write("{} steps on {} paths in {} ms\n".format(len(self.stepTimes), len(self.parent), total))
+
+        out.write("\nHottest paths:\n")
+        for (pathId, duration) in self.pathTime.most_common(top):
+            out.write("  {:>8} ms {:5.1f}%  path {} ({} steps, from {})\n".format(
+                duration, 100.0 * duration / total if total else 0, pathId, self.pathSteps[pathId],
+                "step {} of path {}".format(*self.branchPoint[pathId]) if self.branchPoint[pathId] else "the start"))
+
+        (branchTimes, branchPaths) = self.branch_times()
+        out.write("\nHottest branch points:\n")
+        for ((step, pathId), duration) in branchTimes.most_common(top):
+            out.write("  {:>8} ms  step {} of path {} ({} paths below)\n".format(
+                duration, step, pathId, branchPaths[(step, pathId)]))
+
+        out.write("\nHottest <pc> ranges:\n")
+        ranges = [(duration, pathId, firstPc, lastPc, steps)
+                  for (pathId, blocks) in self.blocks.items() for (firstPc, lastPc, duration, steps) in blocks]
+        for (duration, pathId, firstPc, lastPc, steps) in heapq.nlargest(top, ranges, key=lambda r: r[0]):
+            out.write("  {:>8} ms  {} of path {} ({} steps)\n".format(duration, pc_range(firstPc, lastPc), pathId, steps))
+
+        out.write("\nHottest steps:\n")
+        for (duration, step, pathId, pc) in heapq.nlargest(top, self.stepTimes, key=lambda s: s[0]):
+            out.write("  {:>8} ms  step {} of path {}{}\n".format(
+                duration, step, pathId, " at pc {}".format(pc) if pc is not None else ""))
+
+
+def pc_range(firstPc, lastPc):
+    if firstPc is None:
+        return "pc ?"
+    return "pc {}".format(firstPc) if firstPc == lastPc else "pc {}-{}".format(firstPc, lastPc)
+
+
+# Profiles the steps accepted by stepFilter. Steps outside the filter still count for the tree and step times.
+def profile(debuggDir, stepFilter=None, cacheMb=NODE_CACHE_MB, top=20, foldedFile=None):
+    nodes = NodeCache(debuggDir, False, cacheMb * 1024 * 1024)
+    result = Profile()
+    for line in read_lines(debuggDir + "/debugg.log", False, None):
+        match = log_pattern.match(line)
+        if match is None:
+            continue
+        (stepTime, step, pathId, termId, _, branch) = match.groups()
+        if branch is not None:
+            result.add_branch()
+        elif stepFilter is None or stepFilter.accepts(step, pathId):
+            result.add_step(int(stepTime), int(step), int(pathId), find_pc(nodes.get(termId)["term"]))
+        else:
+            result.lastTime = int(stepTime)
+    result.report(top, sys.stdout)
+    if foldedFile is not None:
+        with open(foldedFile, "w") as f:
+            for line in result.folded():
+                f.write(line + "\n")
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("One argument expected: debugg dir")
-        sys.exit(1)
-    debuggDir = sys.argv[1]
-    main(debuggDir)
+    parser = argparse.ArgumentParser(description="Print the steps of a kprove --debugg log.")
+    parser.add_argument("debuggDir", help="debugg dir, containing debugg.log and nodes/")
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="keep printing steps as they are appended to a log that is still being written")
+    parser.add_argument("--steps", metavar="FIRST:LAST",
+                        help="only print steps in this range, e.g. 100:200, 100: or :200")
+    parser.add_argument("--path", action="append", metavar="PATH_ID", help="only print steps of this path")
+    parser.add_argument("--cache-mb", type=int, default=NODE_CACHE_MB,
+                        help="size of parsed node files kept in memory (default: {})".format(NODE_CACHE_MB))
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="render steps in this many processes; the output keeps the order of the log")
+    parser.add_argument("--omit", action="append", default=[], metavar="CELL", help="leave out this cell, e.g. \"<program>\"")
+    parser.add_argument("--tostring", action="append", default=[], metavar="CELL",
+                        help="show this cell on a single line, e.g. \"<storage>\"")
+    parser.add_argument("--dkprove", action="store_true",
+                        help="omit and show on a single line the cells dkprove.sh passes to --output-omit/--output-tostring")
+    parser.add_argument("--max-depth", type=int, help="show subterms nested deeper than this as ...")
+    parser.add_argument("--max-width", type=int, help="show at most this many arguments of a term, or bindings of a map")
+    parser.add_argument("--delta", action="store_true",
+                        help="print only the cells and constraint conjuncts that changed since the previous step of a path")
+    parser.add_argument("--profile", action="store_true",
+                        help="instead of printing the steps, show the time spent per path, branch point and <pc> range")
+    parser.add_argument("--top", type=int, default=20, help="number of entries per table of --profile (default: 20)")
+    parser.add_argument("--folded", metavar="FILE",
+                        help="with --profile, also write the time per path and <pc> range as folded stacks for flamegraph.pl")
+    args = parser.parse_args()
+    termFormat = TermFormat(args.omit, args.tostring, args.max_depth, args.max_width)
+    if args.dkprove:
+        dkproveFormat = TermFormat.from_dkprove(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dkprove.sh"))
+        termFormat = TermFormat(dkproveFormat.omit | termFormat.omit, dkproveFormat.tostring | termFormat.tostring,
+                                args.max_depth, args.max_width)
+    stepFilter = None
+    if args.steps is not None or args.path:
+        (first, _, last) = (args.steps or ":").partition(":")
+        stepFilter = StepFilter(int(first) if first else None, int(last) if last else None, args.path)
+    try:
+        if args.profile:
+            profile(args.debuggDir, stepFilter, args.cache_mb, args.top, args.folded)
+        else:
+            main(args.debuggDir, args.follow, stepFilter, args.cache_mb, args.jobs, termFormat, args.delta)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3.6
+
+# Keeps a corpus of the Z3 queries of kprove proofs, replays it against a local z3, and memoizes z3 for kprove.
+#
+# usage: kprove_smt.py capture [--corpus <dir>] [--spec <name>] [<log file> ...]
+#        kprove_smt.py replay [--corpus <dir>] [--spec <name>] [--smt-prelude <file>] ... [--timeout <ms>] [-j <jobs>]
+#                             [--z3 <path>] [--save <results.json>] [--baseline <results.json>] [--top <n>]
+#        kprove_smt.py solve [--cache <dir>] [<z3 argument> ...]
+#
+# capture reads the output of kprove --debug-z3-queries (make test DEBUG=true), one log file per spec, and adds its
+# queries to the corpus, .build/smt-corpus by default. Queries are normalized as in kprove_z3.py, so a query sent by
+# several specs, or by several runs of a spec, is stored once, <hash>.smt2, with <hash>.json recording the specs that
+# sent it and the results and times seen in the logs.
+#
+# replay runs z3 on every query of the corpus (of --spec only), after the SMT preludes (resources/evm.smt2 by
+# default), in parallel, and reports the results and times. --timeout is the z3 timeout of each query in
+# milliseconds, as kprove --z3-impl-timeout. Replays are compared with --save'd results of an earlier replay given
+# by --baseline, e.g. to measure a prelude or timeout change:
+#   kprove_smt.py replay --save before.json
+#   kprove_smt.py replay --smt-prelude new-evm.smt2 --timeout 500 --baseline before.json
+#
+# solve is a memoizing z3: it reads a query on its standard input, as kprove --z3-executable sends it, and answers
+# it from the cache, .build/z3-cache by default, or runs the real z3 and caches its answer. Only sat and unsat are
+# cached, keyed by the z3 arguments (which include the timeout) and the normalized query, prelude included, so
+# identical queries of different specs and of reruns are solved once. script/z3-shim/z3 runs it under the name z3;
+# make test Z3_CACHE=true puts it first in PATH. The real z3 is $Z3_REAL, or the next z3 in PATH.
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from kprove_z3 import DEFAULT_PRELUDE, ROOT, Prelude, analyze, formatResults, formatSeconds, normalize
+
+DEFAULT_CORPUS = os.path.join(ROOT, ".build", "smt-corpus")
+DEFAULT_CACHE = os.path.join(ROOT, ".build", "z3-cache")
+
+# Answers of z3 that do not depend on the time it was given
+CACHED_RESULTS = {"sat", "unsat"}
+
+
+def writeAtomic(path, text):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmpPath, "w") as f:
+        f.write(text)
+    os.replace(tmpPath, path)
+
+
+def readJson(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class Corpus:
+    """Normalized queries, <hash>.smt2, with the specs that sent them and their logged results, <hash>.json"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def queryFile(self, queryHash):
+        return os.path.join(self.path, queryHash[:2], queryHash + ".smt2")
+
+    def infoFile(self, queryHash):
+        return os.path.join(self.path, queryHash[:2], queryHash + ".json")
+
+    def add(self, spec, query):
+        if not os.path.exists(self.queryFile(query.hash)):
+            writeAtomic(self.queryFile(query.hash), query.text + "\n")
+        info = readJson(self.infoFile(query.hash), {"specs": {}, "results": {}, "time": 0.0})
+        info["specs"][spec] = info["specs"].get(spec, 0) + query.count
+        for (result, count) in query.results.items():
+            info["results"][result] = info["results"].get(result, 0) + count
+        info["time"] += query.totalTime
+        writeAtomic(self.infoFile(query.hash), json.dumps(info, indent=2, sort_keys=True) + "\n")
+
+    def hashes(self, spec=None):
+        if not os.path.isdir(self.path):
+            return []
+        hashes = []
+        for prefix in sorted(os.listdir(self.path)):
+            directory = os.path.join(self.path, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".smt2"):
+                    queryHash = name[:-len(".smt2")]
+                    if spec is None or spec in self.info(queryHash)["specs"]:
+                        hashes.append(queryHash)
+        return hashes
+
+    def text(self, queryHash):
+        with open(self.queryFile(queryHash)) as f:
+            return f.read()
+
+    def info(self, queryHash):
+        return readJson(self.infoFile(queryHash), {"specs": {}, "results": {}, "time": 0.0})
+
+
+def capture(args):
+    corpus = Corpus(args.corpus)
+    prelude = Prelude([])
+    streams = [(args.spec or "-", sys.stdin)] if not args.logs or args.logs == ["-"] else []
+    for log in args.logs if not streams else []:
+        spec = args.spec if args.spec and len(args.logs) == 1 else os.path.basename(log)
+        streams.append((spec[:-len(".log")] if spec.endswith(".log") else spec, log))
+    for (spec, source) in streams:
+        if source is sys.stdin:
+            specQueries = analyze(spec, source, prelude, False)
+        else:
+            with open(source, errors="replace") as stream:
+                specQueries = analyze(spec, stream, prelude, False)
+        new = 0
+        for query in specQueries.queries.values():
+            new += not os.path.exists(corpus.queryFile(query.hash))
+            corpus.add(spec, query)
+        print("{}: {} queries, {} distinct, {} new in {}".format(
+            spec, sum(query.count for query in specQueries.queries.values()), len(specQueries.queries), new,
+            args.corpus))
+
+
+def solverCommand(z3, timeout):
+    return [z3, "-smt2", "-in"] + (["-t:{}".format(timeout)] if timeout is not None else [])
+
+
+def solverInput(preludeText, queryText):
+    query = queryText if "(check-sat)" in queryText else queryText + "\n(check-sat)\n"
+    return preludeText + "\n" + query
+
+
+def runSolver(command, text):
+    start = time.time()
+    result = subprocess.run(command, input=text, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    seconds = time.time() - start
+    lines = result.stdout.split()
+    answer = lines[0] if lines and lines[0] in ("sat", "unsat", "unknown", "timeout") else "error"
+    return (answer, seconds)
+
+
+def replay(args):
+    corpus = Corpus(args.corpus)
+    hashes = corpus.hashes(args.spec)
+    if not hashes:
+        sys.exit("No queries in {}{}".format(args.corpus, " for " + args.spec if args.spec else ""))
+    preludePaths = args.smt_prelude or ([DEFAULT_PRELUDE] if os.path.exists(DEFAULT_PRELUDE) else [])
+    preludeText = ""
+    for path in preludePaths:
+        with open(path) as f:
+            preludeText += f.read() + "\n"
+    command = solverCommand(args.z3, args.timeout)
+
+    def solve(queryHash):
+        return (queryHash,) + runSolver(command, solverInput(preludeText, corpus.text(queryHash)))
+
+    start = time.time()
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        for (queryHash, answer, seconds) in executor.map(solve, hashes):
+            results[queryHash] = {"result": answer, "time": seconds}
+    wallTime = time.time() - start
+
+    answers = {}
+    for result in results.values():
+        answers[result["result"]] = answers.get(result["result"], 0) + 1
+    print("{} queries of {}, {} in {} ({} jobs), solver time {}: {}".format(
+        len(results), args.corpus, " ".join(command), formatSeconds(wallTime), args.jobs,
+        formatSeconds(sum(result["time"] for result in results.values())), formatResults(answers)))
+    print("Slowest queries:")
+    for queryHash in sorted(results, key=lambda h: results[h]["time"], reverse=True)[:args.top]:
+        info = corpus.info(queryHash)
+        print("  {:>9}  {:8}  {}  specs: {}".format(formatSeconds(results[queryHash]["time"]),
+                                                   results[queryHash]["result"], queryHash[:12],
+                                                   ", ".join(sorted(info["specs"]))))
+
+    # Answers that differ from those kprove logged, e.g. unknown because of the timeout
+    changed = []
+    for (queryHash, result) in sorted(results.items()):
+        logged = set(corpus.info(queryHash)["results"]) & CACHED_RESULTS
+        if logged and result["result"] not in logged:
+            changed.append("  {}  logged {}, now {}".format(queryHash[:12], "/".join(sorted(logged)),
+                                                            result["result"]))
+    if changed:
+        print("Results that differ from the logs:")
+        print("\n".join(changed))
+
+    if args.baseline:
+        compare(readJson(args.baseline, {}), results, args.top)
+    if args.save:
+        writeAtomic(args.save, json.dumps({"command": command, "preludes": preludePaths, "results": results},
+                                          indent=2, sort_keys=True) + "\n")
+
+
+def compare(baseline, results, top):
+    before = baseline.get("results", {})
+    common = [queryHash for queryHash in results if queryHash in before]
+    if not common:
+        print("No query in common with the baseline")
+        return
+    beforeTime = sum(before[queryHash]["time"] for queryHash in common)
+    afterTime = sum(results[queryHash]["time"] for queryHash in common)
+    print("Against the baseline ({}), {} queries in common: solver time {} -> {} ({:+.1f}%)".format(
+        " ".join(baseline.get("command", [])), len(common), formatSeconds(beforeTime), formatSeconds(afterTime),
+        100 * (afterTime - beforeTime) / beforeTime if beforeTime else 0.0))
+    changed = [queryHash for queryHash in common if before[queryHash]["result"] != results[queryHash]["result"]]
+    for queryHash in changed:
+        print("  {}  {} -> {}".format(queryHash[:12], before[queryHash]["result"], results[queryHash]["result"]))
+    print("Largest time changes:")
+    for queryHash in sorted(common, key=lambda h: abs(results[h]["time"] - before[h]["time"]), reverse=True)[:top]:
+        print("  {:>9} -> {:>9}  {}".format(formatSeconds(before[queryHash]["time"]),
+                                           formatSeconds(results[queryHash]["time"]), queryHash[:12]))
+
+
+def realSolver():
+    """The z3 that the shim stands for: $Z3_REAL, or the first z3 in PATH that is not the shim"""
+    if os.environ.get("Z3_REAL"):
+        return os.environ["Z3_REAL"]
+    shims = {os.path.realpath(path) for path in (os.environ.get("Z3_SHIM", ""), sys.argv[0]) if path}
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = os.path.join(directory or ".", "z3")
+        if os.access(candidate, os.X_OK) and os.path.realpath(candidate) not in shims:
+            return candidate
+    sys.exit("kprove_smt.py: no z3 in PATH; set Z3_REAL")
+
+
+def solve(args):
+    z3 = realSolver()
+    # Queries passed as files are not memoized.
+    if any(not arg.startswith("-") for arg in args.z3_args):
+        os.execv(z3, [z3] + args.z3_args)
+    text = sys.stdin.read()
+    digest = hashlib.sha256()
+    for part in args.z3_args + [normalize(text)]:
+        digest.update(part.encode() + b"\0")
+    key = digest.hexdigest()
+    cacheFile = os.path.join(args.cache, key[:2], key)
+    try:
+        with open(cacheFile) as f:
+            sys.stdout.write(f.read())
+        return
+    except OSError:
+        pass
+    result = subprocess.run([z3] + args.z3_args, input=text, stdout=subprocess.PIPE, universal_newlines=True)
+    sys.stdout.write(result.stdout)
+    sys.stdout.flush()
+    if result.returncode == 0 and result.stdout.strip() in CACHED_RESULTS:
+        writeAtomic(cacheFile, result.stdout)
+    sys.exit(result.returncode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture, replay and memoize the Z3 queries of kprove.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    captureParser = subparsers.add_parser("capture", help="add the queries of kprove --debug-z3-queries logs")
+    captureParser.add_argument("logs", nargs="*", help="kprove output files, one per spec; the standard input by default")
+    captureParser.add_argument("--corpus", default=DEFAULT_CORPUS, help="query corpus directory")
+    captureParser.add_argument("--spec", help="spec name, for the standard input or a single log file")
+    captureParser.set_defaults(func=capture)
+
+    replayParser = subparsers.add_parser("replay", help="run z3 on the queries of the corpus")
+    replayParser.add_argument("--corpus", default=DEFAULT_CORPUS, help="query corpus directory")
+    replayParser.add_argument("--spec", help="only replay the queries of this spec")
+    replayParser.add_argument("--smt-prelude", action="append", help="SMT prelude file (default: resources/evm.smt2)")
+    replayParser.add_argument("--timeout", type=int, help="z3 timeout of each query, in milliseconds")
+    replayParser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of parallel z3 runs")
+    replayParser.add_argument("--z3", default="z3", help="z3 executable")
+    replayParser.add_argument("--save", help="write the results to this file")
+    replayParser.add_argument("--baseline", help="compare with the results saved by an earlier replay")
+    replayParser.add_argument("--top", type=int, default=10, help="number of queries listed")
+    replayParser.set_defaults(func=replay)
+
+    solveParser = subparsers.add_parser("solve", help="memoizing z3, reading the query on the standard input")
+    solveParser.add_argument("--cache", default=os.environ.get("Z3_CACHE_DIR", DEFAULT_CACHE),
+                             help="cache directory ($Z3_CACHE_DIR)")
+    solveParser.add_argument("z3_args", nargs=argparse.REMAINDER, help="z3 arguments")
+    solveParser.set_defaults(func=solve)
+
+    args = parser.parse_args()
+    if getattr(args, "z3_args", None) and args.z3_args[0] == "--":
+        args.z3_args = args.z3_args[1:]
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3.6
+
+# Random access to the steps of a kprove --debugg trace.
+#
+# usage: kprove_trace.py index <debugg-dir>
+#        kprove_trace.py paths <debugg-dir>
+#        kprove_trace.py branches <debugg-dir>
+#        kprove_trace.py steps <debugg-dir> [--path <id>] [--from <step>] [--to <step>] [--render] [--cache-mb <mb>]
+#
+# `index` makes one pass over debugg.log and the node files of its steps, and writes <debugg-dir>/trace-index.db:
+# the byte offset in debugg.log of every step and branch point, and the node files, stored once per distinct
+# content. Indexing a log that has grown since resumes where the previous run stopped.
+# The other commands query the index: the paths with their step ranges, the branch points, and the steps of a path
+# in a step range, printed as kprove_log.py does with --render.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import zlib
+
+from kprove_log import NODE_CACHE_MB, NodeCache, log_pattern, process_node, TermFormat
+
+INDEX_FILE = "trace-index.db"
+
+
+def connect(debuggDir):
+    conn = sqlite3.connect(os.path.join(debuggDir, INDEX_FILE))
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS steps (
+            step      INTEGER NOT NULL,
+            path      INTEGER NOT NULL,
+            time      INTEGER NOT NULL,
+            term_id   TEXT NOT NULL,
+            constr_id TEXT NOT NULL,
+            offset    INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS steps_path ON steps (path, step);
+        CREATE TABLE IF NOT EXISTS branches (
+            offset    INTEGER PRIMARY KEY,
+            time      INTEGER NOT NULL,
+            step      INTEGER,
+            path      INTEGER,
+            line      TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS node_ids (
+            id        TEXT PRIMARY KEY,
+            hash      TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS nodes (
+            hash      TEXT PRIMARY KEY,
+            data      BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS progress (
+            log_offset INTEGER NOT NULL);""")
+    return conn
+
+
+def index(debuggDir):
+    nodesAdded = 0
+    with connect(debuggDir) as conn:
+        row = conn.execute("SELECT log_offset FROM progress").fetchone()
+        offset = row[0] if row else 0
+        logPath = os.path.join(debuggDir, "debugg.log")
+        if os.path.getsize(logPath) < offset:
+            sys.exit("{} is shorter than when it was indexed; delete {} to index it again."
+                     .format(logPath, os.path.join(debuggDir, INDEX_FILE)))
+        last = conn.execute("SELECT step, path FROM steps ORDER BY offset DESC LIMIT 1").fetchone() or (None, None)
+        (stepCount, branchCount) = (0, 0)
+        with open(logPath, "rb") as f:
+            f.seek(offset)
+            for rawLine in f:
+                # A partially written last line is indexed by the next run.
+                if not rawLine.endswith(b"\n"):
+                    break
+                match = log_pattern.match(rawLine.decode("utf-8", "replace"))
+                if match is not None:
+                    (stepTime, step, pathId, termId, constrId, branch) = match.groups()
+                    if branch is None:
+                        conn.execute("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?)",
+                                     (int(step), int(pathId), int(stepTime), termId, constrId, offset))
+                        nodesAdded += add_node(conn, debuggDir, termId) + add_node(conn, debuggDir, constrId)
+                        last = (int(step), int(pathId))
+                        stepCount += 1
+                    else:
+                        conn.execute("INSERT INTO branches VALUES (?, ?, ?, ?, ?)",
+                                     (offset, int(stepTime), last[0], last[1], rawLine.decode("utf-8", "replace").rstrip("\n")))
+                        branchCount += 1
+                offset += len(rawLine)
+        conn.execute("DELETE FROM progress")
+        conn.execute("INSERT INTO progress VALUES (?)", (offset,))
+    print("Indexed {} steps, {} branch points and {} distinct nodes.".format(stepCount, branchCount, nodesAdded))
+
+
+# Stores the node file of nodeId, unless it is already indexed. Returns 1 if new content was stored.
+def add_node(conn, debuggDir, nodeId):
+    if conn.execute("SELECT 1 FROM node_ids WHERE id = ?", (nodeId,)).fetchone():
+        return 0
+    with open("{}/nodes/{}.json".format(debuggDir, nodeId), "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    conn.execute("INSERT INTO node_ids VALUES (?, ?)", (nodeId, digest))
+    if conn.execute("SELECT 1 FROM nodes WHERE hash = ?", (digest,)).fetchone():
+        return 0
+    conn.execute("INSERT INTO nodes VALUES (?, ?)", (digest, zlib.compress(data)))
+    return 1
+
+
+class IndexedNodes(NodeCache):
+    """Parsed nodes read from the index, least recently used dropped first, as in kprove_log.NodeCache."""
+
+    def __init__(self, conn, maxBytes):
+        NodeCache.__init__(self, None, False, maxBytes)
+        self.conn = conn
+
+    def read(self, nodeId):
+        row = self.conn.execute("SELECT data FROM nodes JOIN node_ids USING (hash) WHERE id = ?", (nodeId,)).fetchone()
+        if row is None:
+            sys.exit("Node {} is not indexed.".format(nodeId))
+        data = zlib.decompress(row[0])
+        return (json.loads(data.decode()), len(data))
+
+
+def open_index(debuggDir):
+    if not os.path.exists(os.path.join(debuggDir, INDEX_FILE)):
+        sys.exit("{} is not indexed; run: kprove_trace.py index {}".format(debuggDir, debuggDir))
+    return connect(debuggDir)
+
+
+def paths(debuggDir):
+    with open_index(debuggDir) as conn:
+        print("{:>6}  {:>8}  {:>8}  {:>8}".format("path", "steps", "first", "last"))
+        for row in conn.execute("SELECT path, COUNT(*), MIN(step), MAX(step) FROM steps GROUP BY path ORDER BY path"):
+            print("{:>6}  {:>8}  {:>8}  {:>8}".format(*row))
+
+
+def branches(debuggDir):
+    with open_index(debuggDir) as conn:
+        print("{:>10}  {:>8}  {:>6}  {:>8}  {}".format("offset", "after", "path", "time", "line"))
+        for (offset, branchTime, step, pathId, line) in conn.execute(
+                "SELECT offset, time, step, path, line FROM branches ORDER BY offset"):
+            print("{:>10}  {:>8}  {:>6}  {:>8}  {}".format(
+                offset, "-" if step is None else step, "-" if pathId is None else pathId, branchTime, line))
+
+
+def steps(debuggDir, pathId, first, last, render, cacheMb=NODE_CACHE_MB):
+    conditions = []
+    params = []
+    for (condition, value) in [("path = ?", pathId), ("step >= ?", first), ("step <= ?", last)]:
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    query = "SELECT time, step, path, term_id, constr_id, offset FROM steps {} ORDER BY {}".format(
+        "WHERE " + " AND ".join(conditions) if conditions else "", "step" if pathId is not None else "offset")
+    with open_index(debuggDir) as conn:
+        nodes = IndexedNodes(conn, cacheMb * 1024 * 1024)
+        termFormat = TermFormat()
+        for (stepTime, step, stepPath, termId, constrId, offset) in conn.execute(query, params).fetchall():
+            if render:
+                process_node(nodes, (str(stepTime), str(step), str(stepPath), termId, constrId), sys.stdout, termFormat)
+            else:
+                print("step {} path {} at {} ms: term {} constraint {} (offset {})"
+                      .format(step, stepPath, stepTime, termId, constrId, offset))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index a kprove --debugg trace and query it.")
+    subparsers = parser.add_subparsers(dest="cmd")
+    for (name, description) in [("index", "index debugg.log and the node files"),
+                                ("paths", "list the paths and their step ranges"),
+                                ("branches", "list the branch points")]:
+        subparsers.add_parser(name, help=description).add_argument("debuggDir")
+    stepsParser = subparsers.add_parser("steps", help="list the steps of a path in a step range")
+    stepsParser.add_argument("debuggDir")
+    stepsParser.add_argument("--path", type=int)
+    stepsParser.add_argument("--from", dest="first", type=int)
+    stepsParser.add_argument("--to", dest="last", type=int)
+    stepsParser.add_argument("--render", action="store_true", help="print the steps as kprove_log.py does")
+    stepsParser.add_argument("--cache-mb", type=int, default=NODE_CACHE_MB,
+                             help="size of parsed node files kept in memory (default: {})".format(NODE_CACHE_MB))
+    args = parser.parse_args()
+    if args.cmd == "index":
+        index(args.debuggDir)
+    elif args.cmd == "paths":
+        paths(args.debuggDir)
+    elif args.cmd == "branches":
+        branches(args.debuggDir)
+    elif args.cmd == "steps":
+        steps(args.debuggDir, args.path, args.first, args.last, args.render, args.cache_mb)
+    else:
+        parser.print_usage()
+        sys.exit(1)
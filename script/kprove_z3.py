@@ -0,0 +1,302 @@
+#!/usr/bin/env python3.6
+
+# Analyzes the Z3 queries in the output of kprove --debug-z3-queries (make test DEBUG=true).
+#
+# usage: kprove_z3.py [--spec <name>] [--smt-prelude <file>] ... [--top <n>] [--show <hash>] [<log file> ...]
+#
+# E.g. kprove_z3.py --smt-prelude resources/evm.smt2 output/gnosis-erc20-1/*.log
+#      kprove ... --debug-z3-queries 2>&1 | kprove_z3.py --spec transfer-success-1
+#
+# The output is streamed, so a proof can be piped into it. Every query is extracted with its result and time,
+# normalized (comments and layout dropped, declared names renamed in order of declaration, so that queries differing
+# only in fresh variable names are equal) and identified by the hash of its normalized text. For every spec, one per
+# log file, named after the file, the report shows the queries that took the most solver time, the most repeated
+# ones, and the symbols and axioms of the SMT preludes (resources/evm.smt2 by default) that the queries use.
+# --show prints the normalized query with the given hash prefix.
+#
+# Query time is read from "Z3 query time" lines when the log has them. Otherwise, when reading a pipe, it is the
+# time between the end of the query and its result in the stream; for log files it is unknown, and queries are
+# ranked by count.
+
+import argparse
+import hashlib
+import os
+import re
+import stat
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DEFAULT_PRELUDE = os.path.join(ROOT, "resources", "evm.smt2")
+
+# Characters of a query shown in the report
+SNIPPET_LENGTH = 100
+
+queryStartPattern = re.compile(r"^\s*Z3 query(?! result| time)\b:?\s*(.*)$", re.IGNORECASE)
+resultPattern = re.compile(r"^\s*(?:Z3 (?:query )?result:?\s*)?(unsat|sat|unknown|timeout)\b", re.IGNORECASE)
+timePattern = re.compile(r"Z3 (?:query )?time:?\s*([0-9.]+)\s*(ms|s)?", re.IGNORECASE)
+tokenPattern = re.compile(r'\(|\)|\|[^|]*\||"(?:[^"]|"")*"|[^\s()";]+')
+declarationHeads = {"declare-fun", "declare-const", "define-fun", "define-const", "declare-sort", "define-sort"}
+
+
+def tokens(text):
+    return tokenPattern.findall(re.sub(r";[^\n]*", "", text))
+
+
+def parenDepth(line):
+    line = line.split(";", 1)[0]
+    return line.count("(") - line.count(")")
+
+
+def normalize(text):
+    """Returns the normalized query: tokens separated by single spaces, declared names renamed to v0, v1, ..."""
+    toks = tokens(text)
+    renames = {}
+    for i in range(1, len(toks) - 1):
+        tok = toks[i]
+        if toks[i - 1] == "(" and tok in declarationHeads and toks[i + 1] not in renames:
+            renames[toks[i + 1]] = "v{}".format(len(renames))
+    return " ".join(renames.get(tok, tok) for tok in toks).replace("( ", "(").replace(" )", ")")
+
+
+def topLevelForms(text):
+    """Yields the tokens of each top-level s-expression, with the comment lines before it"""
+    comment = None
+    depth = 0
+    form = []
+    for line in text.splitlines():
+        if depth == 0 and line.strip().startswith(";"):
+            comment = line.strip().lstrip(";").strip()
+            continue
+        for tok in tokens(line):
+            form.append(tok)
+            depth += {"(": 1, ")": -1}.get(tok, 0)
+            if depth == 0 and form:
+                yield (form, comment)
+                form = []
+
+
+class Prelude:
+    """Symbols defined by SMT prelude files, and their axioms, with the symbols each axiom mentions"""
+
+    def __init__(self, paths):
+        self.symbols = {}
+        self.axioms = []
+        for path in paths:
+            with open(path) as f:
+                text = f.read()
+            name = os.path.basename(path)
+            forms = list(topLevelForms(text))
+            for (form, comment) in forms:
+                if len(form) > 2 and form[1] in declarationHeads:
+                    self.symbols[form[2]] = name
+            asserts = [(form, comment) for (form, comment) in forms if len(form) > 1 and form[1] == "assert"]
+            for (number, (form, comment)) in enumerate(asserts, 1):
+                label = form[form.index(":named") + 1] if ":named" in form else "assert #{}".format(number)
+                used = frozenset(tok for tok in form if tok in self.symbols)
+                self.axioms.append(("{}: {}".format(name, label) + (" ({})".format(comment) if comment else ""), used))
+
+    def touched(self, queryTokens):
+        """Prelude symbols and axioms a query uses"""
+        symbols = queryTokens & self.symbols.keys()
+        axioms = [label for (label, used) in self.axioms if used & symbols]
+        return ["{}: {}".format(self.symbols[symbol], symbol) for symbol in sorted(symbols)] + axioms
+
+
+class Query:
+
+    def __init__(self, text, prelude):
+        self.text = text
+        self.hash = hashlib.sha256(text.encode()).hexdigest()
+        self.touched = prelude.touched(set(tokens(text)))
+        self.count = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.timed = False
+        self.results = {}
+
+    def add(self, result, seconds):
+        self.count += 1
+        self.results[result] = self.results.get(result, 0) + 1
+        if seconds is not None:
+            self.timed = True
+            self.totalTime += seconds
+            self.maxTime = max(self.maxTime, seconds)
+
+    def snippet(self):
+        return self.text if len(self.text) <= SNIPPET_LENGTH else self.text[:SNIPPET_LENGTH - 3] + "..."
+
+
+class SpecQueries:
+    """Distinct queries of one spec, in a single pass over its output"""
+
+    def __init__(self, spec, prelude, live):
+        self.spec = spec
+        self.prelude = prelude
+        self.live = live
+        self.queries = {}
+        # Query being read, and query waiting for its result
+        self.lines = None
+        self.depth = 0
+        self.pending = None
+        self.pendingSince = None
+        self.pendingTime = None
+        self.pendingResult = None
+        self.pendingElapsed = None
+
+    def feed(self, line):
+        if self.lines is not None:
+            stripped = line.strip()
+            if self.depth > 0 or stripped.startswith("(") or stripped.startswith(";") or not stripped:
+                self.lines.append(line)
+                self.depth += parenDepth(line)
+                return
+            self.endQuery()
+        match = queryStartPattern.match(line)
+        if match:
+            self.flushPending()
+            self.lines = []
+            self.depth = 0
+            if match.group(1):
+                self.feed(match.group(1))
+            return
+        if self.pending is None:
+            return
+        # The time of a query may be printed before or after its result.
+        match = timePattern.search(line)
+        if match:
+            self.pendingTime = float(match.group(1)) / (1000 if match.group(2) == "ms" else 1)
+            if self.pendingResult is not None:
+                self.flushPending()
+            return
+        match = resultPattern.match(line)
+        if match and self.pendingResult is None:
+            self.pendingResult = match.group(1).lower()
+            if self.live:
+                self.pendingElapsed = time.time() - self.pendingSince
+            if self.pendingTime is not None:
+                self.flushPending()
+
+    def endQuery(self):
+        text = normalize("".join(self.lines))
+        self.lines = None
+        if text:
+            self.pending = text
+            self.pendingSince = time.time()
+            self.pendingTime = None
+            self.pendingResult = None
+            self.pendingElapsed = None
+
+    def flushPending(self):
+        if self.pending is None:
+            return
+        query = self.queries.get(self.pending)
+        if query is None:
+            query = self.queries[self.pending] = Query(self.pending, self.prelude)
+        query.add(self.pendingResult or "no result",
+                  self.pendingTime if self.pendingTime is not None else self.pendingElapsed)
+        self.pending = None
+
+    def close(self):
+        if self.lines is not None:
+            self.endQuery()
+        self.flushPending()
+
+
+def formatSeconds(seconds):
+    return "{:.3f}s".format(seconds) if seconds < 10 else "{:.1f}s".format(seconds)
+
+
+def formatResults(results):
+    return ",".join("{}:{}".format(result, count) for (result, count) in sorted(results.items()))
+
+
+def report(specQueries, top):
+    queries = list(specQueries.queries.values())
+    total = sum(query.count for query in queries)
+    timed = any(query.timed for query in queries)
+    results = {}
+    for query in queries:
+        for (result, count) in query.results.items():
+            results[result] = results.get(result, 0) + count
+    print("== {}: {} queries, {} distinct, {}, {}".format(
+        specQueries.spec, total, len(queries),
+        "solver time " + formatSeconds(sum(query.totalTime for query in queries)) if timed else "no timing",
+        formatResults(results) or "no results"))
+    if not queries:
+        return
+
+    def printQuery(query):
+        print("  {:>9} {:>6} {:>9}  {}  {:24}  {}".format(
+            formatSeconds(query.totalTime) if query.timed else "-", query.count,
+            formatSeconds(query.maxTime) if query.timed else "-", query.hash[:12],
+            formatResults(query.results), query.snippet()))
+        if query.touched:
+            print("  {:>38}prelude: {}".format("", ", ".join(query.touched)))
+
+    header = "  {:>9} {:>6} {:>9}  {:12}  {:24}  {}".format("total", "count", "max", "hash", "results", "query")
+    if timed:
+        print("Most expensive queries:")
+        print(header)
+        for query in sorted(queries, key=lambda q: q.totalTime, reverse=True)[:top]:
+            printQuery(query)
+    print("Most repeated queries:")
+    print(header)
+    for query in sorted(queries, key=lambda q: (q.count, q.totalTime), reverse=True)[:top]:
+        printQuery(query)
+
+    usage = {}
+    for query in queries:
+        for item in query.touched:
+            (count, seconds) = usage.get(item, (0, 0.0))
+            usage[item] = (count + query.count, seconds + query.totalTime)
+    print("Prelude symbols and axioms used:")
+    if not usage:
+        print("  none")
+    for (item, (count, seconds)) in sorted(usage.items(), key=lambda i: (i[1][1], i[1][0]), reverse=True):
+        print("  {:>9} {:>6}  {}".format(formatSeconds(seconds) if timed else "-", count, item))
+    print()
+
+
+def analyze(spec, stream, prelude, live):
+    specQueries = SpecQueries(spec, prelude, live)
+    for line in stream:
+        specQueries.feed(line)
+    specQueries.close()
+    return specQueries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze the Z3 queries in kprove --debug-z3-queries output.")
+    parser.add_argument("logs", nargs="*", help="kprove output files, one per spec; the standard input by default")
+    parser.add_argument("--spec", help="spec name, for the standard input or a single log file")
+    parser.add_argument("--smt-prelude", action="append", help="SMT prelude file (default: resources/evm.smt2)")
+    parser.add_argument("--top", type=int, default=10, help="number of queries listed")
+    parser.add_argument("--show", metavar="HASH", help="print the normalized query with this hash prefix")
+    args = parser.parse_args()
+
+    prelude = Prelude(args.smt_prelude or ([DEFAULT_PRELUDE] if os.path.exists(DEFAULT_PRELUDE) else []))
+    results = []
+    if not args.logs or args.logs == ["-"]:
+        live = not stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode)
+        results.append(analyze(args.spec or "-", sys.stdin, prelude, live))
+    else:
+        for log in args.logs:
+            spec = args.spec if args.spec and len(args.logs) == 1 else os.path.basename(log)
+            spec = spec[:-len(".log")] if spec.endswith(".log") else spec
+            with open(log, errors="replace") as stream:
+                results.append(analyze(spec, stream, prelude, False))
+
+    if args.show:
+        for specQueries in results:
+            for query in specQueries.queries.values():
+                if query.hash.startswith(args.show):
+                    print(query.text)
+                    return
+        sys.exit("No query with hash {}".format(args.show))
+    for specQueries in results:
+        report(specQueries, args.top)
+
+
+if __name__ == "__main__":
+    main()